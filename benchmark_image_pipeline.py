@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Image Pipeline Benchmark
+Feeds the sample frames in input_tensors/ (and combined_image_1.bmp) through a fake
+shared-memory mapping and times each stage of the uart_control image path:
+capture (get_pic_from_socket), composite, encode (save_image_with_target_size) and
+block splitting, for every TotalImageBlocks value in single and dual camera mode.
+
+Usage:
+    python benchmark_image_pipeline.py [--blocks 20-80] [--repeat 3] [--save-baseline bench/bench_baseline.json]
+
+The reference baseline in bench/bench_baseline.json was recorded with --repeat 3;
+compare with the same --repeat so the quality history warms up the same way.
+--compare refuses (exit code 2) when frames, size, codec or repeat differ from the
+baseline, and compares only the shared values when --blocks differs.
+Millisecond figures are machine-specific, so the tolerance only applies to timings
+against a baseline recorded on the same hardware; encodes/frame is portable.
+
+Example:
+    python benchmark_image_pipeline.py --repeat 3 --save-baseline bench/bench_baseline.json
+    python benchmark_image_pipeline.py --repeat 3 --compare bench/bench_baseline.json --tolerance 0.2
+"""
+
+import argparse
+import base64
+import glob
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import uart_control
+
+DEFAULT_FRAMES = ["input_tensors/*.bmp", "combined_image_1.bmp"]
+STAGES = ["capture", "composite", "encode", "split", "total"]
+COMPARE_KEYS = ["frames", "size", "codec", "repeat"]  # runs that differ in any of these are not compared
+TIMING_NOTE = ("Millisecond figures are machine-specific: compare timings only against a baseline "
+               "recorded on the same hardware. encodes/frame is machine-independent.")
+MODES = {"single": 1, "dual": 3}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    """p50/p95/p99/mean of a list of latencies in milliseconds"""
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "mean": round(sum(values) / len(values), 3) if values else 0.0
+    }
+
+
+def parse_block_range(text):
+    """Parse '20-80', '20-80:10' or '20,40,80' into a list of block counts"""
+    if "-" in text:
+        span, _, step = text.partition(":")
+        low, high = (int(x) for x in span.split("-"))
+        return list(range(low, high + 1, int(step) if step else 1))
+    return [int(x) for x in text.split(",")]
+
+
+def load_frames(patterns, size):
+    """Load frames as BGR byte strings of the same size (the layout written to shm)"""
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No frames found for {patterns}")
+
+    frames = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        if size is None:
+            size = image.size
+        if image.size != size:
+            image = image.resize(size)
+        frames.append(np.asarray(image)[..., ::-1].tobytes())
+    return paths, frames, size
+
+
+class FakeShm:
+    """Anonymous mmap standing in for a /xxx_imx501_bmp_shm segment"""
+
+    def __init__(self, frame_size):
+        self.mapping = mmap.mmap(-1, max(frame_size, mmap.PAGESIZE))
+
+    def write_frame(self, frame):
+        self.mapping.seek(0)
+        self.mapping.write(frame)
+
+
+def run_cycle(cam_in_use, timings):
+    """One ?OBdata image cycle, stage by stage. Returns (bytes, blocks, encodes)"""
+    start = time.perf_counter()
+    if cam_in_use == 1 or cam_in_use == 3:
+        uart_control.get_pic_from_socket(uart_control.cam1_image_shm_ptr, uart_control.CAM1_ID, cam_in_use)
+    if cam_in_use == 2 or cam_in_use == 3:
+        uart_control.get_pic_from_socket(uart_control.cam2_image_shm_ptr, uart_control.CAM2_ID, cam_in_use)
+    t_capture = time.perf_counter()
+
+    frame = uart_control.image_frames[cam_in_use]
+    crop_boxes = uart_control.get_roi_crop_boxes(cam_in_use)
+    if crop_boxes:
+        frame = uart_control.crop_frame_to_roi(frame, cam_in_use, crop_boxes)
+    image = Image.fromarray(frame)
+    t_composite = time.perf_counter()
+
+    image_data = uart_control.save_image_with_target_size(image, cam_in_use)
+    t_encode = time.perf_counter()
+
+    blocks = uart_control.ImageBlockSet(base64.b64encode(image_data), uart_control.send_max_length,
+                                        uart_control.image_encode_stats["last_codec"], crop_boxes)
+    end = time.perf_counter()
+
+    timings["capture"].append((t_capture - start) * 1000)
+    timings["composite"].append((t_composite - t_capture) * 1000)
+    timings["encode"].append((t_encode - t_composite) * 1000)
+    timings["split"].append((end - t_encode) * 1000)
+    timings["total"].append((end - start) * 1000)
+    return len(image_data), len(blocks), uart_control.image_encode_stats["last_encodes"]
+
+
+def run_benchmark(frames, size, block_values, repeat, codec):
+    """Run every (mode, TotalImageBlocks) combination and collect statistics"""
+    width, height = size
+    uart_control.IMAGE_WIDTH = width
+    uart_control.IMAGE_HEIGHT = height
+    if not uart_control.set_image_codec(codec):
+        raise ValueError(f"Unsupported codec: {codec}")
+
+    frame_size = width * height * uart_control.IMAGE_CHANNELS
+    left, right = FakeShm(frame_size), FakeShm(frame_size)
+    uart_control.cam1_image_shm_ptr = left.mapping
+    uart_control.cam2_image_shm_ptr = right.mapping
+
+    results = {}
+    for mode_name, cam_in_use in MODES.items():
+        mode_timings = {stage: [] for stage in STAGES}
+        per_blocks = {}
+        for blocks in block_values:
+            uart_control.max_image_blocks = blocks
+            timings = {stage: [] for stage in STAGES}
+            sizes, block_counts, encodes = [], [], []
+            for _ in range(repeat):
+                for index, frame in enumerate(frames):
+                    left.write_frame(frame)
+                    right.write_frame(frames[(index + 1) % len(frames)])
+                    image_bytes, block_count, encode_count = run_cycle(cam_in_use, timings)
+                    sizes.append(image_bytes)
+                    block_counts.append(block_count)
+                    encodes.append(encode_count)
+            for stage in STAGES:
+                mode_timings[stage].extend(timings[stage])
+            per_blocks[str(blocks)] = {
+                "total_ms": summarize(timings["total"]),
+                "encode_ms": summarize(timings["encode"]),
+                "encodes_per_frame": round(sum(encodes) / len(encodes), 3),
+                "max_encodes": max(encodes),
+                "bytes_per_frame": round(sum(sizes) / len(sizes), 1),
+                "blocks_per_frame": round(sum(block_counts) / len(block_counts), 2),
+                "over_budget": sum(1 for n in block_counts if n > blocks)
+            }
+        results[mode_name] = {
+            "stages_ms": {stage: summarize(mode_timings[stage]) for stage in STAGES},
+            "blocks": per_blocks
+        }
+    return results
+
+
+def print_report(results):
+    for mode_name, mode_result in results.items():
+        print(f"\n{'=' * 72}")
+        print(f"Mode: {mode_name}")
+        print(f"{'=' * 72}")
+        print(f"{'stage':<10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+        for stage, stats in mode_result["stages_ms"].items():
+            print(f"{stage:<10} {stats['p50']:>10.2f} {stats['p95']:>10.2f} {stats['p99']:>10.2f} {stats['mean']:>10.2f}")
+        print(f"\n{'blocks':>6} {'total p50':>10} {'total p95':>10} {'encodes':>8} {'max':>4} {'bytes':>9} {'used':>6} {'over':>5}")
+        for blocks, stats in mode_result["blocks"].items():
+            print(f"{blocks:>6} {stats['total_ms']['p50']:>10.2f} {stats['total_ms']['p95']:>10.2f} "
+                  f"{stats['encodes_per_frame']:>8.2f} {stats['max_encodes']:>4} {stats['bytes_per_frame']:>9.0f} "
+                  f"{stats['blocks_per_frame']:>6.1f} {stats['over_budget']:>5}")
+
+
+def baseline_mismatch(report, baseline):
+    """Return the settings that make the two runs incomparable (empty when comparable)"""
+    return [(key, baseline.get(key), report[key]) for key in COMPARE_KEYS if baseline.get(key) != report[key]]
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Print the change of the key metrics against a baseline, return the number of regressions.
+    Stage percentiles are only compared when both runs cover the same TotalImageBlocks values;
+    otherwise only the block values present in both runs are compared, block by block.
+    """
+    regressions = 0
+    print(f"\n{'=' * 72}")
+    print(f"Comparison with baseline (tolerance {tolerance * 100:.0f}%)")
+    print(f"{'=' * 72}")
+    for mode_name, mode_result in report["results"].items():
+        base_mode = baseline.get("results", {}).get(mode_name)
+        if not base_mode:
+            print(f"{mode_name}: not in baseline")
+            continue
+        shared = [blocks for blocks in mode_result["blocks"] if blocks in base_mode["blocks"]]
+        if not shared:
+            print(f"{mode_name}: no TotalImageBlocks values in common with the baseline")
+            continue
+        if len(shared) == len(mode_result["blocks"]) == len(base_mode["blocks"]):
+            checks = [(f"{stage} p95 ms", mode_result["stages_ms"][stage]["p95"], base_mode["stages_ms"][stage]["p95"])
+                      for stage in STAGES if stage in base_mode["stages_ms"]]
+        else:
+            print(f"{mode_name}: TotalImageBlocks differ from the baseline, comparing the {len(shared)} shared values only")
+            checks = []
+            for metric in ["total_ms", "encode_ms"]:
+                checks.append((f"{metric[:-3]} p95 ms (avg)",
+                               sum(mode_result["blocks"][b][metric]["p95"] for b in shared) / len(shared),
+                               sum(base_mode["blocks"][b][metric]["p95"] for b in shared) / len(shared)))
+        checks.append(("encodes/frame",
+                       sum(mode_result["blocks"][b]["encodes_per_frame"] for b in shared) / len(shared),
+                       sum(base_mode["blocks"][b]["encodes_per_frame"] for b in shared) / len(shared)))
+        for name, current, base in checks:
+            change = (current - base) / base if base else 0.0
+            flag = ""
+            if change > tolerance:
+                flag = "  <-- REGRESSION"
+                regressions += 1
+            print(f"{mode_name:<7} {name:<20} {base:>10.2f} -> {current:>10.2f} ({change * 100:+.1f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the uart_control image pipeline with sample frames",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark_image_pipeline.py
+  python benchmark_image_pipeline.py --blocks 20-80:10 --repeat 5
+  python benchmark_image_pipeline.py --repeat 3 --save-baseline bench/bench_baseline.json
+  python benchmark_image_pipeline.py --repeat 3 --compare bench/bench_baseline.json
+        """
+    )
+    parser.add_argument("--frames", nargs="+", default=DEFAULT_FRAMES, help="Frame files or glob patterns")
+    parser.add_argument("--size", default=None, help="Frame size WxH (default: size of the first frame)")
+    parser.add_argument("--blocks", default="20-80", help="TotalImageBlocks values: 20-80, 20-80:10 or 20,40,80")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the frame set per block value (default: 1)")
+    parser.add_argument("--codec", default="jpeg", help="Image codec (default: jpeg)")
+    parser.add_argument("--save-baseline", default=None, help="Write results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Compare results with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default: 0.2)")
+    args = parser.parse_args()
+
+    uart_control.logger.setLevel(logging.WARNING)
+    # 每帧都完整编码，不复用未变化的帧
+    uart_control.image_change_threshold = -1
+
+    size = tuple(int(x) for x in args.size.lower().split("x")) if args.size else None
+    paths, frames, size = load_frames(args.frames, size)
+    block_values = parse_block_range(args.blocks)
+    print(f"Frames: {len(frames)} ({size[0]}x{size[1]}), blocks: {block_values[0]}-{block_values[-1]} "
+          f"({len(block_values)} values), repeat: {args.repeat}, codec: {args.codec}")
+
+    start = time.time()
+    results = run_benchmark(frames, size, block_values, args.repeat, args.codec)
+    print_report(results)
+    print(f"\nElapsed: {time.time() - start:.1f} seconds")
+
+    report = {
+        "version": uart_control.VERSION,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "frames": paths,
+        "size": list(size),
+        "codec": args.codec,
+        "repeat": args.repeat,
+        "note": TIMING_NOTE,
+        "results": results
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        mismatch = baseline_mismatch(report, baseline)
+        if mismatch:
+            for key, base, current in mismatch:
+                print(f"Not comparable with {args.compare}: {key} differs (baseline {base}, current {current})")
+            sys.exit(2)
+        if compare_with_baseline(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
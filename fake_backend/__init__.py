@@ -0,0 +1,87 @@
+"""
+AglaiaSense 本地服务的替身，用于在普通 Linux 机器上运行和压测 uart_control：
+SDK JSON 服务(1880)、事件推送(到1780)、摄像头信息服务(10808/10809)、共享内存帧和 gs501.json
+
+用法：
+    python -m fake_backend --gs501 /tmp/fake_gs501.json
+    UART_CONTROL_GS501=/tmp/fake_gs501.json UART_CONTROL_PORT=/dev/pts/3 python uart_control.py
+或者在 uart_harness.py 中加 --backend 一起启动
+"""
+
+import json
+import logging
+import os
+
+from .camera_server import CAMERA1_PORT, CAMERA2_PORT, CameraInfoServer, default_drawing
+from .event_pusher import EVENT_SERVER_PORT, EventPusher
+from .sdk_server import SDK_JSON_PORT, FakeSdkServer, SdkState
+from .shm_producer import CAMERA1_SHM_BMP_NAME, CAMERA2_SHM_BMP_NAME, ShmProducer, load_frames
+
+logger = logging.getLogger("fake_backend")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GS501_TEMPLATE = os.path.join(REPO_DIR, "gs501-back.json")
+DEFAULT_FRAMES = [os.path.join(REPO_DIR, "input_tensors", "*.bmp")]
+
+
+def write_gs501(path, sensor_num="dual", width=None, height=None, template=GS501_TEMPLATE):
+    """以 gs501-back.json 为模板写出 gs501.json，返回 (宽, 高)"""
+    with open(template, "r", encoding="utf-8") as file:
+        config = json.load(file)
+    config["SensorNum"] = sensor_num
+    config["HWName"] = ""
+    if width:
+        config["InputTensorWidth"] = str(width)
+    if height:
+        config["InputTensorHeith"] = str(height)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=4)
+    return int(config["InputTensorWidth"]), int(config["InputTensorHeith"])
+
+
+class FakeBackend:
+    """按配置启动全部替身服务，stop() 停止并删除共享内存"""
+
+    def __init__(self, gs501_path, sensor_num="dual", size=None, frames=None, fps=1.0,
+                 sdk_latency=0.0, sdk_latency_by_cmd=None, sdk_keep_alive=False, camera_latency=0.0,
+                 event_rates=None, seed=None):
+        self.gs501_path = gs501_path
+        self.sensor_num = sensor_num
+        self.size = size
+        self.frame_patterns = frames or DEFAULT_FRAMES
+        self.fps = fps
+        self.cameras = {"left": ["left"], "right": ["right"]}.get(sensor_num, ["left", "right"])
+        self.events = EventPusher(port=EVENT_SERVER_PORT, rates=event_rates, cameras=self.cameras, seed=seed)
+        self.sdk = FakeSdkServer(port=SDK_JSON_PORT, default_latency=sdk_latency, latency=sdk_latency_by_cmd,
+                                 state=SdkState(), on_event_server=self.events.set_target,
+                                 on_camera_param=self.events.push_camera_param, keep_alive=sdk_keep_alive)
+        self.camera_latency = camera_latency
+        self.camera_servers = []
+        self.producers = []
+
+    def start(self):
+        width, height = write_gs501(self.gs501_path, self.sensor_num, *(self.size or (None, None)))
+        logger.info(f"gs501.json written to {self.gs501_path} ({width}x{height}, SensorNum={self.sensor_num})")
+        frames = load_frames(self.frame_patterns, width, height)
+        drawing = default_drawing()
+        if "left" in self.cameras:
+            self.camera_servers.append(CameraInfoServer(CAMERA1_PORT, drawing, self.camera_latency))
+            self.producers.append(ShmProducer(CAMERA1_SHM_BMP_NAME, frames, self.fps))
+        if "right" in self.cameras:
+            self.camera_servers.append(CameraInfoServer(CAMERA2_PORT, drawing, self.camera_latency))
+            self.producers.append(ShmProducer(CAMERA2_SHM_BMP_NAME, frames, self.fps, offset=len(frames) // 2))
+        for service in [self.sdk] + self.camera_servers + self.producers + [self.events]:
+            service.start()
+
+    def stop(self):
+        for service in [self.events, self.sdk] + self.camera_servers + self.producers:
+            service.stop()
+
+    def summary(self):
+        return {
+            "sdk_requests": dict(self.sdk.state.requests),
+            "sdk_connections": self.sdk.connections,
+            "events_sent": dict(self.events.sent),
+            "drawing_requests": sum(server.requests for server in self.camera_servers),
+            "frames_written": sum(producer.frames_written for producer in self.producers)
+        }
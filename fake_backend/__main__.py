@@ -0,0 +1,64 @@
+"""
+启动全部替身服务，Ctrl+C 停止
+    python -m fake_backend --gs501 /tmp/fake_gs501.json --sdk-latency 0.05 --speed-rate 5
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from . import FakeBackend
+
+
+def parse_latency(items):
+    """get_camera_param_req=0.3 形式的参数转为字典"""
+    latency = {}
+    for item in items:
+        cmd, _, value = item.partition("=")
+        latency[cmd] = float(value)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m fake_backend",
+                                     description="Fake AglaiaSense backend for running uart_control locally")
+    parser.add_argument("--gs501", default="/tmp/fake_gs501.json",
+                        help="Where to write gs501.json (pass it to uart_control as UART_CONTROL_GS501)")
+    parser.add_argument("--sensor", default="dual", choices=["left", "right", "dual"], help="SensorNum (default: dual)")
+    parser.add_argument("--size", default=None, help="Input tensor size WxH (default: from gs501-back.json)")
+    parser.add_argument("--frames", nargs="+", default=None, help="Frame files or glob patterns (default: input_tensors/*.bmp)")
+    parser.add_argument("--fps", type=float, default=1.0, help="Frames written to shared memory per second (default: 1)")
+    parser.add_argument("--sdk-latency", type=float, default=0.0, help="SDK response latency in seconds (default: 0)")
+    parser.add_argument("--sdk-latency-for", action="append", default=[], metavar="CMD=SECONDS",
+                        help="Per-command SDK latency, e.g. get_camera_param_req=0.3 (repeatable)")
+    parser.add_argument("--sdk-keepalive", action="store_true",
+                        help="Serve several requests per SDK connection instead of closing after each reply")
+    parser.add_argument("--camera-latency", type=float, default=0.0, help="drawing response latency in seconds (default: 0)")
+    parser.add_argument("--count-rate", type=float, default=1.0, help="TRFFCCNT events per second per camera (default: 1)")
+    parser.add_argument("--speed-rate", type=float, default=2.0, help="TRFFSPED events per second per camera (default: 2)")
+    parser.add_argument("--alert-rate", type=float, default=0.0, help="ASSETMNT events per second per camera (default: 0)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for generated events")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s]: %(message)s")
+    size = tuple(int(x) for x in args.size.lower().split("x")) if args.size else None
+    backend = FakeBackend(args.gs501, sensor_num=args.sensor, size=size, frames=args.frames, fps=args.fps,
+                          sdk_latency=args.sdk_latency, sdk_latency_by_cmd=parse_latency(args.sdk_latency_for),
+                          sdk_keep_alive=args.sdk_keepalive, camera_latency=args.camera_latency,
+                          event_rates={"TRFFCCNT": args.count_rate, "TRFFSPED": args.speed_rate, "ASSETMNT": args.alert_rate},
+                          seed=args.seed)
+    backend.start()
+    print(f"Fake backend running. Start uart_control with UART_CONTROL_GS501={args.gs501}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        backend.stop()
+        print(json.dumps(backend.summary(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
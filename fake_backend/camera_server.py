@@ -0,0 +1,92 @@
+"""
+模拟摄像头信息服务（左 10808，右 10809）
+uart_control 保持一个长连接，发送 {"cmd": "drawing"} 后读取一次应答（最多 4096 字节）
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger("fake_backend")
+
+CAMERA1_PORT = 10808
+CAMERA2_PORT = 10809
+DRAWING_CANVAS_SIZE = (480, 480)  # drawing 坐标按 ImageSize 画布给出，与输入张量尺寸无关
+
+
+def default_drawing(width=DRAWING_CANVAS_SIZE[0], height=DRAWING_CANVAS_SIZE[1]):
+    """两条计数线和一个区域，坐标在 ImageSize 画布范围内"""
+    return {
+        "ImageSize": f"{width}*{height}",
+        "categories": {"line_categories": ["car-truck-bus", "pedestrian-cycle"]},
+        "coordinates": {
+            "line_1": [{"x": width * 0.1, "y": height * 0.6}, {"x": width * 0.9, "y": height * 0.6}],
+            "line_2": [{"x": width * 0.2, "y": height * 0.8}, {"x": width * 0.8, "y": height * 0.8}],
+            "area_1": [{"x": width * 0.3, "y": height * 0.3}, {"x": width * 0.7, "y": height * 0.3},
+                       {"x": width * 0.7, "y": height * 0.5}, {"x": width * 0.3, "y": height * 0.5}]
+        }
+    }
+
+
+class CameraInfoServer:
+    """应答 drawing 请求，latency 为应答延迟(秒)"""
+
+    def __init__(self, port, drawing, latency=0.0):
+        self.port = port
+        self.drawing = drawing
+        self.latency = latency
+        self.requests = 0
+        self.server_socket = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(("127.0.0.1", self.port))
+        self.server_socket.listen(2)
+        threading.Thread(target=self.accept_loop, name=f"fake_camera_{self.port}", daemon=True).start()
+        logger.info(f"Fake camera info server listening on 127.0.0.1:{self.port}")
+
+    def stop(self):
+        if self.server_socket:
+            self.server_socket.close()
+
+    def accept_loop(self):
+        while True:
+            try:
+                client, _ = self.server_socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def serve(self, client):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        with client:
+            while True:
+                try:
+                    chunk = client.recv(4096)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                buffer += chunk.decode("utf-8", "ignore")
+                # 一次可能收到多个请求
+                while buffer.strip():
+                    try:
+                        request, end = decoder.raw_decode(buffer.lstrip())
+                    except ValueError:
+                        break
+                    buffer = buffer.lstrip()[end:]
+                    self.requests += 1
+                    if self.latency:
+                        time.sleep(self.latency)
+                    if request.get("cmd") == "drawing":
+                        response = self.drawing
+                    else:
+                        response = {}
+                    try:
+                        client.sendall(json.dumps(response).encode("utf-8"))
+                    except OSError:
+                        return
@@ -0,0 +1,113 @@
+"""
+模拟 SDK 事件推送（推送到 uart_control 的事件服务器，默认端口 1780）
+每条事件为一行 JSON，按设定的速率推送 TRFFCCNT（累计计数）、TRFFSPED（速度）和 ASSETMNT（报警）
+"""
+
+import json
+import logging
+import random
+import socket
+import threading
+import time
+
+logger = logging.getLogger("fake_backend")
+
+EVENT_SERVER_PORT = 1780
+VEHICLE_CLASSES = ["car", "truck", "bus", "pedestrian", "cycle"]
+BOUNDARIES = ["boundary_1_in", "boundary_1_out", "boundary_2_in", "boundary_2_out"]
+
+
+class EventPusher:
+    """
+    rates 为各事件每秒推送的次数，0 表示不推送，如 {"TRFFCCNT": 1, "TRFFSPED": 5, "ASSETMNT": 0.01}
+    连接断开或 uart_control 尚未启动时每秒重连一次
+    """
+
+    def __init__(self, host="127.0.0.1", port=EVENT_SERVER_PORT, rates=None, cameras=("left", "right"), seed=None):
+        self.host = host
+        self.port = port
+        self.rates = dict({"TRFFCCNT": 1.0, "TRFFSPED": 2.0, "ASSETMNT": 0.0}, **(rates or {}))
+        self.cameras = list(cameras)
+        self.random = random.Random(seed)
+        self.counts = {camera: {boundary: {vehicle: 0 for vehicle in VEHICLE_CLASSES} for boundary in BOUNDARIES}
+                       for camera in self.cameras}
+        self.sent = {event_type: 0 for event_type in self.rates}
+        self.stop_event = threading.Event()
+        self.send_lock = threading.Lock()  # 推送线程和 push_camera_param 共用连接
+        self.sock = None
+
+    def set_target(self, host, port):
+        """SDK 收到 set_event_server_info_req 后改为推送到新地址"""
+        if (host, port) != (self.host, self.port):
+            logger.info(f"Event pusher target changed to {host}:{port}")
+            self.host, self.port = host, port
+            self.close()
+
+    def start(self):
+        threading.Thread(target=self.run, name="fake_events", daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.close()
+
+    def close(self):
+        sock, self.sock = self.sock, None
+        if sock:
+            sock.close()
+
+    def run(self):
+        # 各事件下一次推送的时间
+        now = time.time()
+        due = {event_type: now for event_type, rate in self.rates.items() if rate > 0}
+        while not self.stop_event.is_set():
+            if not due:
+                self.stop_event.wait(1)
+                continue
+            event_type = min(due, key=due.get)
+            delay = due[event_type] - time.time()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            due[event_type] += 1.0 / self.rates[event_type]
+            for camera in self.cameras:
+                self.push(self.build_event(event_type, camera))
+
+    def push_camera_param(self, camera):
+        """推送摄像头参数变化通知"""
+        self.push({"event_type": "camera_param", "camera_id": camera, "timestamp": time.time()})
+
+    def push(self, message):
+        with self.send_lock:
+            self.send(message)
+
+    def send(self, message):
+        if self.sock is None:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=2)
+                logger.info(f"Event pusher connected to {self.host}:{self.port}")
+            except OSError:
+                self.stop_event.wait(1)
+                return
+        try:
+            self.sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            self.sent[message["event_type"]] = self.sent.get(message["event_type"], 0) + 1
+        except OSError as e:
+            logger.warning(f"Event push failed: {e}")
+            self.close()
+
+    def build_event(self, event_type, camera):
+        if event_type == "TRFFCCNT":
+            # 计数为累计值，uart_control 按周期相减
+            for boundary in self.counts[camera].values():
+                for vehicle in boundary:
+                    boundary[vehicle] += self.random.randint(0, 3)
+            outputs = [{"counting_results": {boundary: dict(counts) for boundary, counts in self.counts[camera].items()}}]
+        elif event_type == "TRFFSPED":
+            shapes = [{"label": boundary,
+                       "counters": [{"class": vehicle, "speed": round(self.random.uniform(5, 80), 1)}
+                                    for vehicle in self.random.sample(VEHICLE_CLASSES, 2)]}
+                      for boundary in BOUNDARIES]
+            outputs = [{"speed_event": {"event": {"shapes": shapes}}}]
+        else:
+            outputs = [{"alert": {"type": "pedestrian", "score": round(self.random.uniform(0.5, 1), 2)}}]
+        return {"event_type": event_type, "camera_id": camera, "timestamp": time.time(),
+                "cds_data": {"outputs": outputs}}
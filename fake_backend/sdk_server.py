@@ -0,0 +1,169 @@
+"""
+模拟 SDK JSON 服务（端口 1880）
+默认与真实 SDK 一样，每个请求一个 TCP 连接：客户端发送一个 JSON 对象，服务端应答后关闭连接
+keep_alive=True 时同一连接上可连续发送多个请求，用于对比 uart_control 长连接客户端的效果
+"""
+
+import json
+import logging
+import socket
+import socketserver
+import threading
+import time
+
+logger = logging.getLogger("fake_backend")
+
+SDK_JSON_PORT = 1880
+
+
+class SdkState:
+    """SDK 维护的设备状态，可在测试中直接修改"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token = "fake-sdk-token"
+        self.hardware = {"wifi": "enabled", "lte": "enabled"}
+        self.camera_params = {
+            "left": {"gain": 1, "exposure": 1120, "ae_mode": "auto", "framerate": 30},
+            "right": {"gain": 1, "exposure": 1120, "ae_mode": "auto", "framerate": 30}
+        }
+        self.wifi_password = ""
+        self.event_server = None  # set_event_server_info_req 设置的 (ip, port)
+        self.requests = {}  # 命令 -> 收到的次数
+
+
+class FakeSdkServer:
+    """
+    应答 user_login_req/get_camera_param_req/get_hardware_status_req 等请求，
+    latency 为各命令的应答延迟(秒)，未列出的命令使用 default_latency
+    """
+
+    def __init__(self, port=SDK_JSON_PORT, default_latency=0.0, latency=None, state=None,
+                 on_event_server=None, on_camera_param=None, keep_alive=False):
+        self.port = port
+        self.keep_alive = keep_alive
+        self.connections = 0
+        self.open_sockets = set()
+        self.default_latency = default_latency
+        self.latency = dict(latency or {})
+        self.state = state or SdkState()
+        self.on_event_server = on_event_server  # 收到 set_event_server_info_req 时回调 (ip, port)
+        self.on_camera_param = on_camera_param  # 摄像头参数变化时回调 (camera_id)
+        self.server = None
+
+    def start(self):
+        owner = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                owner.handle_connection(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake_sdk", daemon=True).start()
+        logger.info(f"Fake SDK listening on 127.0.0.1:{self.port}")
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        # 像 SDK 重启一样断开仍在使用的长连接
+        for sock in list(self.open_sockets):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def set_camera_param(self, camera_id, **params):
+        """测试用：修改摄像头参数（如 gain=2），并像 SDK 一样推送 camera_param 事件"""
+        with self.state.lock:
+            self.state.camera_params[camera_id].update(params)
+        if self.on_camera_param:
+            self.on_camera_param(camera_id)
+
+    def handle_connection(self, sock):
+        # 按 JSON 对象边界读取请求（客户端发送后不关闭写端）
+        decoder = json.JSONDecoder()
+        buffer = ""
+        self.connections += 1
+        self.open_sockets.add(sock)
+        sock.settimeout(None if self.keep_alive else 10)
+        try:
+            while True:
+                try:
+                    request, end = decoder.raw_decode(buffer.lstrip())
+                except ValueError:
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        return
+                    buffer += chunk.decode("utf-8")
+                    continue
+                buffer = buffer.lstrip()[end:]
+                cmd = request.get("cmd", "")
+                delay = self.latency.get(cmd, self.default_latency)
+                if delay:
+                    time.sleep(delay)
+                response = self.handle_request(request)
+                sock.sendall(json.dumps(response).encode("utf-8"))
+                if not self.keep_alive:
+                    return
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning(f"Fake SDK connection error: {e}")
+        finally:
+            self.open_sockets.discard(sock)
+
+    def handle_request(self, request):
+        state = self.state
+        cmd = request.get("cmd", "")
+        rsp = cmd[:-4] + "_rsp" if cmd.endswith("_req") else cmd
+        with state.lock:
+            state.requests[cmd] = state.requests.get(cmd, 0) + 1
+
+            if cmd == "user_login_req":
+                return {"cmd": rsp, "ret_code": 0, "token": state.token}
+            if cmd in ("user_logout_req", "heartbeat_req"):
+                return {"cmd": rsp, "ret_code": 0}
+            if cmd == "set_event_server_info_req":
+                state.event_server = (request.get("server_ip"), request.get("server_port"))
+                if self.on_event_server:
+                    self.on_event_server(*state.event_server)
+                return {"cmd": rsp, "ret_code": 0}
+            if cmd == "get_camera_param_req":
+                params = state.camera_params.get(request.get("camera_id"))
+                if params is None:
+                    return {"cmd": rsp, "ret_code": -1, "error": "invalid camera_id"}
+                return dict({"cmd": rsp, "ret_code": 0, "camera_id": request.get("camera_id")}, **params)
+            if cmd == "get_hardware_status_req":
+                modules = request.get("modules") or list(state.hardware)
+                response = {"cmd": rsp, "ret_code": 0}
+                for module in modules:
+                    if module in state.hardware:
+                        response[f"{module}_status"] = state.hardware[module]
+                return response
+            if cmd == "set_hardware_status_req":
+                module, status = request.get("module"), request.get("status")
+                if module not in state.hardware or status not in ("open", "close"):
+                    return {"cmd": rsp, "ret_code": -1, "error": "invalid parameter"}
+                state.hardware[module] = "enabled" if status == "open" else "disabled"
+                return {"cmd": rsp, "ret_code": 0}
+            if cmd == "set_wifi_password_req":
+                state.wifi_password = request.get("password", "")
+                return {"cmd": rsp, "ret_code": 0}
+
+        logger.warning(f"Fake SDK: unsupported command {cmd}")
+        return {"cmd": rsp, "ret_code": -1, "error": "unsupported command"}
+
+
+def send_request(request, port=SDK_JSON_PORT):
+    """测试用：按 uart_control 的方式发送一个请求"""
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(json.dumps(request).encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        data = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data.decode("utf-8"))
@@ -0,0 +1,79 @@
+"""
+模拟摄像头共享内存（/left_imx501_bmp_shm、/right_imx501_bmp_shm）
+把 input_tensors/ 中的图片按输入张量尺寸转换为 BGR，按帧率循环写入共享内存起始处
+"""
+
+import glob
+import logging
+import mmap
+import threading
+
+import numpy as np
+import posix_ipc
+from PIL import Image
+
+logger = logging.getLogger("fake_backend")
+
+CAMERA1_SHM_BMP_NAME = "/left_imx501_bmp_shm"
+CAMERA2_SHM_BMP_NAME = "/right_imx501_bmp_shm"
+SHM_BMP_SIZE = 36936000  # 与 uart_control.SHM_BMP_SIZE 一致，uart_control 按该大小映射
+
+
+def load_frames(patterns, width, height):
+    """读取图片并转换为共享内存中的 BGR 字节串"""
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No frames found for {patterns}")
+    frames = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        if image.size != (width, height):
+            image = image.resize((width, height))
+        frames.append(np.asarray(image)[..., ::-1].tobytes())
+    return frames
+
+
+class ShmProducer:
+    """创建共享内存段并按 fps 循环写入帧，offset 用于左右摄像头错开起始帧"""
+
+    def __init__(self, name, frames, fps=1.0, offset=0):
+        self.name = name
+        self.frames = frames
+        self.fps = fps
+        self.index = offset
+        self.frames_written = 0
+        self.stop_event = threading.Event()
+        self.shm = None
+        self.mapping = None
+
+    def start(self):
+        self.shm = posix_ipc.SharedMemory(self.name, posix_ipc.O_CREAT, size=SHM_BMP_SIZE)
+        self.mapping = mmap.mmap(self.shm.fd, SHM_BMP_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.write_next()
+        if self.fps > 0 and len(self.frames) > 1:
+            threading.Thread(target=self.run, name=f"fake_shm{self.name}", daemon=True).start()
+        logger.info(f"Shared memory {self.name} ready, {len(self.frames)} frames at {self.fps} fps")
+
+    def run(self):
+        while not self.stop_event.wait(1.0 / self.fps):
+            self.write_next()
+
+    def write_next(self):
+        frame = self.frames[self.index % len(self.frames)]
+        self.mapping[:len(frame)] = frame
+        self.index += 1
+        self.frames_written += 1
+
+    def stop(self, unlink=True):
+        self.stop_event.set()
+        if self.mapping:
+            self.mapping.close()
+        if self.shm:
+            self.shm.close_fd()
+            if unlink:
+                try:
+                    self.shm.unlink()
+                except posix_ipc.ExistentialError:
+                    pass
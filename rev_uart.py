@@ -4,9 +4,18 @@ import json
 import re
 import serial
 import time
+import zlib
 
 TEST_RUN_COUNT = 1
 send_max_length = 980
+NEGOTIATE_BAUDRATE = True  # 启动时协商双方都支持的最高波特率
+MAX_BAUDRATE = 921600  # 协商的波特率上限，USB转串口不稳定时调低
+USE_RTSCTS = False  # 高波特率下启用RTS/CTS硬件流控（需连接RTS/CTS线）
+SUPPORTED_BAUDRATES = [38400, 57600, 115200, 230400, 460800, 921600]
+BAUD_CONFIRM_TIMEOUT = 2.0
+COMPRESSION_MODE = ""  # 响应压缩: "" 不压缩, "deflate", "zdict"(预设字典，压缩率最高)
+USE_BLOCK_RANGE = True  # True: ?PSR| 一次请求连续接收全部图像块（无应答时改为逐块请求），False: 逐块 ?PSxx 请求
+BLOCK_RANGE_REPLY_TIMEOUT = 3.0  # ?PSR| 在该时间内没有任何应答时视为设备不支持
 # max_image_blocks = 80  # 预设最大值，实际以空块判断为准
 
 class UART:
@@ -32,6 +41,93 @@ class UART:
         rcvdata = self.uartport.readline()
         return rcvdata
 
+    def enable_compression(self, mode):
+        # zdict 模式先从设备获取预设字典
+        if mode == "zdict":
+            response = self.query_json("COMP|dict")
+            if not response or "CompressionDict" not in response:
+                print("设备不支持响应压缩")
+                return
+            self.compression_dict = base64.b64decode(response["CompressionDict"])
+        response = self.query_json(f"COMP|{mode}")
+        if response and response.get("Compression") == mode:
+            print("响应压缩已开启: {0}".format(mode))
+        else:
+            print("响应压缩开启失败")
+
+    def expand_response(self, response_str):
+        # 展开压缩信封 {"Z": 模式, "P": "Base64"}，普通响应原样返回
+        if not response_str.startswith('{"Z":'):
+            return response_str
+        try:
+            envelope = json.loads(response_str)
+            packed = base64.b64decode(envelope["P"])
+            if envelope["Z"] == 2:
+                data = zlib.decompressobj(zdict=self.compression_dict).decompress(packed)
+            else:
+                data = zlib.decompress(packed, -15)
+            return data.decode("utf_8")
+        except (ValueError, KeyError, AttributeError, zlib.error) as e:
+            print(f"Failed to expand compressed response: {e}")
+            return response_str
+
+    def switch_baudrate(self, baudrate, rtscts=False):
+        self.uartport.flush()
+        self.uartport.baudrate = baudrate
+        self.uartport.rtscts = rtscts
+        self.uartport.reset_input_buffer()
+
+    def query_json(self, cmd, timeout=1.0):
+        # 发送命令并在超时内等待一行JSON响应
+        self.send_serial(cmd)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = self.receive_serial()
+            if response:
+                try:
+                    return json.loads(response.decode("utf_8", "ignore"))
+                except json.JSONDecodeError:
+                    pass
+        return None
+
+    def try_baudrate(self, baudrate, rtscts=False):
+        # BAUD|<rate> 握手：设备应答后切换，在新波特率下发送 BAUDACK| 直到收到确认
+        old_baudrate, old_rtscts = self.uartport.baudrate, self.uartport.rtscts
+        response = self.query_json(f"BAUD|{baudrate},{int(rtscts)}")
+        if not response or response.get("Baudrate") != baudrate or "Error" in response:
+            return False
+        self.switch_baudrate(baudrate, rtscts)
+        deadline = time.time() + BAUD_CONFIRM_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            response = self.query_json(f"BAUDACK|{baudrate}", timeout=0.3)
+            if response and response.get("BaudrateConfirmed") == baudrate:
+                return True
+        # 未收到确认：等设备超时恢复后确认它实际所在的波特率
+        self.switch_baudrate(old_baudrate, old_rtscts)
+        time.sleep(BAUD_CONFIRM_TIMEOUT)
+        if self.query_json("BAUD|"):
+            return False
+        self.switch_baudrate(baudrate, rtscts)
+        if self.query_json("BAUD|"):
+            return True
+        self.switch_baudrate(old_baudrate, old_rtscts)
+        return False
+
+    def negotiate_baudrate(self, max_baudrate, rtscts=False):
+        response = self.query_json("BAUD|")
+        if not response or "Supported" not in response:
+            print("设备不支持波特率协商，保持 {0}".format(self.uartport.baudrate))
+            return
+        candidates = sorted((rate for rate in response["Supported"]
+                             if rate in SUPPORTED_BAUDRATES and self.uartport.baudrate < rate <= max_baudrate),
+                            reverse=True)
+        for rate in candidates:
+            if self.try_baudrate(rate, rtscts):
+                print("波特率协商成功: {0}".format(rate))
+                return
+        print("波特率协商失败，保持 {0}".format(self.uartport.baudrate))
+
 def append_response_to_file(command, response):
     filename = "recv_test.json"
     try:
@@ -52,11 +148,21 @@ def append_response_to_file(command, response):
         json.dump(data, file, indent=4)
     print(f"Appended response to {filename}")
 
-def save_image(image_data, filename):
+def detect_image_format(image_binary):
+    # 按文件头判断图像格式（逐块 ?PSxx 接收时没有汇总行告知格式）
+    if image_binary[:4] == b"RIFF" and image_binary[8:12] == b"WEBP":
+        return "webp"
+    return "jpeg"
+
+def save_image(image_data, basename, image_format=None):
+    # image_format 为 ?PSR| 汇总行中的 Format，没有时按文件头判断，决定文件扩展名
     image_binary = base64.b64decode(image_data)
+    image_format = image_format or detect_image_format(image_binary)
+    extension = {"jpeg": "jpg"}.get(image_format, image_format)
+    filename = f"{basename}.{extension}"
     with open(filename, 'wb') as f:
         f.write(image_binary)
-    print(f"Saved image to {filename}")
+    print(f"Saved {image_format} image to {filename}")
 
 def fix_base64_padding(data):
     missing_padding = len(data) % 4
@@ -74,6 +180,43 @@ def extract_base64_data(response_str):
         print("Error decoding JSON:", response_str)
     return None
 
+def fetch_image_range(uart, first=5, last=84):
+    # 发送 ?PSR|first-last，接收连续的图像块直到汇总行，并用汇总行中的CRC32校验整幅图像
+    # 返回 (图像块列表, 汇总行中的图像格式)；设备没有应答（旧固件不支持 ?PSR|）时返回 None，由调用方改用逐块 ?PSxx 请求
+    blocks = []
+    start_time = time.time()
+    uart.send_serial(f"?PSR|{first}-{last}")
+    deadline = time.time() + 30
+    received = False
+    while time.time() < deadline:
+        response = uart.receive_serial()
+        if not response:
+            if not received and time.time() - start_time > BLOCK_RANGE_REPLY_TIMEOUT:
+                print(f"?PSR| {BLOCK_RANGE_REPLY_TIMEOUT}秒内无应答，改用逐块 ?PSxx 请求")
+                return None
+            continue
+        received = True
+        response_str = uart.expand_response(response.decode("utf_8", "ignore").rstrip())
+        try:
+            data = json.loads(response_str)
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON for ?PSR|: {response_str[:80]}")
+            continue
+        if "BlockRange" in data:
+            print(time.strftime("%B-%d-%Y %H:%M:%S") + "  <-: {0}".format(response_str))
+            image_crc = format(zlib.crc32(base64.b64decode(fix_base64_padding("".join(blocks)))) & 0xffffffff, "08x")
+            if len(blocks) != data.get("Blocks") or (data.get("CRC32") and image_crc != data["CRC32"]):
+                print(f"图像块校验失败: 收到 {len(blocks)} 块, CRC32 {image_crc}")
+            else:
+                print(f"图像块接收完成: {len(blocks)} 块，耗时 {time.time() - start_time:.2f}秒，CRC32 {image_crc}")
+            append_response_to_file(f"?PSR|{first}-{last}", data)
+            return blocks, data.get("Format")
+        for key, value in data.items():
+            if key.startswith("Block"):
+                blocks.append(value)
+    print("未收到 ?PSR| 汇总行")
+    return blocks, None
+
 if __name__ == '__main__':
     # Delete recv_test.json file if it exists
     if os.path.exists("recv_test.json"):
@@ -104,10 +247,15 @@ if __name__ == '__main__':
     ]
 
     uart = UART()
+    if NEGOTIATE_BAUDRATE:
+        uart.negotiate_baudrate(MAX_BAUDRATE, USE_RTSCTS)
+    if COMPRESSION_MODE:
+        uart.enable_compression(COMPRESSION_MODE)
 
     for run in range(TEST_RUN_COUNT):
         print(f"Running test iteration {run + 1}/{TEST_RUN_COUNT}")
         image_data_list = []
+        image_format = None  # ?PSR| 汇总行中的图像格式
 
         for command in commands:
             uart.send_serial(command)
@@ -115,7 +263,7 @@ if __name__ == '__main__':
             while True:
                 response = uart.receive_serial()
                 if response:
-                    response_str = response.decode("utf_8", "ignore").rstrip()
+                    response_str = uart.expand_response(response.decode("utf_8", "ignore").rstrip())
                     print(time.strftime("%B-%d-%Y %H:%M:%S") + "  <-: {0}".format(response_str))
 
                     if response_str.startswith('{"Block'):
@@ -134,68 +282,74 @@ if __name__ == '__main__':
                 else:
                     break
 
-        # 动态请求图像块（?PS5 开始），直到收到空块
-        print("开始动态请求图像块...")
-        image_block_start_time = time.time()
-        total_sleep_time = 0  # 累计 sleep 时间
-        ps_index = 5
-        max_attempts = 100  # 安全上限，防止无限循环
-        while ps_index < max_attempts:
-            command = f"?PS{ps_index}"
-            uart.send_serial(command)
-            sleep_duration = 0.5
-            time.sleep(sleep_duration)
-            total_sleep_time += sleep_duration
+        # 一次 ?PSR| 请求连续接收全部图像块，设备无应答时改为逐块请求
+        range_result = fetch_image_range(uart) if USE_BLOCK_RANGE else None
+        if range_result is not None:
+            range_blocks, image_format = range_result
+            image_data_list.extend(range_blocks)
+        else:
+            # 动态请求图像块（?PS5 开始），直到收到空块
+            print("开始动态请求图像块...")
+            image_block_start_time = time.time()
+            total_sleep_time = 0  # 累计 sleep 时间
+            ps_index = 5
+            max_attempts = 100  # 安全上限，防止无限循环
+            while ps_index < max_attempts:
+                command = f"?PS{ps_index}"
+                uart.send_serial(command)
+                sleep_duration = 0.5
+                time.sleep(sleep_duration)
+                total_sleep_time += sleep_duration
 
-            response_received = False
-            while True:
-                response = uart.receive_serial()
-                if response:
-                    response_str = response.decode("utf_8", "ignore").rstrip()
-                    print(time.strftime("%B-%d-%Y %H:%M:%S") + "  <-: {0}".format(response_str))
-                    response_received = True
+                response_received = False
+                while True:
+                    response = uart.receive_serial()
+                    if response:
+                        response_str = uart.expand_response(response.decode("utf_8", "ignore").rstrip())
+                        print(time.strftime("%B-%d-%Y %H:%M:%S") + "  <-: {0}".format(response_str))
+                        response_received = True
 
-                    if response_str.startswith('{"Block'):
-                        try:
-                            json_data = json.loads(response_str)
-                            block_key = f"Block{ps_index - 4}"
-
-                            # 检查是否是空块
-                            if block_key in json_data:
-                                if json_data[block_key] == "":
-                                    image_block_end_time = time.time()
-                                    total_elapsed = image_block_end_time - image_block_start_time
-                                    actual_processing_time = total_elapsed - total_sleep_time
-                                    print(f"收到空块 {block_key}，图像读取完成，共接收 {ps_index - 5} 个图像块")
-                                    print(f"图像块接收统计：总耗时 {total_elapsed:.2f}秒，纯处理时间 {actual_processing_time:.2f}秒")
-                                    ps_index = max_attempts  # 退出外层循环
-                                    break
-                                else:
-                                    # 有数据，添加到列表
-                                    image_data_list.append(json_data[block_key])
-                                    append_response_to_file(command, {"image_data_received": True})
-                                    ps_index += 1
-                                    break
-                        except json.JSONDecodeError:
-                            print(f"Failed to decode JSON for {command}")
+                        if response_str.startswith('{"Block'):
+                            try:
+                                json_data = json.loads(response_str)
+                                block_key = f"Block{ps_index - 4}"
+
+                                # 检查是否是空块
+                                if block_key in json_data:
+                                    if json_data[block_key] == "":
+                                        image_block_end_time = time.time()
+                                        total_elapsed = image_block_end_time - image_block_start_time
+                                        actual_processing_time = total_elapsed - total_sleep_time
+                                        print(f"收到空块 {block_key}，图像读取完成，共接收 {ps_index - 5} 个图像块")
+                                        print(f"图像块接收统计：总耗时 {total_elapsed:.2f}秒，纯处理时间 {actual_processing_time:.2f}秒")
+                                        ps_index = max_attempts  # 退出外层循环
+                                        break
+                                    else:
+                                        # 有数据，添加到列表
+                                        image_data_list.append(json_data[block_key])
+                                        append_response_to_file(command, {"image_data_received": True})
+                                        ps_index += 1
+                                        break
+                            except json.JSONDecodeError:
+                                print(f"Failed to decode JSON for {command}")
+                                break
+                        else:
                             break
                     else:
                         break
-                else:
-                    break
 
-            # 如果没有收到响应，停止请求
-            if not response_received:
-                image_block_end_time = time.time()
-                total_elapsed = image_block_end_time - image_block_start_time
-                actual_processing_time = total_elapsed - total_sleep_time
-                print(f"未收到 {command} 的响应，停止请求")
-                print(f"图像块接收统计：总耗时 {total_elapsed:.2f}秒，纯处理时间 {actual_processing_time:.2f}秒")
-                break
+                # 如果没有收到响应，停止请求
+                if not response_received:
+                    image_block_end_time = time.time()
+                    total_elapsed = image_block_end_time - image_block_start_time
+                    actual_processing_time = total_elapsed - total_sleep_time
+                    print(f"未收到 {command} 的响应，停止请求")
+                    print(f"图像块接收统计：总耗时 {total_elapsed:.2f}秒，纯处理时间 {actual_processing_time:.2f}秒")
+                    break
 
         if image_data_list:
             combined_image_data = ''.join(image_data_list)
             combined_image_data = fix_base64_padding(combined_image_data)
-            save_image(combined_image_data, f"combined_image_{run + 1}.jpg")
+            save_image(combined_image_data, f"combined_image_{run + 1}", image_format)
 
         time.sleep(1)
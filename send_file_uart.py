@@ -4,7 +4,7 @@ UART File Transfer Tool - Sender Side
 Sends files (typically ZIP archives) to a device via UART with CRC32 and MD5 verification.
 
 Usage:
-    python send_file_uart.py <file_path> [--port COM3] [--baudrate 38400]
+    python send_file_uart.py <file_path> [--port COM3] [--baudrate 38400] [--max-baudrate 921600]
 
 Example:
     python send_file_uart.py firmware.zip --port COM3
@@ -21,21 +21,77 @@ import sys
 import os
 from pathlib import Path
 import argparse
+import struct
 
 # Configuration
 BLOCK_SIZE = 650  # Bytes per block (before Base64 encoding, ~867 after, ensures JSON < 1000 bytes)
 MAX_RETRIES = 3  # Maximum retries per block
 TIMEOUT_SECONDS = 5  # Response timeout
 CONSECUTIVE_ERRORS_LIMIT = 5  # Abort if this many consecutive errors
+SUPPORTED_BAUDRATES = [38400, 57600, 115200, 230400, 460800, 921600]  # Rates this tool can negotiate
+BAUD_CONFIRM_TIMEOUT = 2.0  # Must match the device's BAUDACK wait
+
+# Binary framing: COBS(type(1) + body + CRC32(4, big-endian)) + 0x00
+BINARY_BLOCK_SIZE = 2048  # Raw bytes per file block in binary mode (device accepts frames up to 4096 bytes)
+FRAME_DELIMITER = b"\x00"
+FRAME_TYPE_TEXT = 0x01
+FRAME_TYPE_FILE_BLOCK = 0x03
+
+
+def cobs_encode(data):
+    """COBS encode, the output contains no 0x00 bytes"""
+    out = bytearray()
+    for segment in bytes(data).split(b"\x00"):
+        while len(segment) >= 254:
+            out.append(0xFF)
+            out += segment[:254]
+            segment = segment[254:]
+        out.append(len(segment) + 1)
+        out += segment
+    return bytes(out)
+
+
+def cobs_decode(data):
+    """COBS decode, raises ValueError on malformed input"""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code == 0 or i + code > len(data):
+            raise ValueError("invalid COBS data")
+        out += data[i + 1:i + code]
+        i += code
+        if code < 0xFF and i < len(data):
+            out.append(0)
+    return bytes(out)
+
+
+def build_frame(frame_type, body):
+    """Build a complete binary frame including the trailing delimiter"""
+    payload = bytes([frame_type]) + bytes(body)
+    return cobs_encode(payload + struct.pack(">I", zlib.crc32(payload) & 0xffffffff)) + FRAME_DELIMITER
+
+
+def parse_frame(encoded):
+    """Parse a frame without its delimiter, return (type, body)"""
+    payload = cobs_decode(encoded)
+    if len(payload) < 5:
+        raise ValueError("frame too short")
+    if struct.unpack(">I", payload[-4:])[0] != zlib.crc32(payload[:-4]) & 0xffffffff:
+        raise ValueError("CRC mismatch")
+    return payload[0], payload[1:-4]
+
 
 class UARTFileSender:
     def __init__(self, port, baudrate=38400, timeout=TIMEOUT_SECONDS):
         """Initialize UART connection"""
         self.port = port
         self.baudrate = baudrate
+        self.initial_baudrate = baudrate
         self.timeout = timeout
         self.uart = None
         self.consecutive_errors = 0
+        self.binary = False
 
     def connect(self):
         """Connect to UART port"""
@@ -60,6 +116,11 @@ class UARTFileSender:
     def disconnect(self):
         """Disconnect UART"""
         if self.uart:
+            # Leave the device in the framing and rate other tools expect
+            if self.binary:
+                self.set_binary_mode(False)
+            if self.baudrate != self.initial_baudrate and self.try_baudrate(self.initial_baudrate):
+                print(f"✓ Restored {self.initial_baudrate} baud")
             self.uart.close()
             print("✓ Disconnected")
 
@@ -67,13 +128,118 @@ class UARTFileSender:
         """Send JSON command via UART"""
         try:
             cmd_json = json.dumps(cmd_dict)
-            self.uart.write((cmd_json + "\n").encode("utf-8"))
-            self.uart.flush()
+            self.send_line(cmd_json)
             return True
         except Exception as e:
             print(f"✗ Send error: {e}")
             return False
 
+    def send_line(self, line):
+        """Send a plain text command via UART"""
+        if self.binary:
+            self.uart.write(build_frame(FRAME_TYPE_TEXT, line.encode("utf-8")))
+        else:
+            self.uart.write((line + "\n").encode("utf-8"))
+        self.uart.flush()
+
+    def receive_frame(self, timeout):
+        """Receive one binary frame, return (type, body) or (None, b"") on timeout"""
+        deadline = time.time() + timeout
+        buffer = bytearray()
+        while time.time() < deadline:
+            buffer += self.uart.read_until(FRAME_DELIMITER)
+            if buffer.endswith(FRAME_DELIMITER):
+                if len(buffer) == 1:
+                    buffer.clear()
+                    continue
+                try:
+                    return parse_frame(bytes(buffer[:-1]))
+                except ValueError as e:
+                    print(f"✗ Bad frame: {e}")
+                    buffer.clear()
+        return None, b""
+
+    def set_binary_mode(self, enable):
+        """Enter or leave binary framing, the reply arrives in the old framing"""
+        if not self.send_command({"cmd": "binary_mode", "enable": int(enable)}):
+            return False
+        response = self.receive_response()
+        if not response or response.get("status") != "ok":
+            print(f"⚠ Device did not accept binary_mode={int(enable)}")
+            return False
+        self.binary = enable
+        print(f"✓ {'Binary' if enable else 'Line'} framing enabled")
+        return True
+
+    def switch_baudrate(self, baudrate, rtscts=False):
+        """Change the local port settings after pending output is sent"""
+        self.uart.flush()
+        self.uart.baudrate = baudrate
+        self.uart.rtscts = rtscts
+        self.uart.reset_input_buffer()
+        self.baudrate = baudrate
+
+    def query_baudrate(self, timeout=1):
+        """Send BAUD| and return the device's current settings, or None"""
+        self.uart.reset_input_buffer()
+        self.send_line("BAUD|")
+        response = self.receive_response(timeout)
+        if response and "Baudrate" in response:
+            return response
+        return None
+
+    def try_baudrate(self, baudrate, rtscts=False):
+        """Run the BAUD|/BAUDACK| handshake for one rate, return True if both ends switched"""
+        old_baudrate, old_rtscts = self.baudrate, self.uart.rtscts
+        self.send_line(f"BAUD|{baudrate},{int(rtscts)}")
+        response = self.receive_response()
+        if not response or response.get("Baudrate") != baudrate or "Error" in response:
+            return False
+
+        # The device switched right after answering, confirm at the new rate
+        self.switch_baudrate(baudrate, rtscts)
+        original_timeout = self.uart.timeout
+        self.uart.timeout = 0.3
+        try:
+            deadline = time.time() + BAUD_CONFIRM_TIMEOUT
+            while time.time() < deadline:
+                time.sleep(0.05)
+                self.send_line(f"BAUDACK|{baudrate}")
+                line = self.uart.readline()
+                if b"BaudrateConfirmed" in line:
+                    return True
+        finally:
+            self.uart.timeout = original_timeout
+
+        # No confirmation: wait for the device to revert, then find out where it ended up
+        self.switch_baudrate(old_baudrate, old_rtscts)
+        time.sleep(BAUD_CONFIRM_TIMEOUT)
+        if self.query_baudrate():
+            return False
+        self.switch_baudrate(baudrate, rtscts)
+        if self.query_baudrate():
+            return True
+        self.switch_baudrate(old_baudrate, old_rtscts)
+        return False
+
+    def negotiate_baudrate(self, max_baudrate=None, rtscts=False):
+        """Switch to the highest baud rate supported by both ends"""
+        response = self.query_baudrate()
+        if not response or "Supported" not in response:
+            print(f"⚠ Device does not support baud rate negotiation, staying at {self.baudrate} baud")
+            return False
+
+        candidates = sorted((rate for rate in response["Supported"]
+                             if rate in SUPPORTED_BAUDRATES and rate > self.baudrate
+                             and (max_baudrate is None or rate <= max_baudrate)), reverse=True)
+        for rate in candidates:
+            print(f"  Trying {rate} baud...")
+            if self.try_baudrate(rate, rtscts):
+                print(f"✓ Negotiated {rate} baud" + (" with RTS/CTS" if rtscts else ""))
+                return True
+        print(f"⚠ Baud rate negotiation failed, staying at {self.baudrate} baud")
+        return False
+
     def receive_response(self, timeout=None):
         """Receive JSON response from UART"""
         if timeout is None:
@@ -83,7 +249,13 @@ class UARTFileSender:
         self.uart.timeout = timeout
 
         try:
-            line = self.uart.readline()
+            if self.binary:
+                frame_type, line = self.receive_frame(timeout)
+                if line and frame_type != FRAME_TYPE_TEXT:
+                    print(f"✗ Unexpected frame type: {frame_type}")
+                    return None
+            else:
+                line = self.uart.readline()
             if line:
                 response_str = line.decode("utf-8", "ignore").rstrip()
                 try:
@@ -116,7 +288,8 @@ class UARTFileSender:
 
         file_size = os.path.getsize(file_path)
         filename = os.path.basename(file_path)
-        total_blocks = math.ceil(file_size / BLOCK_SIZE)
+        block_size = BINARY_BLOCK_SIZE if self.binary else BLOCK_SIZE
+        total_blocks = math.ceil(file_size / block_size)
 
         print(f"\n{'='*60}")
         print(f"File Transfer Information")
@@ -124,7 +297,7 @@ class UARTFileSender:
         print(f"File: {filename}")
         print(f"Size: {file_size:,} bytes ({file_size / 1024 / 1024:.2f} MB)")
         print(f"Blocks: {total_blocks}")
-        print(f"Block size: {BLOCK_SIZE} bytes")
+        print(f"Block size: {block_size} bytes ({'binary frames' if self.binary else 'Base64 JSON'})")
         print(f"{'='*60}\n")
 
         # Calculate MD5
@@ -163,8 +336,16 @@ class UARTFileSender:
         with open(file_path, "rb") as f:
             for block_index in range(total_blocks):
                 # Read block data
-                f.seek(block_index * BLOCK_SIZE)
-                block_data = f.read(BLOCK_SIZE)
+                f.seek(block_index * block_size)
+                block_data = f.read(block_size)
+
+                if self.binary:
+                    if not self.send_block_frame(block_index, block_data):
+                        return False
+                    progress = (block_index + 1) / total_blocks * 100
+                    if (block_index + 1) % 50 == 0 or block_index + 1 == total_blocks:
+                        print(f"  Progress: {block_index + 1}/{total_blocks} blocks ({progress:.1f}%)")
+                    continue
 
                 # Calculate CRC32
                 crc32_value = format(zlib.crc32(block_data) & 0xffffffff, '08x')
@@ -260,6 +441,29 @@ class UARTFileSender:
                 print(f"  Actual: {response.get('actual')}")
             return False
 
+    def send_block_frame(self, block_index, block_data):
+        """Send one file block as a binary frame with retries, the frame CRC32 covers the data"""
+        frame = build_frame(FRAME_TYPE_FILE_BLOCK, struct.pack(">I", block_index) + block_data)
+        for retry in range(MAX_RETRIES):
+            self.uart.write(frame)
+            self.uart.flush()
+
+            response = self.receive_response()
+            if not response:
+                print(f"  ⚠ Block {block_index}: Timeout (retry {retry + 1}/{MAX_RETRIES})")
+                continue
+            if response.get("status") == "ok":
+                self.consecutive_errors = 0
+                return True
+            reason = response.get("reason", "unknown")
+            if not response.get("retry"):
+                print(f"  ✗ Block {block_index}: {reason} (not retryable)")
+                return False
+            print(f"  ⚠ Block {block_index}: {reason} (retry {retry + 1}/{MAX_RETRIES})")
+
+        print(f"✗ Failed to send block {block_index} after {MAX_RETRIES} retries")
+        return False
+
     def cancel_transfer(self):
         """Cancel ongoing transfer"""
         print("\n⚠ Cancelling transfer...")
@@ -282,12 +486,20 @@ Examples:
   python send_file_uart.py firmware.zip
   python send_file_uart.py update.zip --port COM5 --baudrate 115200
   python send_file_uart.py data.zip --port /dev/ttyUSB0
+  python send_file_uart.py data.zip --port /dev/ttyUSB0 --max-baudrate 460800 --rtscts
+  python send_file_uart.py data.zip --no-negotiate
+  python send_file_uart.py data.zip --port /dev/ttyUSB0 --binary
         """
     )
 
     parser.add_argument("file", help="File to send (e.g., firmware.zip)")
     parser.add_argument("--port", default="COM3", help="UART port (default: COM3)")
-    parser.add_argument("--baudrate", type=int, default=38400, help="Baud rate (default: 38400)")
+    parser.add_argument("--baudrate", type=int, default=38400, help="Initial baud rate (default: 38400)")
+    parser.add_argument("--max-baudrate", type=int, default=max(SUPPORTED_BAUDRATES),
+                        help=f"Highest baud rate to negotiate (default: {max(SUPPORTED_BAUDRATES)})")
+    parser.add_argument("--rtscts", action="store_true", help="Use RTS/CTS flow control after negotiation")
+    parser.add_argument("--no-negotiate", action="store_true", help="Stay at the initial baud rate")
+    parser.add_argument("--binary", action="store_true", help="Send file blocks as raw binary frames")
     parser.add_argument("--timeout", type=int, default=5, help="Timeout in seconds (default: 5)")
 
     args = parser.parse_args()
@@ -305,6 +517,14 @@ Examples:
         if not sender.connect():
             sys.exit(1)
 
+        # Negotiate a faster baud rate before the transfer
+        if not args.no_negotiate:
+            sender.negotiate_baudrate(args.max_baudrate, args.rtscts)
+
+        # Raw binary blocks instead of Base64 JSON, falls back to JSON if refused
+        if args.binary:
+            sender.set_binary_mode(True)
+
         # Send file
         print(f"\n🚀 Starting file transfer...\n")
         start_time = time.time()
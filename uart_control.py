@@ -1,9 +1,10 @@
 import socket
+import select
 import serial
 import base64
 import time
 import math
-from PIL import Image
+from PIL import Image, features
 import json
 from datetime import datetime
 import numpy as np
@@ -21,11 +22,17 @@ import subprocess
 import hashlib
 import zlib
 import shutil
+import io
+import struct
+import queue
+import collections
+import bisect
+from concurrent.futures import ThreadPoolExecutor
 
 # ================================
 # VERSION INFORMATION
 # ================================
-VERSION = "3.3.1"
+VERSION = "3.4.0"
 
 # ================================
 # CAMERA CONFIGURATION LOGIC
@@ -58,7 +65,8 @@ USE_WEIGHTED_AVERAGE = True
 CAMERA1_DIAGNOSE_INFO_PATH = "/home/root/AglaiaSense/resource/share_config/diagnose_info_1.json"
 CAMERA2_DIAGNOSE_INFO_PATH = "/home/root/AglaiaSense/resource/share_config/diagnose_info_2.json"
 LOG_FOLDER = "log"
-CONFIG_PATH = '/home/root/AglaiaSense/resource/share_config/gs501.json'
+# 环境变量 UART_CONTROL_GS501 可指定其他 gs501.json（如 fake_backend 生成的配置）
+CONFIG_PATH = os.environ.get("UART_CONTROL_GS501", '/home/root/AglaiaSense/resource/share_config/gs501.json')
 CAM1_ID = 1
 CAM2_ID = 2
 CAMERA1_PORT = 10808
@@ -80,12 +88,74 @@ SDK_USER_NAME = "sdk_user"
 SDK_USER_PASSWD = "sdk_password"
 sdk_token = None
 sdk_token_lock = threading.Lock()
+SDK_REQUEST_TIMEOUT = 5.0  # 单次SDK请求的超时(秒)，包括连接、发送和读取应答，避免SDK无响应时一直阻塞
+SDK_POOL_SIZE = 2  # SDK长连接池保留的空闲连接数，与慢命令工作线程数相同
+SDK_LOGIN_RETRY_INTERVAL = 5.0  # 没有token时两次自动登录之间的最短间隔(秒)
+sdk_last_login_attempt = 0
+# SDK 断路器：连续失败达到 SDK_BREAKER_FAILURES 次后打开，期间请求立即失败，调用方使用最近一次的值；
+# 等待退避时间后放行一个探测请求，成功则关闭，失败则退避时间加倍
+SDK_BREAKER_FAILURES = 3
+SDK_BREAKER_BACKOFF = 1.0  # 首次探测前的等待时间(秒)
+SDK_BREAKER_MAX_BACKOFF = 30.0  # 探测间隔上限(秒)
+sdk_stats = {}  # SDK 命令 -> 次数/失败数/延迟直方图，与 command_stats 结构相同
+sdk_stats_lock = threading.Lock()
+sdk_stale_served = 0  # SDK 不可用或缓存过期时返回旧值的次数
+
+# SDK hardware status cache
+# WiFi|/CELL| 从缓存读取WiFi/LTE状态，后台线程用一次 get_hardware_status_req 同时刷新两个模块
+HARDWARE_STATUS_MODULES = ["wifi", "lte"]
+hardware_status_refresh = 10.0  # 后台刷新周期(秒)，config.json HardwareStatusRefresh，0 表示不缓存、每次查询都请求SDK
+hardware_status_max_age = 30.0  # 缓存可直接使用的最长时间(秒)，config.json HardwareStatusMaxAge，超过后查询时同步请求SDK
+hardware_status = {}  # 模块 -> (状态 "enabled"/"disabled", 更新时间 monotonic)
+hardware_status_lock = threading.Lock()
+hardware_status_wakeup = threading.Event()  # 缓存过期时唤醒刷新线程
+hardware_set_locks = {"wifi": threading.Lock(), "lte": threading.Lock()}  # 同一模块的 WiFi|/CELL| 命令逐个执行，设置不会交错
+
+# SDK camera parameter cache
+# ?PS1/?PS2 从缓存读取摄像头参数（gain/exposure/ae_mode/framerate），不再每次请求SDK
+# 后台线程定期刷新，收到 SDK 的 camera_param 事件时立即刷新
+CAMERA_SDK_NAMES = {CAM1_ID: "left", CAM2_ID: "right"}
+PS_DYNAMIC_FIELDS = ["CameraFPS", "AEModel", "Exposure", "Gain", "Time"]  # ?PS1/?PS2 中每次重新生成的字段
+camera_param_refresh = 30.0  # 后台刷新周期(秒)，config.json CameraParamRefresh，0 表示不缓存、每次查询都请求SDK
+camera_param_max_age = 120.0  # 参数超过该时间(秒)未刷新成功视为过期，config.json CameraParamMaxAge
+camera_params = {}  # 摄像头ID -> (SDK 返回的参数, 更新时间 monotonic)
+camera_params_lock = threading.Lock()
+camera_param_wakeup = threading.Event()  # 收到参数变化事件或缓存过期时唤醒刷新线程
+ps_template = None  # ?PS1/?PS2 应答模板，gs501.json 字段已序列化，main() 读取配置后生成
 
 # Firmware update config
-UNIT_CONFIG_PATH = '/home/root/AglaiaSense/resource/share_config/gs501.json'
+UNIT_CONFIG_PATH = CONFIG_PATH
 HOST_DEVM_UPDATE = 'localhost'
 PORT_DEVM_UPDATE = 20808
 
+# UART baudrate config
+UART_DEFAULT_BAUDRATE = 38400  # 上电及恢复时使用的波特率
+SUPPORTED_BAUDRATES = [38400, 57600, 115200, 230400, 460800, 921600]
+BAUD_CONFIRM_TIMEOUT = 2.0  # 切换波特率后等待主机 BAUDACK 的时间(秒)
+baud_idle_revert = 600  # 非默认波特率或二进制帧模式下超过该时间(秒)未收到命令则恢复默认设置，0 表示不恢复
+
+# UART receive config
+# 接收线程持续读取串口，按行（二进制模式按0x00）切分后放入接收队列，主循环从队列取命令
+UART_RX_QUEUE_SIZE = 64  # 接收队列最多缓存的完整行/帧数，队列满时新收到的行被丢弃并计数
+UART_MAX_LINE_SIZE = 4096  # 行模式单行最大长度（file_block 行约 934 字节），超出则整行丢弃
+UART_RX_IDLE_WAIT = 1.0  # 主循环无命令时的等待时间(秒)，只用于空闲检查
+
+# Slow command config
+# WiFi|/CELL|/WFPW|/?PS1/?PS2 需要请求SDK，在后台线程执行，主循环继续处理后续命令，应答仍按命令顺序发送
+SLOW_COMMAND_WORKERS = 2  # 后台执行慢命令的线程数
+SLOW_COMMAND_LIMIT = 8  # 排队和执行中的慢命令上限，超出时直接以最近状态应答
+SLOW_COMMAND_DEADLINE = 0.8  # 慢命令的应答期限(秒)，主机等待应答1秒，超时以该命令最近一次的应答代替（设置命令加 "Pending": 1）
+
+# UART binary framing config
+# 帧格式: COBS(类型(1) + 数据 + CRC32(4, 大端, 覆盖类型和数据)) + 0x00
+FRAME_DELIMITER = b"\x00"
+FRAME_TYPE_TEXT = 0x01  # 文本命令/JSON响应（不含换行）
+FRAME_TYPE_IMAGE_BLOCK = 0x02  # ?PS5+ 图像块: 块序号(2字节, 从1开始) + 原始图像数据
+FRAME_TYPE_FILE_BLOCK = 0x03  # 文件块: 块序号(4字节, 从0开始) + 原始文件数据
+FRAME_TYPE_DELTA_BLOCK = 0x04  # ?DB 增量图像块: 块序号(2字节, 从1开始) + 原始图像数据
+FRAME_TYPE_COMPRESSED = 0x05  # 压缩的文本响应: 压缩模式(1字节) + 压缩数据
+MAX_FRAME_SIZE = 4096  # 接收帧（COBS编码后）最大长度，超出则丢弃
+
 # define pic size
 IMAGE_CHANNELS = 3
 IMAGE_HEIGHT = 300
@@ -97,14 +167,110 @@ APP_NUMBER_TRAFFIC = "699"
 
 send_max_length = 980
 max_image_blocks = 20  # 最大图像块数量，默认20，最大80
+MAX_IMAGE_BLOCKS = 80  # ?PS5 ~ ?PS84 固定有效范围
 count_interval = "300"
 profile_index = 3
 emer_mode = 0  # corrected from ener_mode
-str_image = []
+str_image = []  # 最新一组完整图像块(ImageBlockSet)，由编码线程整体替换发布
+pinned_image = []  # ?OBdata 时锁定的图像块，本周期内 ?PS5+ 均从这里读取
+alert_image = []  # 报警时编码的图像块，紧急模式下 pin_image_blocks() 优先锁定，不会被编码线程之后发布的图像替换
+# 超出实际图像块数量时返回的空包，预先组帧
+EMPTY_BLOCK_FRAMES = [b'{"Block%d":""}\n' % (n + 1) for n in range(MAX_IMAGE_BLOCKS)]
 emer_imgage_send = 0
+device_config = None  # gs501.json 硬件配置，main() 启动时读取，?PS1/?PS2 使用
+# 应答缓存：?Asset/?Order 及 @|、Profile|、REACT|、BLK| 查询的应答只随全局变量/配置变化，
+# 编码好的字节按 state_version 缓存，相关全局变量或配置每次修改后调用 bump_state_version()
+state_version = 0
+state_version_lock = threading.Lock()
+response_cache = {}  # (命令, 二进制模式, 压缩模式) -> (state_version, 应答文本, 编码后的字节)
+
+# 后台图像编码线程：周期性取图编码并发布到 str_image，?OBdata 不再等待JPEG编码
+image_encode_interval = 1.0  # 编码周期(秒)，config.json ImageEncodeInterval，0 表示在 ?OBdata 时同步编码
+image_pipeline_lock = threading.Lock()  # 串行化取图与编码（编码线程/报警线程共用帧缓冲）
+image_encoder_wakeup = threading.Event()  # 配置变化时立即唤醒编码线程
+image_demand = threading.Event()  # 上次取图编码后主机是否请求过图像(?OBdata/?PS5+)，没有请求时编码线程不取图
+image_refresh_time = 0  # 上次取图编码的时间，编码线程空闲较久后 ?OBdata 立即唤醒编码线程
+
+# 图像流水线缓冲区（全程内存处理，不再写临时文件）
+image_frames = {}  # {cam_in_use: ndarray}，预分配的RGB帧缓冲：单摄 (H, W, 3)，双摄 (H, 2W, 3) 左右拼接
+image_encode_buffer = io.BytesIO()  # 复用的编码输出缓冲
+delta_encode_buffer = io.BytesIO()  # 增量帧(?DLT)专用的编码输出缓冲，不与编码线程共用
+image_debug_dump = False  # 调试用：为True时把中间图像写入 IMAGE_DEBUG_DUMP_DIR
+IMAGE_DEBUG_DUMP_DIR = "./tmp"
+
+# JPEG质量搜索：以上次满足大小限制的quality为起点，先按步长倍增找到区间再二分
+JPEG_QUALITY_MIN = 1
+JPEG_QUALITY_MAX = 95
+JPEG_QUALITY_STEP = 4  # 起始探测步长，每次未找到区间时翻倍
+JPEG_QUALITY_TOLERANCE = 4  # 可用/超限两个quality相差不超过该值即停止
+JPEG_SIZE_FILL_RATIO = 0.9  # 结果达到目标大小的90%即接受，不再向上搜索
+jpeg_quality_history = {}  # {(codec, subsampling, cam_in_use, max_image_blocks): 上次满足大小限制的quality}
+image_encode_stats = {"cycles": 0, "encodes": 0, "last_encodes": 0, "last_quality": 0, "last_size": 0, "last_codec": ""}
+
+# 图像编码后端，可通过 config.json ImageCodec 或 CODEC| 命令选择
+IMAGE_CODECS = {
+    "jpeg": {"format": "JPEG", "mode": "RGB", "params": {}},                               # 基线JPEG
+    "jpeg_progressive": {"format": "JPEG", "mode": "RGB", "params": {"progressive": True}},  # 渐进式JPEG
+    "webp": {"format": "WEBP", "mode": "RGB", "params": {"method": 4}},                    # WebP（需Pillow支持）
+    "gray": {"format": "JPEG", "mode": "L", "params": {}, "auto": False},                  # 灰度JPEG，只能显式选择
+}
+IMAGE_CODEC_AUTO = "auto"  # 自动评估各后端，选择预算内画质最好的（"auto": False 的后端不参与，PSNR按彩色原图计算，对灰度不公平）
+CHROMA_SUBSAMPLING = {"4:4:4": 0, "4:2:2": 1, "4:2:0": 2}  # JPEG色度抽样
+IMAGE_CODEC_RESCORE_CYCLES = 30  # auto模式下每编码多少次重新评估一次（每次只与一个候选后端比较，轮流进行）
+image_codec = "jpeg"
+image_chroma_subsampling = "4:2:0"
+image_codec_selection = {}  # auto模式评估结果 {(cam_in_use, max_image_blocks): {"codec": name, "cycles": n, "next": 下一个候选序号}}
+
+# ROI模式：只编码计数线/区域(drawing coordinates)并集加边距的区域
+IMAGE_ROI_MIN_SIZE = 32  # 裁剪区域最小边长（像素）
+image_roi_enabled = False  # config.json ImageROI / ROI| 命令
+image_roi_margin = 16  # 裁剪边距（像素），config.json ImageROIMargin
+roi_coordinates = {}  # {cam_id: (coordinates, (宽, 高) 或 None)}，最近一次从摄像头info socket获取的drawing坐标及其画布尺寸(ImageSize)
+
+# 分块增量图像：只发送相对主机上次确认(DACK|)的帧有变化的图块，定期发送完整关键帧
+# 命令: ?DLT[|K] 生成关键帧/增量帧, ?DB<n> 读取第n块, DACK|<seq> 确认已收到
+DELTA_TILE_SIZE = 64  # 图块边长（像素），16的倍数，避免JPEG宏块跨图块
+DELTA_SAMPLE_STEP = 4  # 图块比较时的降采样步长
+DELTA_CELL_SIZE = 16  # 变化判断的小格边长（像素），图块内任一小格变化即发送整块
+DELTA_KEYFRAME_INTERVAL = 5  # 连续增量帧数达到该值后发送关键帧，刷新主机端未变化图块的JPEG损失
+delta_tile_threshold = 4.0  # 小格平均绝对差阈值(0-255)，config.json DeltaTileThreshold
+delta_state = {
+    "seq": 0,              # 最近一次生成的帧序号
+    "reference": None,     # 主机已确认的参考帧 (ndarray)：主机各图块最后一次收到时的原始像素
+    "reference_key": None, # 参考帧对应的 cam_in_use
+    "pending": None,       # 已生成待确认的帧 {"seq", "frame"(确认后的参考帧), "key", "keyframe"}
+    "since_keyframe": 0,   # 距离上次关键帧的增量帧数
+    "quality": None,       # 最近一次关键帧的JPEG quality，增量图块沿用
+    "blocks": [],          # 当前帧的图像块(ImageBlockSet)
+}
+
+# 帧变化检测：与上次编码帧相比，每个16像素小格的平均差都不超过阈值时，复用已有 str_image
+# 按小格取最大值，画面中的小目标（如只占5%画面的车辆）不会被整帧平均掉
+IMAGE_CHANGE_SAMPLE_STEP = 8  # 降采样步长（像素）
+IMAGE_CHANGE_CELL_SIZE = 16  # 变化判断的小格边长（像素），IMAGE_CHANGE_SAMPLE_STEP 的倍数
+image_change_threshold = 4.0  # 小格平均绝对差阈值(0-255)，config.json ImageChangeThreshold，负数表示关闭检测
+image_change_max_age = 60.0  # 复用图像块的最长时间(秒)，超过后强制重新编码，config.json ImageChangeMaxAge
+image_change_state = {"key": None, "signature": None, "time": 0}  # 上次编码帧的配置、降采样签名和编码时间
+image_change_stats = {"hits": 0, "misses": 0}  # hits: 复用已有图像块, misses: 重新编码
 
 dnn_default_dirct = {"spdunit":"KPH","incar":-1,"incarspd":-1,"inbus":-1,"inbusspd":-1,"inped":-1,"inpedspd":-1,"incycle":-1,"incyclespd":-1,"intruck":-1,"intruckspd":-1,"outcar":-1,"outcarspd":-1,"outbus":-1,"outbusspd":-1,"outped":-1,"outpedspd":-1,"outcycle":-1,"outcyclespd":-1,"outtruck":-1,"outtruckspd":-1}
 
+# 响应压缩：主机通过 COMP| 开启，压缩后不更短时仍发送原文
+COMPRESSION_MODES = {"deflate": 1, "zdict": 2}  # deflate: 原始deflate流，zdict: 带预设字典的zlib流
+COMPRESSION_MIN_SIZE = 48  # 短于该长度的响应不尝试压缩
+COMPRESSION_LOG_INTERVAL = 100  # 每压缩这么多条响应输出一次按命令统计的节省字节数
+# 预设字典：?PS1/?PS2 参数键、?PS3/?PS4 坐标格式和 ?OBdata 计数键，最常见的内容放在最后
+COMPRESSION_DICTIONARY = (
+    json.dumps({key: "" for key in ["CameraFPS", "ImageSize", "PixelDepth", "PixelOrder", "DNNModel",
+                                    "PostProcessingLogic", "SendImageQuality", "SendImageSizePercent",
+                                    "AEModel", "Exposure", "Gain", "Heating", "Time"]})
+    + json.dumps({"line": [{"x": 0, "y": 0}, {"x": 0, "y": 0}]})
+    + json.dumps(dnn_default_dirct)
+).encode("utf_8")
+compression_templates = {}  # 压缩模式 -> 已初始化的压缩器模板，compress_payload() 每条响应复制使用
+compression_stats = {}  # 命令类型 -> {"count", "raw", "sent"}，raw 为不压缩时应发送的字节数
+compression_count = 0
+
 sockets = {
     'cam1_info_sock': None,
     'cam2_info_sock': None
@@ -219,26 +385,191 @@ def connect_socket(server_address, socket_key):
             time.sleep(5)  # Wait 5 seconds and try again
 
 # SDK 相关函数
-def send_json_request(request):
-    """向 SDK 发送 JSON 请求"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+class SdkClient:
+    """
+    SDK JSON 长连接客户端
+    - 最多保留 size 个空闲连接，并发请求各自占用一个连接
+    - 按 JSON 对象边界(raw_decode)读取应答，读到完整对象即返回，不再等待服务端关闭连接
+    - 服务端关闭了空闲连接（如每个请求一个连接的 SDK）时丢弃该连接重新建立
+    - SDK 连接失败后再次连上时先调用 on_reconnect（重新登录），用返回的 token 替换请求中的 token
+    - 断路器（见 SDK_BREAKER_FAILURES）：打开期间请求直接抛出 SdkUnavailableError，不再等待连接超时
+    """
+
+    def __init__(self, host, port, size=SDK_POOL_SIZE, timeout=SDK_REQUEST_TIMEOUT, on_reconnect=None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.on_reconnect = on_reconnect
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+        self.decoder = json.JSONDecoder()
+        self.disconnected = False  # 上一次连接SDK失败，下次连上时需要重新登录
+        self.breaker = "closed"  # closed / open / half_open（探测中）
+        self.failures = 0  # 连续失败次数
+        self.backoff = SDK_BREAKER_BACKOFF
+        self.retry_at = 0  # 断路器打开时下一次允许探测的时间(monotonic)
+        self.breaker_opened = 0  # 断路器打开的次数
+
+    def acquire(self, deadline):
+        """取一个空闲连接，没有可用的则新建，返回 (sock, 是否复用)"""
+        while True:
+            with self.lock:
+                sock = self.idle.pop() if self.idle else None
+            if sock is None:
+                break
+            # 空闲连接可读说明服务端已关闭（或有多余数据），不能复用
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return sock, True
+            sock.close()
         try:
-            sock.connect((SDK_SERVER_IP, SDK_JSON_PORT))
-            sock.sendall(json.dumps(request).encode('utf-8'))
-            response = b""
-            while True:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-            return json.loads(response.decode('utf-8'))
+            sock = socket.create_connection((self.host, self.port), timeout=max(deadline - time.monotonic(), 0.01))
+        except OSError:
+            self.disconnected = True
+            raise
+        return sock, False
+
+    def release(self, sock):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        with self.lock:
+            socks = list(self.idle)
+            self.idle.clear()
+        for sock in socks:
+            sock.close()
+
+    def check_breaker(self):
+        """断路器打开且未到探测时间，或已有探测请求进行中时抛出 SdkUnavailableError"""
+        with self.lock:
+            if self.breaker == "closed":
+                return
+            if self.breaker == "open" and time.monotonic() >= self.retry_at:
+                self.breaker = "half_open"  # 当前请求作为探测
+                logger.info("SDK circuit breaker half-open, probing")
+                return
+        raise SdkUnavailableError(f"SDK circuit breaker {self.breaker}")
+
+    def record_result(self, ok):
+        with self.lock:
+            if ok:
+                if self.breaker != "closed" or self.failures >= SDK_BREAKER_FAILURES:
+                    logger.info(f"SDK circuit breaker closed after {self.failures} failures")
+                self.breaker = "closed"
+                self.failures = 0
+                self.backoff = SDK_BREAKER_BACKOFF
+                return
+            self.failures += 1
+            if self.failures < SDK_BREAKER_FAILURES:
+                return
+            if self.failures == SDK_BREAKER_FAILURES:
+                self.breaker_opened += 1
+            if self.breaker != "open":
+                self.retry_at = time.monotonic() + self.backoff
+                logger.warning(f"SDK circuit breaker open after {self.failures} failures, next probe in {self.backoff:.1f}s")
+                self.backoff = min(self.backoff * 2, SDK_BREAKER_MAX_BACKOFF)
+                self.breaker = "open"
+
+    def request(self, request, timeout=None):
+        """发送请求并返回应答字典，超时、连接失败或应答无法解析时抛出异常，断路器打开时抛出 SdkUnavailableError"""
+        self.check_breaker()
+        started = time.perf_counter()
+        try:
+            response = self.send(request, timeout)
         except Exception as e:
-            logger.error(f"SDK JSON request error: {e}")
-            return None
+            self.record_result(False)
+            record_sdk_stats(request.get("cmd", ""), time.perf_counter() - started, e)
+            raise
+        self.record_result(True)
+        record_sdk_stats(request.get("cmd", ""), time.perf_counter() - started, None)
+        return response
+
+    def send(self, request, timeout):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        while True:
+            sock, reused = self.acquire(deadline)
+            if not reused:
+                with self.lock:
+                    reconnected, self.disconnected = self.disconnected, False
+                    if self.breaker == "half_open":
+                        self.breaker = "closed"  # 探测已连上SDK，放行重新登录请求；应答失败时立即重新打开
+                if reconnected and self.on_reconnect and request.get("cmd") != "user_login_req":
+                    logger.info("SDK reachable again, logging in")
+                    token = self.on_reconnect()
+                    if token and "token" in request:
+                        request = dict(request, token=token)
+            try:
+                response = self.exchange(sock, request, deadline)
+            except socket.timeout:
+                sock.close()  # SDK 慢但仍在线，不需要重新登录
+                raise
+            except ConnectionError:
+                sock.close()
+                if reused:
+                    continue  # 复用的连接已被服务端关闭且未收到任何数据，换新连接重发
+                self.disconnected = True
+                raise
+            except OSError:
+                sock.close()
+                self.disconnected = True
+                raise
+            except ValueError:
+                sock.close()
+                raise
+            self.release(sock)
+            return response
+
+    def exchange(self, sock, request, deadline):
+        sock.sendall(json.dumps(request).encode('utf-8'))
+        buffer = b""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("SDK response timed out")
+            sock.settimeout(remaining)
+            chunk = sock.recv(4096)
+            if not chunk:
+                if not buffer:
+                    raise ConnectionError("SDK closed the connection")
+                # 服务端关闭连接，剩余数据必须是完整的JSON
+                return json.loads(buffer.decode('utf-8'))
+            buffer += chunk
+            text = buffer.decode('utf-8', 'ignore').lstrip()
+            try:
+                response, end = self.decoder.raw_decode(text)
+            except ValueError:
+                continue  # 应答尚未收全
+            if text[end:].strip():
+                raise ValueError(f"Unexpected data after SDK response: {text[end:end + 64]!r}")
+            return response
+
+class SdkUnavailableError(ConnectionError):
+    """SDK 断路器打开，请求未发送"""
+
+def record_sdk_stats(cmd, elapsed, error):
+    with sdk_stats_lock:
+        add_latency_sample(sdk_stats, cmd, elapsed, error)
+
+def send_json_request(request, timeout=None):
+    """向 SDK 发送 JSON 请求（经 sdk_client 长连接），timeout 默认 SDK_REQUEST_TIMEOUT，失败返回 None"""
+    try:
+        return sdk_client.request(request, timeout)
+    except SdkUnavailableError as e:
+        logger.debug(f"SDK JSON request skipped: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"SDK JSON request error: {e}")
+        return None
 
 def sdk_login():
     """SDK 登录获取 token"""
-    global sdk_token
+    global sdk_token, sdk_last_login_attempt
+    sdk_last_login_attempt = time.monotonic()
     request = {"cmd": "user_login_req", "username": SDK_USER_NAME, "passwd": SDK_USER_PASSWD}
     response = send_json_request(request)
     if response and response.get("cmd") == "user_login_rsp" and response.get("ret_code") == 0:
@@ -250,6 +581,17 @@ def sdk_login():
         sdk_token = None
         return None
 
+def sdk_ensure_token():
+    """返回当前 token；没有 token 时（启动时登录失败等）按 SDK_LOGIN_RETRY_INTERVAL 限频重新登录"""
+    if sdk_token:
+        return sdk_token
+    with sdk_token_lock:
+        if not sdk_token and time.monotonic() - sdk_last_login_attempt >= SDK_LOGIN_RETRY_INTERVAL:
+            sdk_login()
+    return sdk_token
+
+sdk_client = SdkClient(SDK_SERVER_IP, SDK_JSON_PORT, on_reconnect=sdk_login)
+
 def sdk_logout():
     """SDK 登出"""
     global sdk_token
@@ -258,6 +600,7 @@ def sdk_logout():
         response = send_json_request(request)
         logger.info(f"SDK logout response: {response}")
         sdk_token = None
+    sdk_client.close()
 
 # 注释掉：SDK不再校验token，不需要心跳机制
 # def sdk_heartbeat():
@@ -296,7 +639,7 @@ def sdk_logout():
 
 def sdk_set_event_server_info(server_ip, server_port):
     """设置事件服务器信息"""
-    if not sdk_token:
+    if not sdk_ensure_token():
         logger.warning("No valid token available for set_event_server_info")
         return False
 
@@ -317,23 +660,20 @@ def sdk_set_event_server_info(server_ip, server_port):
 
 def sdk_get_camera_param(camera_id):
     """从 SDK 获取摄像头参数"""
-    if not sdk_token:
+    if not sdk_ensure_token():
         logger.warning("No valid token available for get_camera_param")
         return None
 
     # 根据 camera_id 确定使用的摄像头标识
-    if camera_id == CAM1_ID:
-        camera_name = "left"
-    elif camera_id == CAM2_ID:
-        camera_name = "right"
-    else:
+    camera_name = CAMERA_SDK_NAMES.get(camera_id)
+    if camera_name is None:
         logger.error(f"Invalid camera_id for SDK camera param: {camera_id}")
         return None
 
     request = {"cmd": "get_camera_param_req", "camera_id": camera_name, "token": sdk_token}
     response = send_json_request(request)
     if response and response.get("cmd") == "get_camera_param_rsp" and response.get("ret_code") == 0:
-        logger.info(f"SDK camera param data: {response}")
+        logger.debug(f"SDK camera param data: {response}")
         return response
     else:
         logger.error(f"Failed to get camera param from SDK: {response}")
@@ -341,7 +681,7 @@ def sdk_get_camera_param(camera_id):
 
 def sdk_get_hardware_status(modules=None):
     """从SDK获取硬件状态"""
-    if not sdk_token:
+    if not sdk_ensure_token():
         logger.warning("No valid token available for get_hardware_status")
         return None
 
@@ -357,7 +697,7 @@ def sdk_get_hardware_status(modules=None):
 
 def sdk_set_hardware_status(module, status):
     """通过SDK设置硬件状态"""
-    if not sdk_token:
+    if not sdk_ensure_token():
         logger.warning("No valid token available for set_hardware_status")
         return False
 
@@ -371,19 +711,80 @@ def sdk_set_hardware_status(module, status):
 
     if response and response.get("cmd") == "set_hardware_status_rsp" and response.get("ret_code") == 0:
         logger.info(f"Successfully set hardware status: {module}={status}")
+        update_hardware_status({module: "enabled" if status == "open" else "disabled"})
         return True
     else:
         logger.error(f"Failed to set hardware status: {response}")
         return False
 
+def read_sdk_cache(cache, lock, key, max_age, refresh, wakeup=None):
+    """
+    读取SDK查询结果缓存（stale-while-revalidate），返回 (值, 是否过期)，从未取到过值时返回 (None, True)
+    - 未超过 max_age 的值直接返回
+    - 已过期且有后台刷新线程(wakeup)时返回旧值并唤醒刷新线程（断路器打开时不唤醒），不等待SDK
+    - 没有值或没有后台刷新线程时同步调用 refresh()；SDK 失败或断路器打开时返回最近一次的值并标记为过期
+    """
+    global sdk_stale_served
+    with lock:
+        value, updated = cache.get(key, (None, 0))
+    if value is not None and time.monotonic() - updated <= max_age:
+        return value, False
+    if value is None or wakeup is None:
+        refresh()
+        with lock:
+            latest, latest_updated = cache.get(key, (None, 0))
+        if latest_updated > updated:
+            return latest, False
+    elif sdk_client.breaker == "closed":
+        wakeup.set()  # 断路器打开时由刷新线程按周期探测，不逐次唤醒
+    if value is not None:
+        sdk_stale_served += 1
+        logger.debug(f"Serving stale SDK value for {key}, age {time.monotonic() - updated:.1f}s, breaker {sdk_client.breaker}")
+    return value, True
+
+def update_hardware_status(statuses, requested=None):
+    """
+    更新硬件状态缓存，statuses 为 模块 -> 状态
+    requested 为查询请求发出的时间，请求期间已被设置命令更新的模块不会被旧状态覆盖
+    """
+    now = time.monotonic()
+    with hardware_status_lock:
+        for module, status in statuses.items():
+            if requested is not None and hardware_status.get(module, (None, 0))[1] > requested:
+                continue
+            hardware_status[module] = (status, now)
+
+def refresh_hardware_status():
+    """一次请求刷新全部模块的状态，成功返回 True"""
+    requested = time.monotonic()
+    response = sdk_get_hardware_status(HARDWARE_STATUS_MODULES)
+    if not response:
+        return False
+    update_hardware_status({module: response.get(f"{module}_status", "disabled") for module in HARDWARE_STATUS_MODULES},
+                           requested)
+    return True
+
+def get_hardware_status(module):
+    """返回 (模块状态, 是否过期)，缓存规则见 read_sdk_cache，从未取到过状态时返回 (None, True)"""
+    if hardware_status_refresh > 0:
+        return read_sdk_cache(hardware_status, hardware_status_lock, module, hardware_status_max_age,
+                              refresh_hardware_status, hardware_status_wakeup)
+    return read_sdk_cache(hardware_status, hardware_status_lock, module, 0, refresh_hardware_status)
+
+def hardware_status_thread():
+    """后台线程，按 hardware_status_refresh 周期或缓存过期时刷新硬件状态缓存"""
+    logger.info(f"Hardware status refresh thread started, interval: {hardware_status_refresh}s, max age: {hardware_status_max_age}s")
+    while True:
+        try:
+            refresh_hardware_status()
+        except Exception as e:
+            logger.error(f"Hardware status refresh error: {e}")
+        hardware_status_wakeup.wait(hardware_status_refresh)
+        hardware_status_wakeup.clear()
+
 def get_wifi_status_from_sdk():
-    """通过SDK获取WiFi状态"""
-    modules = ["wifi"]
-    hardware_status = sdk_get_hardware_status(modules)
-    if hardware_status:
-        wifi_status = hardware_status.get("wifi_status", "disabled")
-        return wifi_status
-    return None
+    """通过SDK获取WiFi状态（经硬件状态缓存）"""
+    return get_hardware_status("wifi")[0]
 
 def set_wifi_status_via_sdk(enable):
     """通过SDK设置WiFi状态"""
@@ -391,19 +792,79 @@ def set_wifi_status_via_sdk(enable):
     return sdk_set_hardware_status("wifi", status)
 
 def get_lte_status_from_sdk():
-    """通过SDK获取LTE状态"""
-    modules = ["lte"]
-    hardware_status = sdk_get_hardware_status(modules)
-    if hardware_status:
-        lte_status = hardware_status.get("lte_status", "disabled")
-        return lte_status
-    return "disabled"
+    """通过SDK获取LTE状态（经硬件状态缓存）"""
+    return get_hardware_status("lte")[0] or "disabled"
 
 def set_lte_status_via_sdk(enable):
     """通过SDK设置LTE状态"""
     status = "open" if enable else "close"
     return sdk_set_hardware_status("lte", status)
 
+def refresh_camera_params(camera_ids):
+    """从SDK刷新摄像头参数缓存，失败时保留上一次的参数"""
+    for camera_id in camera_ids:
+        response = sdk_get_camera_param(camera_id)
+        if response:
+            with camera_params_lock:
+                camera_params[camera_id] = (response, time.monotonic())
+
+def get_camera_params(camera_id):
+    """返回 (摄像头参数, 是否过期)，缓存规则见 read_sdk_cache，从未取到过参数时返回 (None, True)"""
+    if camera_param_refresh > 0:
+        return read_sdk_cache(camera_params, camera_params_lock, camera_id, camera_param_max_age,
+                              lambda: refresh_camera_params([camera_id]), camera_param_wakeup)
+    return read_sdk_cache(camera_params, camera_params_lock, camera_id, 0, lambda: refresh_camera_params([camera_id]))
+
+def camera_param_thread():
+    """后台线程，按 camera_param_refresh 周期或收到参数变化事件时刷新已安装摄像头的参数"""
+    camera_ids = [camera_id for camera_id in CAMERA_SDK_NAMES if cam_in_use_actual & camera_id]
+    logger.info(f"Camera param refresh thread started, interval: {camera_param_refresh}s, cameras: {camera_ids}")
+    while True:
+        try:
+            refresh_camera_params(camera_ids)
+        except Exception as e:
+            logger.error(f"Camera param refresh error: {e}")
+        camera_param_wakeup.wait(camera_param_refresh)
+        camera_param_wakeup.clear()
+
+def build_ps_template(config):
+    """
+    生成 ?PS1/?PS2 应答模板：gs501.json 中的字段预先序列化，PS_DYNAMIC_FIELDS 留为 str.format 占位符
+    渲染结果与 json.dumps(ps_data) 相同
+    """
+    fields = [
+        ("CameraFPS", None),
+        ("ImageSize", f"{config['InputTensorWidth']}*{config['InputTensorHeith']}"),
+        ("PixelDepth", config["PixelDepth"]),
+        ("PixelOrder", config["PixelOrder"]),
+        ("DNNModel", config["DNNModel"]),
+        ("PostProcessingLogic", config["PostProcessingLogic"]),
+        ("SendImageQuality", config["SendImageQuality"]),
+        ("SendImageSizePercent", config["SendImageSizePercent"]),
+        ("AEModel", None),
+        ("Exposure", None),
+        ("Gain", None),
+        ("Heating", config["Heating"]),
+        ("Time", None)
+    ]
+    parts = []
+    for key, value in fields:
+        if key in PS_DYNAMIC_FIELDS:
+            parts.append(f"{json.dumps(key)}: {{{key}}}")
+        else:
+            parts.append(f"{json.dumps(key)}: " + json.dumps(value).replace("{", "{{").replace("}", "}}"))
+    return "{{" + ", ".join(parts) + "}}"
+
+def render_camera_params(params):
+    """用SDK参数填充 ?PS1/?PS2 应答模板"""
+    return ps_template.format(
+        CameraFPS=json.dumps(str(params.get("framerate", 30))),  # 使用SDK返回的帧率
+        AEModel=json.dumps(params.get("ae_mode", "auto")),  # 直接使用SDK返回的字符串
+        Exposure=json.dumps(str(params.get("exposure", 0))),
+        Gain=json.dumps(str(params.get("gain", 0))),
+        Time=json.dumps(datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
+    )
+
 def calculate_speed_weighted_average(direction_class, new_speed, speed_averages, speed_counts):
     """
     Calculate speed using weighted average method:
@@ -824,16 +1285,50 @@ def map_shared_memory(shm):
         return None
     return shm_ptr
 
-def get_pic_from_socket(shm_ptr, cam_id):
-    shm_ptr.seek(0)
-    image_data = shm_ptr.read(IMAGE_WIDTH * IMAGE_HEIGHT * IMAGE_CHANNELS)
-    image_array = np.frombuffer(image_data, dtype=np.uint8)
-    image_array = image_array.reshape((IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS))
-    image_array = image_array[..., ::-1]
-    image = Image.fromarray(image_array)
-    tmp_image_path = Path(f'./tmp/tmp_{cam_id}.bmp').resolve()
-    tmp_image_path.parent.mkdir(parents=True, exist_ok=True)
-    image.save(tmp_image_path)
+def get_frame_buffer(cam_in_use):
+    """获取 cam_in_use 对应的预分配帧缓冲，尺寸变化时重新分配"""
+    width = IMAGE_WIDTH * 2 if cam_in_use == 3 else IMAGE_WIDTH
+    frame_shape = (IMAGE_HEIGHT, width, IMAGE_CHANNELS)
+    frame = image_frames.get(cam_in_use)
+    if frame is None or frame.shape != frame_shape:
+        frame = np.empty(frame_shape, dtype=np.uint8)
+        image_frames[cam_in_use] = frame
+    return frame
+
+def get_pic_from_socket(shm_ptr, cam_id, cam_in_use):
+    """
+    从共享内存读取一帧BGR图像，转换为RGB直接写入 cam_in_use 对应的预分配帧缓冲（不落盘）
+    双摄模式下左右摄像头分别写入同一缓冲的左右两半，无需再拼接
+    """
+    frame = get_frame_buffer(cam_in_use)
+    if cam_in_use == 3:
+        if cam_id == CAM1_ID:
+            slot = frame[:, :IMAGE_WIDTH]
+        else:
+            slot = frame[:, IMAGE_WIDTH:]
+    else:
+        slot = frame
+    # 直接在mmap上建立视图，避免先read()出一份拷贝
+    src = np.frombuffer(shm_ptr, dtype=np.uint8, count=IMAGE_HEIGHT * IMAGE_WIDTH * IMAGE_CHANNELS)
+    src = src.reshape((IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS))
+    # BGR -> RGB，拷贝时完成通道交换，不产生中间数组
+    np.copyto(slot, src[..., ::-1])
+    del src
+    if image_debug_dump:
+        dump_debug_image(f"tmp_{cam_id}.bmp", image=Image.fromarray(np.ascontiguousarray(slot)))
+
+def dump_debug_image(filename, image=None, data=None):
+    """调试用：把中间图像写入 IMAGE_DEBUG_DUMP_DIR"""
+    try:
+        dump_path = Path(IMAGE_DEBUG_DUMP_DIR).resolve() / filename
+        dump_path.parent.mkdir(parents=True, exist_ok=True)
+        if image is not None:
+            image.save(dump_path)
+        else:
+            with open(dump_path, 'wb') as f:
+                f.write(data)
+    except Exception as e:
+        logger.error(f"Failed to dump debug image {filename}: {e}")
 
 def load_config(path):
     with open(path, 'r') as file:
@@ -872,109 +1367,905 @@ def check_camera_errors(path):
         return "1"
 
 class UART:
-    def __init__(self):
-        # 读取gs501.json配置文件来确定UART端口
-        try:
-            config = load_config(CONFIG_PATH)
-            hw_name = config.get("HWName", "")
+    def __init__(self, baudrate=UART_DEFAULT_BAUDRATE, rtscts=False):
+        # 环境变量 UART_CONTROL_PORT 指定串口时直接使用（如 uart_harness.py 的伪终端）
+        uart_port = os.environ.get("UART_CONTROL_PORT")
+        if uart_port:
+            logger.info(f"Using UART port {uart_port} from UART_CONTROL_PORT")
+        else:
+            # 读取gs501.json配置文件来确定UART端口
+            try:
+                config = load_config(CONFIG_PATH)
+                hw_name = config.get("HWName", "")
             
-            # 根据HWName决定使用哪个串口
-            if hw_name == "AS_8MP":
-                uart_port = "/dev/ttymxc3"
-            else:
-                uart_port = "/dev/ttymxc2"  # 默认端口
+                # 根据HWName决定使用哪个串口
+                if hw_name == "AS_8MP":
+                    uart_port = "/dev/ttymxc3"
+                else:
+                    uart_port = "/dev/ttymxc2"  # 默认端口
             
-            logger.info(f"Using UART port {uart_port} for HWName: {hw_name}")
+                logger.info(f"Using UART port {uart_port} for HWName: {hw_name}")
             
-        except Exception as e:
-            logger.error(f"Failed to read HWName from config, using default port: {e}")
-            uart_port = "/dev/ttymxc2"
+            except Exception as e:
+                logger.error(f"Failed to read HWName from config, using default port: {e}")
+                uart_port = "/dev/ttymxc2"
         
+        self.baudrate = baudrate
+        self.rtscts = rtscts
+        self.binary_mode = False  # False: 行JSON协议(默认)，True: COBS二进制帧
+        self.compression = None  # 响应压缩模式（COMPRESSION_MODES 的键），None 表示不压缩
+        self.local = threading.local()  # 线程局部状态: 当前命令类型、后台命令的应答位置
+        self.command_label = ""  # 当前处理的命令类型，用于压缩统计
+        self.tx_lock = threading.Lock()  # 串行化所有写串口操作
+        self.tx_done = threading.Condition(self.tx_lock)  # 排队的应答全部发出时通知
+        self.tx_slots = collections.deque()  # 按命令顺序排队的应答位置，队首的后台命令未完成时后续应答在此等待
+        self.start_time = time.time()
+        self.rx_buffer = bytearray()  # 接收线程中未收完的行/帧
+        self.rx_lock = threading.Lock()  # 保护 rx_buffer 和切分方式（binary_mode）
+        self.rx_queue = queue.Queue(maxsize=UART_RX_QUEUE_SIZE)  # 完整的行/帧: (是否二进制帧, 数据)
+        self.rx_discarding = False  # 正在丢弃超长行的剩余部分，直到下一个分隔符
+        self.rx_errors = 0  # 二进制模式下丢弃的坏帧数量
+        self.rx_dropped = 0  # 接收队列满时丢弃的行/帧数量
+        self.rx_oversized = 0  # 超长而丢弃的行/帧数量
+        # timeout=None: 接收线程阻塞等待数据到达，不再100ms轮询
         self.uartport = serial.Serial(
                 port=uart_port,
-                baudrate=38400,
+                baudrate=baudrate,
                 bytesize=serial.EIGHTBITS,
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
-                timeout=0.1)
+                rtscts=rtscts,
+                timeout=None)
 
         self.uartport.reset_input_buffer()
         self.uartport.reset_output_buffer()
         time.sleep(1)
+        self.rx_thread = Thread(target=self.reader_loop, name="uart_reader", daemon=True)
+        self.rx_thread.start()
+
+    @property
+    def command_label(self):
+        return getattr(self.local, "command_label", "")
 
-    def send_serial(self, cmd): 
+    @command_label.setter
+    def command_label(self, label):
+        self.local.command_label = label
+
+    def send_serial(self, cmd, compress=True): 
         cmd = str(cmd).rstrip()
         logger.debug(f"UART send ->: {cmd}")
-        self.uartport.write((cmd+"\n").encode("utf_8"))
+        slot = getattr(self.local, "slot", None)
+        if slot is not None:
+            slot.response = cmd
+        self.write(self.encode_response(cmd, compress))
+
+    def encode_response(self, cmd, compress=True):
+        """把一条文本应答编码为发送字节：行/二进制帧，开启压缩时按需压缩"""
+        data = cmd.encode("utf_8")
+        if self.binary_mode:
+            plain = build_binary_frame(FRAME_TYPE_TEXT, data)
+        else:
+            plain = data + b"\n"
+        if compress and self.compression and len(data) >= COMPRESSION_MIN_SIZE:
+            wire = self.build_compressed(data)
+            record_compression(self.command_label, len(plain), min(len(plain), len(wire)))
+            if len(wire) < len(plain):
+                return wire
+        return plain
+
+    def build_compressed(self, data):
+        """压缩响应：二进制模式为压缩帧，行模式为 {"Z":模式,"P":"Base64"} 信封"""
+        mode_id = COMPRESSION_MODES[self.compression]
+        packed = compress_payload(data, self.compression)
+        if self.binary_mode:
+            return build_binary_frame(FRAME_TYPE_COMPRESSED, bytes([mode_id]) + packed)
+        return b'{"Z":%d,"P":"%b"}\n' % (mode_id, base64.b64encode(packed))
+
+    def send_frame(self, frame):
+        """发送已组帧（含换行或0x00分隔符）的字节数据，不再做字符串转换和编码"""
+        logger.debug(f"UART send ->: <pre-framed {len(frame)} bytes>")
+        self.write(frame)
+
+    def write(self, data):
+        """
+        按命令顺序写串口：后台命令的应答先写入它的应答位置；
+        前面还有未完成的后台命令时，其他应答排在后面，等前面的完成后一起发出
+        """
+        slot = getattr(self.local, "slot", None)
+        if slot is None or not slot.done:  # 已超时的后台命令，迟到的应答丢弃，不计入发送字节数
+            self.local.tx_bytes = getattr(self.local, "tx_bytes", 0) + len(data)
+        with self.tx_lock:
+            if slot is not None:
+                if not slot.done:
+                    slot.chunks.append(bytes(data))
+                return
+            if not self.tx_slots:
+                self.uartport.write(data)
+                return
+            if not self.tx_slots[-1].done:
+                self.tx_slots.append(ResponseSlot(done=True))
+            self.tx_slots[-1].chunks.append(bytes(data))
+
+    def open_slot(self):
+        """为一条后台命令在发送顺序中占一个位置"""
+        slot = ResponseSlot()
+        with self.tx_lock:
+            self.tx_slots.append(slot)
+        return slot
+
+    def close_slot(self, slot, fallback=None):
+        """
+        结束一个应答位置并发出队首已完成的应答；fallback 不为空时（超时）以它代替后台命令的应答。
+        位置已经结束过时返回 False
+        """
+        with self.tx_lock:
+            if slot.done:
+                return False
+            if fallback is not None:
+                slot.chunks = [fallback]
+            slot.done = True
+            while self.tx_slots and self.tx_slots[0].done:
+                for chunk in self.tx_slots.popleft().chunks:
+                    self.uartport.write(chunk)
+            if not self.tx_slots:
+                self.tx_done.notify_all()
+        return True
 
-    def receive_serial(self):
-        rcvdata = self.uartport.readline()
-        return rcvdata
+    def wait_slots(self, timeout=SLOW_COMMAND_DEADLINE * 2):
+        """等待排队的应答全部发出（后台命令最迟在期限到时结束），切换波特率/帧格式前调用"""
+        with self.tx_done:
+            if not self.tx_done.wait_for(lambda: not self.tx_slots, timeout):
+                logger.warning(f"{len(self.tx_slots)} queued responses still pending")
 
-def save_image_with_target_size(image, cam_in_use):
-    # 根据最大图像块数量动态计算目标大小
-    # Base64 编码率 4/3，所以原始数据 = Base64大小 × 0.75
-    target_size = int(max_image_blocks * send_max_length * 0.75)
-    filepath = './tmp/converted-jpg-image.jpg'
+    def reader_loop(self):
+        """接收线程：阻塞等待串口数据，每次读出已到达的全部字节并切分成完整的行/帧"""
+        while True:
+            try:
+                chunk = self.uartport.read(self.uartport.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                logger.error(f"UART read error: {e}")
+                time.sleep(1)
+                continue
+            if chunk:
+                with self.rx_lock:
+                    self.rx_buffer += chunk
+                    self.split_rx_buffer()
+
+    def split_rx_buffer(self):
+        """把 rx_buffer 中的完整行（二进制模式下为完整帧）放入接收队列，调用方持有 rx_lock"""
+        binary = self.binary_mode
+        delimiter = FRAME_DELIMITER if binary else b"\n"
+        max_size = MAX_FRAME_SIZE if binary else UART_MAX_LINE_SIZE
+        start = 0
+        with memoryview(self.rx_buffer) as view:
+            while True:
+                end = self.rx_buffer.find(delimiter, start)
+                if end < 0:
+                    break
+                if self.rx_discarding:
+                    self.rx_discarding = False  # 超长行到此结束
+                elif end - start > max_size:
+                    self.rx_oversized += 1
+                    logger.warning(f"UART {'frame' if binary else 'line'} exceeds {max_size} bytes, dropped, oversized: {self.rx_oversized}")
+                elif end > start:  # 空行和单独的分隔符（主机用于重新同步）直接跳过
+                    try:
+                        self.rx_queue.put_nowait((binary, bytes(view[start:end])))
+                    except queue.Full:
+                        self.rx_dropped += 1
+                        logger.warning(f"UART receive queue full, {end - start} bytes dropped, dropped: {self.rx_dropped}")
+                start = end + 1
+        del self.rx_buffer[:start]
+        if self.rx_discarding:
+            self.rx_buffer.clear()
+        elif len(self.rx_buffer) > max_size:
+            self.rx_oversized += 1
+            logger.warning(f"UART {'frame' if binary else 'line'} exceeds {max_size} bytes, dropped, oversized: {self.rx_oversized}")
+            self.rx_buffer.clear()
+            self.rx_discarding = True
+
+    def receive_serial(self, timeout=0.1):
+        """等待一条文本命令，超时返回空字节串"""
+        frame_type, payload = self.receive_frame(timeout)
+        return payload if frame_type == FRAME_TYPE_TEXT else b""
+
+    def receive_frame(self, timeout=0.1):
+        """
+        从接收队列取一帧，返回 (帧类型, 数据)。行模式下每行（不含换行）作为文本帧返回；
+        二进制帧校验失败或超时返回 (None, b"")
+        """
+        try:
+            binary, encoded = self.rx_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None, b""
+        if not binary:
+            return FRAME_TYPE_TEXT, encoded
 
-    # 根据 target_size 分段设置初始 quality
+        try:
+            frame_type, payload = parse_binary_frame(encoded)
+        except ValueError as e:
+            self.rx_errors += 1
+            logger.warning(f"Bad binary frame ({len(encoded)} bytes): {e}, errors: {self.rx_errors}")
+            return None, b""
+        if frame_type == FRAME_TYPE_TEXT:
+            logger.debug(f"UART recv frame <-: text {len(payload)} bytes")
+        else:
+            logger.debug(f"UART recv frame <-: type {frame_type}, {len(payload)} bytes")
+        return frame_type, payload
+
+    def set_binary_mode(self, enable):
+        """切换行JSON协议/二进制帧模式，已写入的数据先发送完毕"""
+        self.wait_slots()
+        self.uartport.flush()
+        with self.rx_lock:
+            # 已切分的行仍按原格式处理，尚未收完的数据按新格式重新切分
+            self.binary_mode = enable
+            self.rx_discarding = False
+            self.split_rx_buffer()
+        logger.info(f"UART framing set to {'binary' if enable else 'line'}")
+
+    def set_baudrate(self, baudrate, rtscts=False):
+        """等待已写入的数据发送完毕后切换波特率和RTS/CTS流控，并丢弃切换前残留的输入"""
+        self.wait_slots()
+        self.uartport.flush()
+        self.uartport.baudrate = baudrate
+        self.uartport.rtscts = rtscts
+        self.uartport.reset_input_buffer()
+        with self.rx_lock:
+            self.rx_buffer.clear()
+            self.rx_discarding = False
+        self.baudrate = baudrate
+        self.rtscts = rtscts
+        logger.info(f"UART baudrate set to {baudrate}, RTS/CTS: {int(rtscts)}")
+
+class ResponseSlot:
+    """一条后台命令在应答发送顺序中的位置"""
+    def __init__(self, done=False):
+        self.chunks = []  # 待发送的字节数据
+        self.response = None  # 最后一条文本应答，作为该命令的最近状态
+        self.done = done
+
+class ImageBlockSet:
+    """
+    一组完整的图像块。构造时把所有 {"BlockN":"..."} 行预先组帧到一块连续缓冲，
+    发送第N块只需按偏移表切片，发布后只读
+    """
+    def __init__(self, data, block_length, codec="jpeg", crop_boxes=None, key=b"Block",
+                 frame_type=FRAME_TYPE_IMAGE_BLOCK):
+        self.data = data  # 完整的Base64图像数据(bytes)
+        self.block_length = block_length
+        self.frame_type = frame_type  # 二进制模式下的帧类型
+        self.binary_frames = {}  # 二进制帧按需组帧后缓存
+        self.codec = codec  # 编码后端名称
+        self.crop_boxes = crop_boxes  # ROI裁剪框 {cam_id: (x0, y0, x1, y1)}，整帧时为None
+        count = math.ceil(len(data) / block_length)
+        lines = [b'{"%b%d":"%b"}\n' % (key, x + 1, data[x * block_length:(x + 1) * block_length])
+                 for x in range(count)]
+        self.offsets = [0]
+        for line in lines:
+            self.offsets.append(self.offsets[-1] + len(line))
+        self.wire = b"".join(lines)
+        self.view = memoryview(self.wire)
+        # 整幅图像（Base64解码后）的CRC32，?PSR| 汇总行中返回，主机拼接后校验
+        self.image_crc32 = format(zlib.crc32(base64.b64decode(data)) & 0xffffffff, "08x")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def block(self, index):
+        """第index块的Base64数据（从0开始）"""
+        return self.data[index * self.block_length:(index + 1) * self.block_length]
+
+    def frame(self, index):
+        """第index块的完整发送帧（从0开始），零拷贝切片"""
+        return self.view[self.offsets[index]:self.offsets[index + 1]]
+
+    def binary_frame(self, index):
+        """
+        第index块的二进制帧（从0开始）：块序号 + Base64解码后的原始数据。
+        block_length 为4的倍数，每块可单独解码，块划分与文本模式一致
+        """
+        frame = self.binary_frames.get(index)
+        if frame is None:
+            frame = build_binary_frame(self.frame_type, struct.pack(">H", index + 1) + base64.b64decode(self.block(index)))
+            self.binary_frames[index] = frame
+        return frame
+
+def compress_payload(data, mode):
+    """按模式压缩一条响应。预设字典的压缩器只初始化一次，之后每条响应复制使用"""
+    template = compression_templates.get(mode)
+    if template is None:
+        if mode == "zdict":
+            template = zlib.compressobj(9, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, COMPRESSION_DICTIONARY)
+        else:
+            template = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+        compression_templates[mode] = template
+    compressor = template.copy()
+    return compressor.compress(data) + compressor.flush()
+
+def record_compression(label, raw_size, sent_size):
+    """累计每类命令的原始/实际发送字节数，定期输出节省情况"""
+    global compression_count
+    stats = compression_stats.setdefault(label or "other", {"count": 0, "raw": 0, "sent": 0})
+    stats["count"] += 1
+    stats["raw"] += raw_size
+    stats["sent"] += sent_size
+    compression_count += 1
+    if compression_count % COMPRESSION_LOG_INTERVAL == 0:
+        log_compression_stats()
+
+def log_compression_stats():
+    summary = ", ".join(f"{label}: {s['raw'] - s['sent']}B saved ({s['sent'] * 100 // max(1, s['raw'])}% of {s['raw']}B, {s['count']} msgs)"
+                        for label, s in sorted(compression_stats.items()))
+    logger.info(f"Compression stats: {summary}")
+
+def cobs_encode(data):
+    """COBS编码，输出不含0x00，可用0x00作为帧分隔符"""
+    out = bytearray()
+    for segment in bytes(data).split(b"\x00"):
+        while len(segment) >= 254:
+            out.append(0xFF)
+            out += segment[:254]
+            segment = segment[254:]
+        out.append(len(segment) + 1)
+        out += segment
+    return bytes(out)
+
+def cobs_decode(data):
+    """COBS解码，数据不合法时抛出 ValueError"""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code == 0 or i + code > len(data):
+            raise ValueError("invalid COBS data")
+        out += data[i + 1:i + code]
+        i += code
+        if code < 0xFF and i < len(data):
+            out.append(0)
+    return bytes(out)
+
+def build_binary_frame(frame_type, body=b""):
+    """组装一个完整的二进制帧（含结尾的0x00分隔符）"""
+    payload = bytes([frame_type]) + bytes(body)
+    return cobs_encode(payload + struct.pack(">I", zlib.crc32(payload) & 0xffffffff)) + FRAME_DELIMITER
+
+def parse_binary_frame(encoded):
+    """解析去掉分隔符的二进制帧，返回 (帧类型, 数据)，CRC不符时抛出 ValueError"""
+    payload = cobs_decode(encoded)
+    if len(payload) < 5:
+        raise ValueError("frame too short")
+    if struct.unpack(">I", payload[-4:])[0] != zlib.crc32(payload[:-4]) & 0xffffffff:
+        raise ValueError("CRC mismatch")
+    return payload[0], payload[1:-4]
+
+def get_initial_jpeg_quality(target_size, cam_in_use):
+    """没有历史记录时，根据 target_size 分段给出初始 quality"""
     if cam_in_use == 3:  # 双摄像头
         if target_size < 20000:
-            quality = 20    # 小容量：低质量
+            return 20    # 小容量：低质量
         elif target_size < 40000:
-            quality = 60    # 中容量：中等质量
+            return 60    # 中容量：中等质量
+        return 85        # 大容量：高质量
+    # 单摄像头
+    if target_size < 20000:
+        return 35        # 小容量：低质量
+    elif target_size < 40000:
+        return 80        # 中容量：中等质量
+    return 95            # 大容量：高质量
+
+def get_available_codecs():
+    """当前Pillow支持的编码后端"""
+    return [name for name, codec in IMAGE_CODECS.items()
+            if codec["format"] != "WEBP" or features.check("webp")]
+
+def get_auto_codecs():
+    """auto模式参与评估的后端"""
+    return [name for name in get_available_codecs() if IMAGE_CODECS[name].get("auto", True)]
+
+def encode_image(image, quality, buffer, codec_name):
+    """在复用缓冲中按指定后端编码一次，返回编码后的字节数。One cycle takes about 8ms"""
+    codec = IMAGE_CODECS[codec_name]
+    params = dict(codec["params"])
+    if codec["format"] == "JPEG" and codec["mode"] == "RGB":
+        params["subsampling"] = CHROMA_SUBSAMPLING[image_chroma_subsampling]
+    buffer.seek(0)
+    buffer.truncate()
+    image.save(buffer, format=codec["format"], quality=quality, **params)
+    return buffer.tell()
+
+def search_image_quality(image, cam_in_use, codec_name, target_size, buffer=None, history_key=None):
+    """
+    在大小预算内搜索 codec_name 可用的最高 quality
+    以历史 quality 为起点，先按步长倍增确定区间再二分
+    buffer/history_key 默认为编码线程的缓冲和历史记录，其他调用方传入自己的，避免互相干扰
+    返回 (编码数据, quality, 编码次数)
+    """
+    if buffer is None:
+        buffer = image_encode_buffer
+    if history_key is None:
+        history_key = (codec_name, image_chroma_subsampling, cam_in_use, max_image_blocks)
+    if IMAGE_CODECS[codec_name]["mode"] != image.mode:
+        image = image.convert(IMAGE_CODECS[codec_name]["mode"])
+
+    quality = jpeg_quality_history.get(history_key)
+    if quality is None:
+        quality = get_initial_jpeg_quality(target_size, cam_in_use)
+
+    fit_quality = None   # 已知满足大小限制的最高quality
+    fail_quality = None  # 已知超出大小限制的最低quality
+    image_data = None
+    step = JPEG_QUALITY_STEP
+    encodes = 0
+    while True:
+        size = encode_image(image, quality, buffer, codec_name)
+        encodes += 1
+        logger.debug(f"{codec_name} quality {quality}: {size} bytes (target {target_size})")
+        if size <= target_size:
+            fit_quality = quality
+            image_data = buffer.getvalue()
+            if size >= target_size * JPEG_SIZE_FILL_RATIO or quality >= JPEG_QUALITY_MAX:
+                break
         else:
-            quality = 85    # 大容量：高质量
-    else:  # 单摄像头
-        if target_size < 20000:
-            quality = 35    # 小容量：低质量
-        elif target_size < 40000:
-            quality = 80    # 中容量：中等质量
+            fail_quality = quality
+            if quality <= JPEG_QUALITY_MIN:
+                break
+
+        if fit_quality is not None and fail_quality is not None:
+            if fail_quality - fit_quality <= JPEG_QUALITY_TOLERANCE:
+                break
+            quality = (fit_quality + fail_quality) // 2
+        elif fail_quality is None:
+            # 目前都满足，向上探测
+            quality = min(fit_quality + step, JPEG_QUALITY_MAX)
+            step *= 2
         else:
-            quality = 95    # 大容量：高质量
-    while quality > 0:
-        logger.debug(f"*******************Quality: {quality}")
-        # save image to tmp_file. One cycle takes about 8ms
-        temp_filepath = filepath.replace('.jpg', '_temp.jpg')
-        image.save(temp_filepath, format='JPEG', quality=quality)
-        # check image size
-        if os.path.getsize(temp_filepath) <= target_size:
-            os.rename(temp_filepath, filepath)
-            return
-        if quality <= 10:
-            quality -= 2
+            # 目前都超限，向下探测
+            quality = max(fail_quality - step, JPEG_QUALITY_MIN)
+            step *= 2
+
+    if fit_quality is not None:
+        jpeg_quality_history[history_key] = fit_quality
+    else:
+        # 最低质量仍超限，使用最后一次编码结果
+        logger.warning(f"{codec_name} still exceeds target size {target_size} at quality {quality}")
+        fit_quality = quality
+        image_data = buffer.getvalue()
+    return image_data, fit_quality, encodes
+
+def compute_image_psnr(original, image_data):
+    """解码编码结果并计算与原图(RGB数组)的PSNR，作为画质评分"""
+    decoded = np.asarray(Image.open(io.BytesIO(image_data)).convert("RGB"), dtype=np.float32)
+    mse = float(np.mean((decoded - original) ** 2))
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255.0 ** 2 / mse)
+
+def score_image_codecs(image, cam_in_use, target_size, codec_names):
+    """对 codec_names 中的后端在同一预算下搜索quality并评分，返回 (最佳后端, 数据, quality, 总编码次数)"""
+    original = np.asarray(image, dtype=np.float32)
+    best = None
+    total_encodes = 0
+    for codec_name in codec_names:
+        image_data, quality, encodes = search_image_quality(image, cam_in_use, codec_name, target_size)
+        total_encodes += encodes
+        psnr = compute_image_psnr(original, image_data)
+        logger.info(f"Codec score {codec_name}: quality {quality}, {len(image_data)} bytes, PSNR {psnr:.2f} dB")
+        # 优先满足预算，其次PSNR高，再次字节少
+        score = (len(image_data) <= target_size, psnr, -len(image_data))
+        if best is None or score > best[0]:
+            best = (score, codec_name, image_data, quality)
+    logger.info(f"Codec auto selection: {best[1]} for cam_in_use={cam_in_use}, blocks={max_image_blocks}")
+    return best[1], best[2], best[3], total_encodes
+
+def save_image_with_target_size(image, cam_in_use):
+    """按目标大小用选定的后端编码图像，在复用的内存缓冲中完成，返回编码后的字节"""
+    # 根据最大图像块数量动态计算目标大小
+    # Base64 编码率 4/3，所以原始数据 = Base64大小 × 0.75
+    target_size = int(max_image_blocks * send_max_length * 0.75)
+
+    if image_codec == IMAGE_CODEC_AUTO:
+        selection_key = (cam_in_use, max_image_blocks)
+        selection = image_codec_selection.get(selection_key)
+        candidates = [name for name in get_auto_codecs() if selection is None or name != selection["codec"]]
+        if selection is None:
+            # 首次评估全部后端
+            codec_name, image_data, quality, encodes = score_image_codecs(image, cam_in_use, target_size, candidates)
+            image_codec_selection[selection_key] = {"codec": codec_name, "cycles": 0, "next": 0}
+        elif selection["cycles"] >= IMAGE_CODEC_RESCORE_CYCLES and candidates:
+            # 重新评估时只与一个候选后端比较，避免在编码线程上对全部后端做完整的quality搜索
+            challenger = candidates[selection["next"] % len(candidates)]
+            codec_name, image_data, quality, encodes = score_image_codecs(
+                image, cam_in_use, target_size, [selection["codec"], challenger])
+            selection.update({"codec": codec_name, "cycles": 0, "next": selection["next"] + 1})
         else:
-            quality -= 5
-    os.rename(temp_filepath, filepath)
+            selection["cycles"] += 1
+            codec_name = selection["codec"]
+            image_data, quality, encodes = search_image_quality(image, cam_in_use, codec_name, target_size)
+    else:
+        codec_name = image_codec
+        image_data, quality, encodes = search_image_quality(image, cam_in_use, codec_name, target_size)
+
+    image_encode_stats["cycles"] += 1
+    image_encode_stats["encodes"] += encodes
+    image_encode_stats["last_encodes"] = encodes
+    image_encode_stats["last_quality"] = quality
+    image_encode_stats["last_size"] = len(image_data)
+    image_encode_stats["last_codec"] = codec_name
+    logger.info(f"{codec_name} quality {quality} selected after {encodes} encodes "
+                f"({len(image_data)}/{target_size} bytes, "
+                f"avg {image_encode_stats['encodes'] / image_encode_stats['cycles']:.2f} encodes/cycle)")
+
+    if image_debug_dump:
+        dump_debug_image(f"converted-image.{IMAGE_CODECS[codec_name]['format'].lower()}", data=image_data)
+    return image_data
+
+def set_image_codec(codec_name, subsampling=None):
+    """
+    设置图像编码后端（及JPEG色度抽样），两项分别校验，只保留不支持的那一项的原值，有不支持的参数时返回False
+    在 image_pipeline_lock 内修改，编码线程不会在一次编码中途看到新的后端
+    """
+    global image_codec, image_chroma_subsampling
+    valid = True
+    with image_pipeline_lock:
+        if codec_name != IMAGE_CODEC_AUTO and codec_name not in get_available_codecs():
+            logger.error(f"Unsupported image codec: {codec_name}, available: {get_available_codecs()}")
+            valid = False
+        else:
+            image_codec = codec_name
+        if subsampling is not None and subsampling not in CHROMA_SUBSAMPLING:
+            logger.error(f"Unsupported chroma subsampling: {subsampling}")
+            valid = False
+        elif subsampling is not None:
+            image_chroma_subsampling = subsampling
+        image_codec_selection.clear()
+    logger.info(f"Image codec set to: {image_codec} (subsampling {image_chroma_subsampling})")
+    return valid
+
+def compute_frame_signature(cam_in_use):
+    """对当前使用的摄像头帧做降采样，作为变化检测的签名"""
+    step = IMAGE_CHANGE_SAMPLE_STEP
+    return image_frames[cam_in_use][::step, ::step].astype(np.int16)
+
+def cell_mean_diffs(diff, cell):
+    """把逐采样点的差值图 (H, W) 按 cell×cell 个采样点分格，返回各小格的平均差，边缘不足一格的部分补零"""
+    rows = math.ceil(diff.shape[0] / cell)
+    cols = math.ceil(diff.shape[1] / cell)
+    padded = np.zeros((rows * cell, cols * cell), dtype=np.float32)
+    padded[:diff.shape[0], :diff.shape[1]] = diff
+    return padded.reshape(rows, cell, cols, cell).mean(axis=(1, 3))
+
+def is_frame_changed(cam_in_use, crop_boxes=None):
+    """判断当前帧相对上次编码帧是否有明显变化，并更新命中统计"""
+    roi_key = tuple(sorted(crop_boxes.items())) if crop_boxes else None
+    key = (cam_in_use, max_image_blocks, image_codec, image_chroma_subsampling, roi_key)
+    signature = compute_frame_signature(cam_in_use)
+    last_signature = image_change_state["signature"]
+    age = time.time() - image_change_state["time"]
+
+    if (image_change_threshold >= 0 and str_image
+            and image_change_state["key"] == key
+            and (image_change_max_age <= 0 or age < image_change_max_age)
+            and last_signature is not None and last_signature.shape == signature.shape):
+        cells = cell_mean_diffs(np.abs(signature - last_signature).mean(axis=2),
+                                IMAGE_CHANGE_CELL_SIZE // IMAGE_CHANGE_SAMPLE_STEP)
+        diff = float(cells.max())
+        if diff <= image_change_threshold:
+            image_change_stats["hits"] += 1
+            logger.debug(f"Frame unchanged (max cell diff {diff:.2f} <= {image_change_threshold}, age {age:.0f}s), "
+                         f"reusing {len(str_image)} blocks "
+                         f"(hits: {image_change_stats['hits']}, misses: {image_change_stats['misses']})")
+            return False
+
+    # 只在重新编码时更新签名，避免缓慢变化被逐帧累积忽略
+    image_change_stats["misses"] += 1
+    image_change_state["key"] = key
+    image_change_state["signature"] = signature
+    image_change_state["time"] = time.time()
+    return True
+
+def parse_image_size(value):
+    """解析 "480*480" 形式的图像尺寸，返回 (宽, 高)，无效时返回None"""
+    try:
+        width, height = (int(float(part)) for part in str(value).split("*"))
+    except (TypeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return (width, height)
+
+def update_roi_coordinates(cam_id, drawing_data):
+    """缓存摄像头drawing响应中的坐标及其画布尺寸(ImageSize)，供ROI裁剪使用；坐标有变化时返回True"""
+    if not isinstance(drawing_data, dict):
+        return False
+    coordinates = drawing_data.get("coordinates")
+    if not isinstance(coordinates, dict):
+        return False
+    entry = (coordinates, parse_image_size(drawing_data.get("ImageSize")))
+    changed = roi_coordinates.get(cam_id) != entry
+    roi_coordinates[cam_id] = entry
+    return changed
+
+def get_roi_box(cam_id):
+    """
+    计算单个摄像头的裁剪框 (x0, y0, x1, y1)：所有线/区域坐标的并集加边距
+    drawing带有 ImageSize 时把坐标从该画布按比例换算为输入张量像素坐标，否则按输入张量像素坐标处理；
+    超出范围的部分被截断，没有坐标时返回整帧
+    """
+    coordinates, canvas_size = roi_coordinates.get(cam_id, ({}, None))
+    scale_x, scale_y = 1.0, 1.0
+    if canvas_size:
+        scale_x = IMAGE_WIDTH / canvas_size[0]
+        scale_y = IMAGE_HEIGHT / canvas_size[1]
+    points = []
+    for coord_list in coordinates.values():
+        if isinstance(coord_list, list):
+            for coord in coord_list:
+                if isinstance(coord, dict) and 'x' in coord and 'y' in coord:
+                    points.append((int(float(coord['x']) * scale_x), int(float(coord['y']) * scale_y)))
+    if not points:
+        return (0, 0, IMAGE_WIDTH, IMAGE_HEIGHT)
+
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    x0 = max(0, min(xs) - image_roi_margin)
+    y0 = max(0, min(ys) - image_roi_margin)
+    x1 = min(IMAGE_WIDTH, max(xs) + image_roi_margin + 1)
+    y1 = min(IMAGE_HEIGHT, max(ys) + image_roi_margin + 1)
+    # 保证最小尺寸
+    if x1 - x0 < IMAGE_ROI_MIN_SIZE:
+        x0 = max(0, min(x0, IMAGE_WIDTH - IMAGE_ROI_MIN_SIZE))
+        x1 = min(IMAGE_WIDTH, x0 + IMAGE_ROI_MIN_SIZE)
+    if y1 - y0 < IMAGE_ROI_MIN_SIZE:
+        y0 = max(0, min(y0, IMAGE_HEIGHT - IMAGE_ROI_MIN_SIZE))
+        y1 = min(IMAGE_HEIGHT, y0 + IMAGE_ROI_MIN_SIZE)
+    return (x0, y0, x1, y1)
+
+def get_roi_crop_boxes(cam_in_use):
+    """
+    计算当前配置下各摄像头的裁剪框，ROI关闭时返回None
+    双摄模式下两侧使用相同的纵向范围，以便左右拼接
+    """
+    if not image_roi_enabled:
+        return None
+    boxes = {}
+    if cam_in_use == 1 or cam_in_use == 3:
+        boxes[CAM1_ID] = get_roi_box(CAM1_ID)
+    if cam_in_use == 2 or cam_in_use == 3:
+        boxes[CAM2_ID] = get_roi_box(CAM2_ID)
+    if cam_in_use == 3:
+        y0 = min(box[1] for box in boxes.values())
+        y1 = max(box[3] for box in boxes.values())
+        boxes = {cam_id: (box[0], y0, box[2], y1) for cam_id, box in boxes.items()}
+    return boxes
+
+def crop_frame_to_roi(frame, cam_in_use, crop_boxes):
+    """按裁剪框从帧缓冲中取出ROI区域，双摄时左右拼接"""
+    if cam_in_use == 3:
+        x0a, y0, x1a, y1 = crop_boxes[CAM1_ID]
+        x0b, _, x1b, _ = crop_boxes[CAM2_ID]
+        return np.concatenate((frame[y0:y1, x0a:x1a], frame[y0:y1, IMAGE_WIDTH + x0b:IMAGE_WIDTH + x1b]), axis=1)
+    x0, y0, x1, y1 = crop_boxes[cam_in_use]
+    return np.ascontiguousarray(frame[y0:y1, x0:x1])
 
 def update_sim_attribute(cam_in_use):
     global str_image
     if emer_imgage_send == 1:
         return
-    if cam_in_use == 1:
-        image = Image.open('./tmp/tmp_1.bmp')
-    elif cam_in_use == 2:
-        image = Image.open('./tmp/tmp_2.bmp')
-    elif cam_in_use == 3:
-        image1 = Image.open('./tmp/tmp_1.bmp')
-        image2 = Image.open('./tmp/tmp_2.bmp')
-        image = Image.new('RGB', (image1.width + image2.width, max(image1.height, image2.height)))
-        image.paste(image1, (0, 0))
-        image.paste(image2, (image1.width, 0))
-
-    save_image_with_target_size(image, cam_in_use)
-
-    with open('./tmp/converted-jpg-image.jpg', 'rb') as image2string:
-        converted_string = base64.b64encode(image2string.read()).decode()
-    
-    str_len = len(converted_string)
-    send_time = math.ceil(str_len / send_max_length)
-    str_image = []
-    for x in range(send_time):
-        str_image.append(converted_string[x * send_max_length:(x + 1) * send_max_length])
+    crop_boxes = get_roi_crop_boxes(cam_in_use)
+    if not is_frame_changed(cam_in_use, crop_boxes):
+        return
+    frame = image_frames[cam_in_use]
+    if crop_boxes:
+        frame = crop_frame_to_roi(frame, cam_in_use, crop_boxes)
+    # 帧缓冲已是拼接好的RGB图像，直接交给编码器
+    image = Image.fromarray(frame)
+
+    image_data = save_image_with_target_size(image, cam_in_use)
+    converted_data = base64.b64encode(image_data)
+    str_len = len(converted_data)
+    # 整体替换发布，读取方拿到的始终是完整的一组图像块
+    str_image = ImageBlockSet(converted_data, send_max_length, image_encode_stats["last_codec"], crop_boxes)
     
     # 打印图像块数信息
-    logger.info(f"Image saved and split into {len(str_image)} blocks (total size: {str_len} bytes, block size: {send_max_length} bytes)")
+    logger.info(f"Image saved and split into {len(str_image)} blocks (total size: {str_len} bytes, block size: {send_max_length} bytes, "
+                f"unchanged frames reused: {image_change_stats['hits']}/{image_change_stats['hits'] + image_change_stats['misses']})")
+
+def refresh_image_blocks(cam_in_use, alert=False):
+    """从共享内存取图并编码，更新 str_image；alert 为 True 时同时保存为报警图像"""
+    global alert_image, image_refresh_time
+    with image_pipeline_lock:
+        if cam_in_use == 1 or cam_in_use == 3:
+            get_pic_from_socket(cam1_image_shm_ptr, CAM1_ID, cam_in_use)
+        if cam_in_use == 2 or cam_in_use == 3:
+            get_pic_from_socket(cam2_image_shm_ptr, CAM2_ID, cam_in_use)
+        update_sim_attribute(cam_in_use)
+        image_refresh_time = time.time()
+        if alert:
+            alert_image = str_image
+
+def pin_image_blocks():
+    """锁定最新发布的图像块，供本周期的 ?PS5+ 读取；紧急模式下锁定报警图像"""
+    global pinned_image
+    if emer_mode == 1 and alert_image:
+        pinned_image = alert_image
+    else:
+        pinned_image = str_image
+    return pinned_image
+
+def send_image_block(uart, image_blocks, index):
+    """
+    发送 ?PS<index> 对应的图像块（index 从5开始），超出实际块数时发送空包。
+    紧急模式下从第一块开始发送报警图像，最后一块（或最大块数对应的空包）发送后结束紧急模式
+    """
+    global emer_mode, emer_imgage_send
+
+    image_demand.set()
+    block_index = index - 5  # 计算实际的数组索引
+    if block_index < len(image_blocks):
+        # 发送实际存在的图像块
+        if block_index == 0 and emer_mode == 1:
+            emer_imgage_send = 1
+        if uart.binary_mode:
+            uart.send_frame(image_blocks.binary_frame(block_index))
+        else:
+            uart.send_frame(image_blocks.frame(block_index))
+
+        # 检查是否发送完最后一块
+        if block_index == len(image_blocks) - 1 and emer_imgage_send == 1:
+            emer_imgage_send = 0
+            emer_mode = 0
+            bump_state_version()
+            logger.debug(f"Emergency mode image sending completed at block {block_index + 1}")
+    else:
+        # 超出实际图像块范围但在最大范围内，返回空包
+        if uart.binary_mode:
+            uart.send_frame(build_binary_frame(FRAME_TYPE_IMAGE_BLOCK, struct.pack(">H", block_index + 1)))
+        else:
+            uart.send_frame(EMPTY_BLOCK_FRAMES[block_index])
+        # 如果在紧急模式下到达最大索引，结束紧急模式
+        if index == (4 + max_image_blocks) and emer_imgage_send == 1:
+            emer_imgage_send = 0
+            emer_mode = 0
+            bump_state_version()
+            logger.debug(f"Emergency mode ended at index {index}, actual blocks: {len(image_blocks)}")
+
+def image_encoder_thread():
+    """后台编码线程，持续把最新帧编码为图像块并发布"""
+    logger.info(f"Image encoder thread started, interval: {image_encode_interval}s")
+    while True:
+        woken = image_encoder_wakeup.wait(image_encode_interval)
+        image_encoder_wakeup.clear()
+        # 紧急模式下保留报警时的图像，直到发送完成
+        if emer_mode == 1:
+            continue
+        # 上次编码后主机没有读取过图像，且配置未变化时不取图
+        if not woken and not image_demand.is_set():
+            continue
+        image_demand.clear()
+        try:
+            refresh_image_blocks(cam_in_use)
+        except Exception as e:
+            logger.error(f"Image encoder error: {e}")
+            time.sleep(1)
+
+def get_changed_tiles(frame, reference):
+    """
+    比较两帧，返回变化超过阈值的图块序号列表（按行优先编号）
+    先按16像素小格求平均差，图块内任一小格超过阈值即视为变化，局部小变化不会被整块平均掉
+    """
+    step = DELTA_SAMPLE_STEP
+    cell = DELTA_CELL_SIZE // step  # 每个小格的采样点数（边长）
+    diff = np.abs(frame[::step, ::step].astype(np.int16) - reference[::step, ::step]).mean(axis=2)
+    cells = cell_mean_diffs(diff, cell)
+
+    tile_cells = DELTA_TILE_SIZE // DELTA_CELL_SIZE
+    tile_cols = math.ceil(frame.shape[1] / DELTA_TILE_SIZE)
+    tile_rows = math.ceil(frame.shape[0] / DELTA_TILE_SIZE)
+    changed = []
+    for row in range(tile_rows):
+        for col in range(tile_cols):
+            tile_diff = cells[row * tile_cells:(row + 1) * tile_cells, col * tile_cells:(col + 1) * tile_cells]
+            if tile_diff.size and float(tile_diff.max()) > delta_tile_threshold:
+                changed.append(row * tile_cols + col)
+    return changed
+
+def build_delta_strip(frame, tiles):
+    """把变化的图块横向拼接成一条图像，边缘不足一块的部分补零"""
+    tile = DELTA_TILE_SIZE
+    cols = math.ceil(frame.shape[1] / tile)
+    strip = np.zeros((tile, tile * len(tiles), IMAGE_CHANNELS), dtype=np.uint8)
+    for n, tile_index in enumerate(tiles):
+        row, col = divmod(tile_index, cols)
+        part = frame[row * tile:(row + 1) * tile, col * tile:(col + 1) * tile]
+        strip[:part.shape[0], n * tile:n * tile + part.shape[1]] = part
+    return strip
+
+def apply_delta_tiles(reference, frame, tiles):
+    """返回参考帧的副本，其中 tiles 中的图块替换为当前帧的像素，未发送的图块保持主机持有的内容"""
+    tile = DELTA_TILE_SIZE
+    cols = math.ceil(reference.shape[1] / tile)
+    updated = reference.copy()
+    for tile_index in tiles:
+        row, col = divmod(tile_index, cols)
+        area = (slice(row * tile, (row + 1) * tile), slice(col * tile, (col + 1) * tile))
+        updated[area] = frame[area]
+    return updated
+
+def build_delta_frame(cam_in_use, force_keyframe=False):
+    """
+    生成一帧关键帧或增量帧，结果图像块保存在 delta_state["blocks"]，返回给主机的帧头
+    关键帧：整帧JPEG；增量帧：变化图块按序横向拼接成一条JPEG，帧头列出图块序号
+    参考帧只更新实际发送的图块，低于阈值的缓慢变化会持续累积直到超过阈值，而不会被整帧替换掉；
+    参考帧是原始像素而不是主机解码后的JPEG（与JPEG比较时编码噪声会让所有图块都超过阈值），
+    主机端未变化图块的JPEG损失由每 DELTA_KEYFRAME_INTERVAL 帧一次的关键帧刷新
+    """
+    target_size = int(max_image_blocks * send_max_length * 0.75)
+    with image_pipeline_lock:
+        if cam_in_use == 1 or cam_in_use == 3:
+            get_pic_from_socket(cam1_image_shm_ptr, CAM1_ID, cam_in_use)
+        if cam_in_use == 2 or cam_in_use == 3:
+            get_pic_from_socket(cam2_image_shm_ptr, CAM2_ID, cam_in_use)
+        frame = image_frames[cam_in_use].copy()
+
+    reference = delta_state["reference"]
+    keyframe = (force_keyframe or reference is None
+                or delta_state["reference_key"] != cam_in_use
+                or reference.shape != frame.shape
+                or delta_state["quality"] is None
+                or delta_state["since_keyframe"] >= DELTA_KEYFRAME_INTERVAL)
+
+    tiles = []
+    image_data = b""
+    updated = reference
+    if not keyframe:
+        tiles = get_changed_tiles(frame, reference)
+        if tiles:
+            strip = Image.fromarray(build_delta_strip(frame, tiles))
+            encode_image(strip, delta_state["quality"], delta_encode_buffer, "jpeg")
+            image_data = delta_encode_buffer.getvalue()
+            if len(image_data) > target_size:
+                # 增量超出块数预算，改发关键帧
+                logger.info(f"Delta frame {len(image_data)} bytes exceeds target {target_size}, sending keyframe")
+                keyframe = True
+            else:
+                updated = apply_delta_tiles(reference, frame, tiles)
+    if keyframe:
+        image_data, quality, _ = search_image_quality(Image.fromarray(frame), cam_in_use, "jpeg", target_size,
+                                                      buffer=delta_encode_buffer,
+                                                      history_key=("delta", cam_in_use, max_image_blocks))
+        delta_state["quality"] = quality
+        updated = frame
+        tiles = []
+
+    delta_state["seq"] += 1
+    delta_state["pending"] = {"seq": delta_state["seq"], "frame": updated, "key": cam_in_use, "keyframe": keyframe}
+    delta_state["blocks"] = ImageBlockSet(base64.b64encode(image_data), send_max_length, "jpeg", key=b"DBlock",
+                                          frame_type=FRAME_TYPE_DELTA_BLOCK)
+
+    header = {
+        "DeltaSeq": delta_state["seq"],
+        "KeyFrame": int(keyframe),
+        "Width": int(frame.shape[1]),
+        "Height": int(frame.shape[0]),
+        "TileSize": DELTA_TILE_SIZE,
+        "Tiles": tiles,
+        "TotalBlocks": len(delta_state["blocks"])
+    }
+    logger.info(f"Delta frame {delta_state['seq']}: keyframe={int(keyframe)}, tiles={len(tiles)}, "
+                f"{len(image_data)} bytes, {len(delta_state['blocks'])} blocks")
+    return header
+
+def acknowledge_delta_frame(seq):
+    """主机确认已收到seq帧，将其作为后续增量的参考帧"""
+    pending = delta_state["pending"]
+    if pending is None or pending["seq"] != seq:
+        logger.warning(f"Delta ack for unknown frame {seq}")
+        return False
+    delta_state["reference"] = pending["frame"]
+    delta_state["reference_key"] = pending["key"]
+    delta_state["since_keyframe"] = 0 if pending["keyframe"] else delta_state["since_keyframe"] + 1
+    delta_state["pending"] = None
+    return True
 
 def handle_assetmnt_alert(camera_id):
     """处理ASSETMNT事件（资产评估/行人报警）- 在独立线程中执行"""
@@ -995,14 +2286,13 @@ def handle_assetmnt_alert(camera_id):
         cds_alerts_received = True
         # Set emergency mode when alert received
         emer_mode = 1
+        bump_state_version()
         logger.info(f"emer_mode set to {emer_mode} by ASSETMNT alert from {camera_id} camera")
 
         # Save images to buffer when emer_mode is set to 1
-        if cam_in_use == 1 or cam_in_use == 3:
-            get_pic_from_socket(cam1_image_shm_ptr, CAM1_ID)
-        if cam_in_use == 2 or cam_in_use == 3:
-            get_pic_from_socket(cam2_image_shm_ptr, CAM2_ID)
-        update_sim_attribute(cam_in_use)
+        refresh_image_blocks(cam_in_use, alert=True)
+        # 报警图像立即生效，主机无需等待下一次 ?OBdata
+        pin_image_blocks()
 
 def handle_sdk_client_connection(client_socket, client_address):
     """处理来自SDK的单个客户端连接"""
@@ -1076,6 +2366,11 @@ def handle_sdk_client_connection(client_socket, client_address):
                         )
                         alert_thread.start()
 
+                    # 摄像头参数变化通知，立即刷新参数缓存
+                    elif event_type == "camera_param":
+                        logger.info(f"Camera param changed: camera={camera_id}")
+                        camera_param_wakeup.set()
+
                     # 其他事件类型
                     elif event_type == "parking":
                         logger.info(f"Received parking event")
@@ -1248,6 +2543,29 @@ def start_update_program(file_path):
         return False
     return True
 
+def negotiate_baudrate(uart, baudrate, rtscts=False):
+    """
+    BAUD|<rate>[,<rtscts>] 握手：先以原波特率应答，切换后等待主机在新波特率下发送 BAUDACK|<rate>，
+    确认后以新波特率回复 {"BaudrateConfirmed": rate}；超时未确认则恢复原波特率和流控设置
+    """
+    old_baudrate, old_rtscts = uart.baudrate, uart.rtscts
+    uart.send_serial(json.dumps({"Baudrate": baudrate, "RTSCTS": int(rtscts)}))
+    uart.set_baudrate(baudrate, rtscts)
+
+    ack = f"BAUDACK|{baudrate}"
+    deadline = time.time() + BAUD_CONFIRM_TIMEOUT
+    while time.time() < deadline:
+        raw_data = uart.receive_serial(max(0.0, deadline - time.time()))
+        # 切换瞬间可能收到乱码，只要行内包含确认串即可
+        if raw_data and ack in raw_data.decode("utf_8", "ignore"):
+            uart.send_serial(json.dumps({"BaudrateConfirmed": baudrate}))
+            logger.info(f"Baudrate negotiated: {old_baudrate} -> {baudrate}")
+            return True
+
+    logger.warning(f"No {ack} within {BAUD_CONFIRM_TIMEOUT}s, reverting to {old_baudrate}")
+    uart.set_baudrate(old_baudrate, old_rtscts)
+    return False
+
 def handle_json_command(uart, cmd):
     """Handle JSON format commands for file transfer"""
     global file_recv_state
@@ -1262,9 +2580,30 @@ def handle_json_command(uart, cmd):
         handle_file_end(uart)
     elif cmd_type == "file_cancel":
         handle_file_cancel(uart)
+    elif cmd_type == "binary_mode":
+        handle_binary_mode(uart, cmd)
     else:
         logger.warning(f"Unknown JSON command: {cmd_type}")
 
+def handle_binary_mode(uart, cmd):
+    """
+    {"cmd": "binary_mode", "enable": 0/1} 进入/退出二进制帧模式，不带 enable 时查询。
+    应答以切换前的帧格式发送，之后双方使用新格式
+    """
+    enable = cmd.get("enable")
+    if enable is None:
+        response = {"cmd": "binary_mode", "status": "ok", "enable": int(uart.binary_mode), "max_frame": MAX_FRAME_SIZE}
+        uart.send_serial(json.dumps(response))
+        return
+    if enable not in [0, 1]:
+        response = {"cmd": "binary_mode", "status": "error", "reason": "invalid_parameter"}
+        uart.send_serial(json.dumps(response))
+        return
+
+    response = {"cmd": "binary_mode", "status": "ok", "enable": int(enable), "max_frame": MAX_FRAME_SIZE}
+    uart.send_serial(json.dumps(response))
+    uart.set_binary_mode(bool(enable))
+
 def handle_file_start(uart, cmd):
     """Handle file transfer start command"""
     global file_recv_state
@@ -1386,6 +2725,24 @@ def handle_file_block(uart, cmd):
             uart.send_serial(json.dumps(response))
             return
 
+        store_file_block(uart, block_index, binary_data)
+
+    except Exception as e:
+        logger.error(f"Error in file_block: {e}")
+        response = {
+            "cmd": "file_block",
+            "index": block_index,
+            "status": "error",
+            "reason": str(e),
+            "retry": False
+        }
+        uart.send_serial(json.dumps(response))
+
+def store_file_block(uart, block_index, binary_data):
+    """Verify block order, append a CRC-checked block to the temp file and acknowledge it"""
+    global file_recv_state
+
+    try:
         # Verify block order (must be sequential)
         expected_index = len(file_recv_state["received_blocks"])
 
@@ -1451,7 +2808,7 @@ def handle_file_block(uart, cmd):
             logger.info(f"File transfer progress: {progress}/{total} ({percent:.1f}%)")
 
     except Exception as e:
-        logger.error(f"Error in file_block: {e}")
+        logger.error(f"Error storing file block {block_index}: {e}")
         response = {
             "cmd": "file_block",
             "index": block_index,
@@ -1461,6 +2818,25 @@ def handle_file_block(uart, cmd):
         }
         uart.send_serial(json.dumps(response))
 
+def handle_file_block_frame(uart, payload):
+    """Handle binary file block frame: index(4 bytes) + raw data, integrity covered by the frame CRC32"""
+    if len(payload) < 4:
+        logger.error(f"File block frame too short: {len(payload)} bytes")
+        return
+    block_index = struct.unpack(">I", payload[:4])[0]
+
+    if not file_recv_state["active"]:
+        response = {
+            "cmd": "file_block",
+            "index": block_index,
+            "status": "error",
+            "reason": "no_active_transfer"
+        }
+        uart.send_serial(json.dumps(response))
+        return
+
+    store_file_block(uart, block_index, payload[4:])
+
 def handle_file_end(uart):
     """Handle file transfer end and verify MD5"""
     global file_recv_state
@@ -1615,6 +2991,971 @@ def handle_file_cancel(uart):
     }
     uart.send_serial(json.dumps(response))
 
+# ================================
+# UART COMMAND ROUTER
+# ================================
+# 命令表: 完整匹配优先，其次按前缀从长到短匹配（?PSR| 先于 ?PS）。
+# 处理函数签名 handler(uart, string)，新增命令只需用 @register_command 注册
+COMMAND_HANDLERS = {}  # 完整命令 -> (统计标签, 处理函数)
+COMMAND_PREFIX_HANDLERS = {}  # 命令前缀 -> (统计标签, 处理函数)
+COMMAND_PREFIX_LENGTHS = []  # 已注册前缀的长度，从长到短
+command_timing_hooks = []  # 每条命令处理完后调用 hook(label, elapsed, error, bytes_in, bytes_out)，后台命令在工作线程中调用
+COMMAND_DEADLINES = {}  # 在后台执行的慢命令: 统计标签 -> 应答期限(秒)
+last_command_responses = {}  # 慢命令最近一次的应答（最近状态）
+slow_command_pool = ThreadPoolExecutor(max_workers=SLOW_COMMAND_WORKERS, thread_name_prefix="uart_slow_cmd")
+slow_command_slots = threading.BoundedSemaphore(SLOW_COMMAND_LIMIT)
+
+def register_command(*names, prefix=False, label=None, deadline=None):
+    """
+    注册命令处理函数；prefix=True 时按前缀匹配，label 为计时/统计使用的命令类型，默认为命令名。
+    指定 deadline 的命令在后台线程执行，超时以最近一次的应答代替，还没有应答过时只发送 {"Pending": 1}；
+    带参数的慢命令（如 WiFi|1）视为设置命令，超时应答带 "Pending": 1，表示设置仍在执行、应答中的状态不是结果
+    """
+    def decorator(handler):
+        for name in names:
+            if deadline is not None:
+                COMMAND_DEADLINES[label or name] = deadline
+            if prefix:
+                COMMAND_PREFIX_HANDLERS[name] = (label or name, handler)
+                if len(name) not in COMMAND_PREFIX_LENGTHS:
+                    COMMAND_PREFIX_LENGTHS.append(len(name))
+                    COMMAND_PREFIX_LENGTHS.sort(reverse=True)
+            else:
+                COMMAND_HANDLERS[name] = (label or name, handler)
+        return handler
+    return decorator
+
+def find_command_handler(string):
+    """查找命令对应的 (标签, 处理函数)，未注册的命令返回 None"""
+    entry = COMMAND_HANDLERS.get(string)
+    if entry is None:
+        for length in COMMAND_PREFIX_LENGTHS:
+            entry = COMMAND_PREFIX_HANDLERS.get(string[:length])
+            if entry is not None:
+                break
+    return entry
+
+def run_command(uart, label, handler, arg, bytes_in=0):
+    """执行处理函数并调用计时钩子；处理函数抛出的异常只记录日志，不中断主循环"""
+    uart.command_label = label
+    tx_bytes = getattr(uart.local, "tx_bytes", 0)
+    start_time = time.perf_counter()
+    error = None
+    try:
+        handler(uart, arg)
+    except Exception as e:
+        error = e
+        logger.error(f"Error handling {label} command: {e}")
+    elapsed = time.perf_counter() - start_time
+    bytes_out = getattr(uart.local, "tx_bytes", 0) - tx_bytes
+    for hook in command_timing_hooks:
+        hook(label, elapsed, error, bytes_in, bytes_out)
+
+def log_command_timing(label, elapsed, error, bytes_in, bytes_out):
+    logger.debug(f"--- {label}: {elapsed} seconds ---")
+
+command_timing_hooks.append(log_command_timing)
+
+# 每类命令的统计：次数、错误数、收发字节数和延迟直方图，?STATS 查询，并定期输出到日志
+COMMAND_LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]  # 直方图各桶上限(毫秒)，最后一桶为超出部分
+COMMAND_STATS_LOG_INTERVAL = 300  # 统计日志输出间隔(秒)
+command_stats = {}
+command_stats_lock = threading.Lock()  # 后台命令在工作线程中记录统计
+command_stats_logged = time.time()
+
+def add_latency_sample(table, label, elapsed, error):
+    """在统计表 table 中记录一次耗时(秒)，返回该类的统计项，调用方持有对应的锁"""
+    elapsed_ms = elapsed * 1000
+    stats = table.get(label)
+    if stats is None:
+        stats = table[label] = {"count": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0, "max_ms": 0.0,
+                                "buckets": [0] * (len(COMMAND_LATENCY_BUCKETS) + 1)}
+    stats["count"] += 1
+    if error is not None:
+        stats["errors"] += 1
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    stats["buckets"][bisect.bisect_left(COMMAND_LATENCY_BUCKETS, elapsed_ms)] += 1
+    return stats
+
+def record_command_stats(label, elapsed, error, bytes_in, bytes_out):
+    global command_stats_logged
+    with command_stats_lock:
+        stats = add_latency_sample(command_stats, label, elapsed, error)
+        stats["bytes_in"] += bytes_in
+        stats["bytes_out"] += bytes_out
+        log_due = time.time() - command_stats_logged >= COMMAND_STATS_LOG_INTERVAL
+        if log_due:
+            command_stats_logged = time.time()
+    if log_due:
+        log_command_stats()
+
+command_timing_hooks.append(record_command_stats)
+
+def latency_percentile(stats, pct):
+    """由直方图估算百分位延迟(毫秒)：返回所在桶的上限，超出最大桶时返回最大值"""
+    rank = math.ceil(stats["count"] * pct / 100)
+    seen = 0
+    for bucket, count in enumerate(stats["buckets"]):
+        seen += count
+        if seen >= rank:
+            if bucket < len(COMMAND_LATENCY_BUCKETS):
+                return min(COMMAND_LATENCY_BUCKETS[bucket], round(stats["max_ms"], 2))
+            break
+    return round(stats["max_ms"], 2)
+
+def summarize_command_stats():
+    """每类命令的统计摘要，按占用的发送字节数从多到少排列"""
+    with command_stats_lock:
+        items = sorted(command_stats.items(), key=lambda item: item[1]["bytes_out"], reverse=True)
+        return {label: {"n": stats["count"], "err": stats["errors"],
+                        "p50": latency_percentile(stats, 50), "p95": latency_percentile(stats, 95),
+                        "p99": latency_percentile(stats, 99), "in": stats["bytes_in"], "out": stats["bytes_out"]}
+                for label, stats in items}
+
+def summarize_sdk_stats():
+    """每种SDK请求的次数、失败数和延迟百分位(毫秒)"""
+    with sdk_stats_lock:
+        return {cmd: {"n": stats["count"], "err": stats["errors"], "p50": latency_percentile(stats, 50),
+                      "p95": latency_percentile(stats, 95), "p99": latency_percentile(stats, 99)}
+                for cmd, stats in sdk_stats.items()}
+
+def log_command_stats():
+    summary = ", ".join(f"{label}: n={s['n']} err={s['err']} p50/p95/p99={s['p50']}/{s['p95']}/{s['p99']}ms in={s['in']}B out={s['out']}B"
+                        for label, s in summarize_command_stats().items())
+    logger.info(f"Command stats: {summary}")
+    sdk_summary = ", ".join(f"{cmd}: n={s['n']} err={s['err']} p50/p95/p99={s['p50']}/{s['p95']}/{s['p99']}ms"
+                            for cmd, s in summarize_sdk_stats().items())
+    logger.info(f"SDK stats: breaker={sdk_client.breaker} opened={sdk_client.breaker_opened} stale={sdk_stale_served}, {sdk_summary}")
+
+def bump_state_version():
+    """缓存的应答所依赖的全局变量或配置已修改，之前缓存的应答全部失效"""
+    global state_version
+    with state_version_lock:
+        state_version += 1
+
+def send_cached_response(uart, key, build):
+    """
+    发送可缓存的应答：state_version 和帧格式/压缩模式不变时直接发送上次编码好的字节，
+    否则调用 build() 生成应答文本并缓存
+    """
+    cache_key = (key, uart.binary_mode, uart.compression)
+    entry = response_cache.get(cache_key)
+    if entry is None or entry[0] != state_version:
+        version = state_version  # 先取版本号，生成期间再有修改时下次重新生成
+        response = build()
+        entry = (version, response, uart.encode_response(response))
+        response_cache[cache_key] = entry
+    logger.debug(f"UART send ->: {entry[1]}")
+    uart.write(entry[2])
+
+def dispatch_command(uart, string, bytes_in=0):
+    """分发一行文本命令：以 { 开头的按JSON命令处理（文件传输等），其余查命令表。bytes_in 为收到的字节数，用于统计"""
+    if string[:1] == "{":
+        try:
+            json_cmd = json.loads(string)
+        except json.JSONDecodeError:
+            json_cmd = None
+        if isinstance(json_cmd, dict) and "cmd" in json_cmd:
+            run_command(uart, "{%s}" % json_cmd["cmd"], handle_json_command, json_cmd, bytes_in)
+        else:
+            logger.warning(f"Invalid JSON command: {string[:80]}")
+        return
+
+    entry = find_command_handler(string)
+    if entry is None:
+        logger.debug(f"Unknown command: {string}")
+        return
+    label, handler = entry
+    if label in COMMAND_DEADLINES:
+        submit_slow_command(uart, label, handler, string, bytes_in)
+    else:
+        run_command(uart, label, handler, string, bytes_in)
+
+def submit_slow_command(uart, label, handler, string, bytes_in=0):
+    """慢命令交给后台线程执行，先在发送顺序中占位；后台线程已满时直接以最近状态应答（设置命令返回 Busy 错误）"""
+    slot = uart.open_slot()
+    # 统计标签即注册的命令名，其后还有参数的是设置命令
+    is_set = bool(string[len(label):].strip())
+    if not slow_command_slots.acquire(blocking=False):
+        logger.warning(f"Too many pending slow commands, {label} answered with last known state")
+        expire_slow_command(uart, label, slot, {"Error": "Busy"}, is_set)
+        return
+    timer = threading.Timer(COMMAND_DEADLINES[label], expire_slow_command, (uart, label, slot, {"Pending": 1}, is_set))
+    timer.daemon = True
+    timer.start()
+    slow_command_pool.submit(run_slow_command, uart, label, handler, string, slot, timer, bytes_in)
+
+def run_slow_command(uart, label, handler, string, slot, timer, bytes_in=0):
+    """后台线程：执行慢命令，应答写入 slot，完成后按顺序发出"""
+    uart.local.slot = slot
+    try:
+        run_command(uart, label, handler, string, bytes_in)
+    finally:
+        uart.local.slot = None
+        timer.cancel()
+        slow_command_slots.release()
+    # 超时后才完成的命令，结果仍作为最近状态供下次超时使用
+    if slot.response is not None:
+        last_command_responses[label] = slot.response
+    if not uart.close_slot(slot):
+        logger.info(f"{label} finished after its deadline, late response discarded")
+
+def expire_slow_command(uart, label, slot, marker, is_set=False):
+    """
+    慢命令超过期限：以最近一次的应答代替，不再阻塞后续应答
+    设置命令的应答合并 marker，标明其中的状态不是结果；还没有应答过时不编造状态，只发送 marker
+    """
+    response = last_command_responses.get(label)
+    if response is None:
+        response = json.dumps(marker)
+    elif is_set:
+        response = json.dumps({**json.loads(response), **marker})
+    uart.command_label = label
+    if uart.close_slot(slot, uart.encode_response(response)):
+        logger.warning(f"{label} not answered within {COMMAND_DEADLINES[label]}s, sent: {response}")
+
+@register_command("?Asset")
+def handle_asset(uart, string):
+    """?Asset: 设备资产信息"""
+    def build():
+        asset_data = {
+            "MfrName": device_config["MfrName"],
+            "ModelNumber": device_config["ModelNumber"],
+            "SerialNumber": device_config["SerialNumber"],
+            "MfgDate": device_config["MfgDate"],
+            "FWVersion": device_config["FWVersion"],
+            "HWVersion": device_config["HWVersion"],
+            "AppNumber": device_config["AppNumber"]
+        }
+        return json.dumps(asset_data)
+    send_cached_response(uart, "?Asset", build)
+
+@register_command("@|", prefix=True)
+def handle_count_interval(uart, string):
+    """@|<秒>: 设置/查询计数上报周期"""
+    global count_interval
+
+    if string[2:]:
+        count_interval = str(string[2:])
+        bump_state_version()
+    send_cached_response(uart, "@|", lambda: json.dumps({"NICFrequency": int(count_interval)}))
+
+@register_command("?Order")
+def handle_order(uart, string):
+    """?Order: 设备订单信息"""
+    send_cached_response(uart, "?Order", lambda: json.dumps(device_config["Order"]))
+
+@register_command("Profile|", prefix=True)
+def handle_profile(uart, string):
+    """Profile|<1/2/3>: 设置/查询摄像头输出模式"""
+    global profile_index, cam_in_use
+
+    if string[8:] and int(string[8:]) in [1, 2, 3]:
+        requested_profile = int(string[8:])
+
+        # 验证请求的配置是否被硬件支持
+        if validate_cam_in_use(requested_profile, cam_in_use_actual):
+            profile_index = requested_profile
+            cam_in_use = requested_profile
+            bump_state_version()
+
+            # 更新config.json
+            local_config = load_config("config.json")
+            config_mapping = {1: "left", 2: "right", 3: "dual"}
+            local_config["cam_in_use"] = config_mapping[requested_profile]
+            with open("config.json", "w", encoding="utf-8") as file:
+                json.dump(local_config, file, indent=4)
+
+            logger.info(f"Profile changed to {requested_profile}")
+            image_encoder_wakeup.set()  # 配置变化，立即重新编码
+        else:
+            logger.warning(f"Profile {requested_profile} not supported by hardware {cam_in_use_actual}")
+
+    send_cached_response(uart, "Profile|", lambda: json.dumps({"CamProfile": int(profile_index)}))
+
+@register_command("WiFi|", prefix=True, deadline=SLOW_COMMAND_DEADLINE)
+def handle_wifi(uart, string):
+    """WiFi|<0/1>: WiFi开关"""
+    #这段是原来的wifi控制
+    # if get_wifi_status() == 'enabled':
+    #     wifi_cur_config = 1
+    # else:
+    #     wifi_cur_config = 0
+    # if string[5:] and int(string[5:]) in [0, 1]:
+    #     wifi_status = str(string[5:])
+    #     if wifi_cur_config != int(wifi_status):
+    #         if int(wifi_status) == 1:
+    #             subprocess.run(['nmcli', 'radio', 'wifi', 'on'])
+    #         else:
+    #             subprocess.run(['nmcli', 'radio', 'wifi', 'off'])
+    # 这段是对接sdk的wifi控制，暂时不使用，因为处理速度太慢
+    # 同一时间只执行一条 WiFi| 命令
+    with hardware_set_locks["wifi"]:
+        wifi_cur_config = 0
+        if get_wifi_status_from_sdk() == 'enabled':
+            wifi_cur_config = 1
+        if string[5:] and int(string[5:]) in [0, 1]:
+            wifi_status = str(string[5:])
+            if wifi_cur_config != int(wifi_status):
+                if int(wifi_status) == 1:
+                    set_wifi_status_via_sdk(True)
+                else:
+                    set_wifi_status_via_sdk(False)
+        else:
+            wifi_status = wifi_cur_config
+    response = json.dumps({"WiFiEnable": int(wifi_status)})
+    uart.send_serial(response)
+
+@register_command("CELL|", prefix=True, deadline=SLOW_COMMAND_DEADLINE)
+def handle_cell(uart, string):
+    """CELL|<0/1>: LTE开关"""
+    # LTE硬件控制，同一时间只执行一条 CELL| 命令
+    with hardware_set_locks["lte"]:
+        # 获取当前LTE状态
+        lte_cur_config = 0
+        lte_status_str = get_lte_status_from_sdk()
+        if lte_status_str == 'enabled':
+            lte_cur_config = 1
+
+        # 处理设置命令
+        if string[5:] and int(string[5:]) in [0, 1]:
+            lte_target_status = str(string[5:])
+            if lte_cur_config != int(lte_target_status):
+                if int(lte_target_status) == 1:
+                    set_lte_status_via_sdk(True)
+                else:
+                    set_lte_status_via_sdk(False)
+        else:
+            lte_target_status = lte_cur_config
+
+    response = json.dumps({"CellularEnable": int(lte_target_status)})
+    uart.send_serial(response)
+
+@register_command("?ERR")
+def handle_camera_errors(uart, string):
+    """?ERR: 摄像头错误状态"""
+    cam1_error_code = check_camera_errors(CAMERA1_DIAGNOSE_INFO_PATH)
+    cam2_error_code = check_camera_errors(CAMERA2_DIAGNOSE_INFO_PATH)
+    response = json.dumps({"Cam1ErrCode": cam1_error_code,"Cam2ErrCode": cam2_error_code})
+    uart.send_serial(response)
+
+@register_command("REACT|", prefix=True)
+def handle_react(uart, string):
+    """REACT|: 查询紧急模式"""
+    # Just return current emer_mode, no modification
+    send_cached_response(uart, "REACT|", lambda: json.dumps({"EmergencyMode": int(emer_mode)}))
+
+@register_command("?OBdata")
+def handle_obdata(uart, string):
+    """?OBdata: 锁定本周期图像块并返回各摄像头计数数据"""
+    # 先获取drawing坐标，本周期锁定的图像按最新坐标裁剪
+    roi_changed = False
+
+    # 获取交通类别信息
+    left_traffic_data = {}
+    right_traffic_data = {}
+
+    # 获取左摄像头交通类别信息
+    if cam_in_use == 1 or cam_in_use == 3:
+        # 选择左摄像头的socket
+        cam_info_socket = 'cam1_info_sock'
+        # 发送JSON格式的请求获取交通类别信息
+        # traffic_request = {"cmd": "traffic_category"}
+        traffic_request = {"cmd": "drawing"}
+        traffic_request_json = json.dumps(traffic_request)
+        send_data(cam_info_socket, traffic_request_json.encode('utf-8'))
+        response = receive_data(cam_info_socket, 4096)
+        if response:
+            try:
+                # 检查响应是否为有效的JSON
+                left_traffic_data = json.loads(response.decode('utf-8'))
+                roi_changed |= update_roi_coordinates(CAM1_ID, left_traffic_data)
+                # logger.info(f"Left camera traffic category data: {left_traffic_data}")
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to decode left traffic category response: {e}")
+            except Exception as e:
+                logger.error(f"Error processing left traffic category response: {e}")
+
+    # 获取右摄像头交通类别信息
+    if cam_in_use == 2 or cam_in_use == 3:
+        # 选择右摄像头的socket
+        cam_info_socket = 'cam2_info_sock'
+        # 发送JSON格式的请求获取交通类别信息
+        # traffic_request = {"cmd": "traffic_category"}
+        traffic_request = {"cmd": "drawing"}
+        traffic_request_json = json.dumps(traffic_request)
+        send_data(cam_info_socket, traffic_request_json.encode('utf-8'))
+        response = receive_data(cam_info_socket, 4096)
+        if response:
+            try:
+                # 检查响应是否为有效的JSON
+                right_traffic_data = json.loads(response.decode('utf-8'))
+                roi_changed |= update_roi_coordinates(CAM2_ID, right_traffic_data)
+                # logger.info(f"Right camera traffic category data: {right_traffic_data}")
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to decode right traffic category response: {e}")
+            except Exception as e:
+                logger.error(f"Error processing right traffic category response: {e}")
+
+    # If emer_mode == 1, skip image save and update_sim_attribute
+    if emer_mode == 1:
+        logger.warning("emer_mode==1, skip image save and update_sim_attribute on ?OBdata")
+    elif image_encode_interval <= 0 or (roi_changed and image_roi_enabled):
+        # 未启用后台编码线程时同步取图编码；ROI坐标变化时编码线程发布的图像按旧坐标裁剪，也同步重新编码
+        refresh_image_blocks(cam_in_use)
+    else:
+        # 不在应答路径上编码：锁定编码线程最近发布的图像块（主机空闲较久后可能较旧），
+        # 编码线程空闲时立即唤醒，为下一周期准备新图像
+        image_demand.set()
+        if time.time() - image_refresh_time > 2 * image_encode_interval:
+            image_encoder_wakeup.set()
+    # 锁定最新一组完整图像块，本周期的 ?PS5+ 都读取这一组
+    pin_image_blocks()
+
+    # Get counting data from CDS - returns separate left and right data
+    left_counting_data, right_counting_data = get_cds_counting_data()
+
+    # Process left camera data (cam1)
+    if cam_in_use == 1 or cam_in_use == 3:
+        # 根据交通类别信息创建基础uart_data
+        if left_traffic_data:
+            base_uart_data = create_uart_data_from_traffic_categories(left_traffic_data)
+        else:
+            base_uart_data = dnn_default_dirct.copy()
+        if left_counting_data:
+            # Process cumulative data to get period counts for left camera
+            left_period_data = process_cumulative_counting(left_counting_data, "left")
+            # Get speed averages for left camera
+            left_speed_averages = get_speed_data_for_uart("left")
+            # Reformat for UART with speed integration using base data
+            uart_data = reformat_counting_for_uart(left_period_data, left_speed_averages, base_uart_data)
+        else:
+            # 如果没有计数数据，使用基础数据
+            uart_data = base_uart_data
+
+        response = json.dumps(uart_data)
+        uart.send_serial(response)
+
+    # Process right camera data (cam2)
+    if cam_in_use == 2 or cam_in_use == 3:
+        # 根据交通类别信息创建基础uart_data
+        if right_traffic_data:
+            base_uart_data = create_uart_data_from_traffic_categories(right_traffic_data)
+        else:
+            base_uart_data = dnn_default_dirct.copy()
+
+        if right_counting_data:
+            # Process cumulative data to get period counts for right camera
+            right_period_data = process_cumulative_counting(right_counting_data, "right")
+            # Get speed averages for right camera
+            right_speed_averages = get_speed_data_for_uart("right")
+            # Reformat for UART with speed integration using base data
+            uart_data = reformat_counting_for_uart(right_period_data, right_speed_averages, base_uart_data)
+        else:
+            # 如果没有计数数据，使用基础数据
+            uart_data = base_uart_data
+
+        response = json.dumps(uart_data)
+        uart.send_serial(response)
+
+    # Reset speed data for next cycle
+    reset_speed_data()
+
+@register_command("BLK|", prefix=True)
+def handle_image_blocks(uart, string):
+    """BLK|<20-80>: 设置/查询最大图像块数量"""
+    global max_image_blocks
+
+    # 处理BLK|xxx命令，设置最大图像块数量
+    try:
+        if string[4:]:
+            block_count = int(string[4:])
+            # 限制在20-80范围内
+            block_count = max(20, min(80, block_count))
+            max_image_blocks = block_count
+            bump_state_version()
+
+            # 持久化保存到配置文件
+            local_config = load_config("config.json")
+            local_config["TotalImageBlocks"] = block_count
+            with open("config.json", "w", encoding="utf-8") as file:
+                json.dump(local_config, file, indent=4)
+
+            logger.info(f"Max image blocks set to: {block_count}")
+            image_encoder_wakeup.set()  # 配置变化，立即重新编码
+            response = json.dumps({"TotalImageBlocks": str(block_count)})
+        else:
+            # 如果没有参数，返回当前设置
+            send_cached_response(uart, "BLK|", lambda: json.dumps({"TotalImageBlocks": str(max_image_blocks)}))
+            return
+    except ValueError:
+        # 参数不是有效数字
+        logger.error(f"Invalid BLK parameter: {string[4:]}")
+        response = json.dumps({"TotalImageBlocks": str(max_image_blocks), "Error": "Invalid parameter"})
+    uart.send_serial(response)
+
+@register_command("CODEC|", prefix=True)
+def handle_codec(uart, string):
+    """CODEC|<codec>[,<subsampling>]: 设置/查询图像编码后端"""
+    # 处理CODEC|<codec>[,<subsampling>]命令，设置图像编码后端
+    param = string[6:].strip()
+    if param:
+        codec_name, _, subsampling = param.partition(",")
+        # 不支持的一项保持原值，另一项照常生效
+        valid = set_image_codec(codec_name.strip(), subsampling.strip() or None)
+        # 持久化保存到配置文件
+        local_config = load_config("config.json")
+        local_config["ImageCodec"] = image_codec
+        local_config["ImageSubsampling"] = image_chroma_subsampling
+        with open("config.json", "w", encoding="utf-8") as file:
+            json.dump(local_config, file, indent=4)
+        image_encoder_wakeup.set()  # 配置变化，立即重新编码
+        codec_response = {"ImageCodec": image_codec, "Subsampling": image_chroma_subsampling}
+        if not valid:
+            codec_response["Error"] = "Invalid parameter"
+    else:
+        codec_response = {"ImageCodec": image_codec, "Subsampling": image_chroma_subsampling}
+    # 当前锁定图像实际使用的后端（auto模式下为评估选中的后端）
+    codec_response["ActiveCodec"] = getattr(pinned_image, "codec", image_codec)
+    response = json.dumps(codec_response)
+    uart.send_serial(response)
+
+@register_command("ROI|", prefix=True)
+def handle_roi(uart, string):
+    """ROI|<0/1>[,<margin>]: 开关ROI模式并返回当前裁剪框"""
+    global image_roi_enabled, image_roi_margin
+
+    # 处理ROI|<0/1>[,<margin>]命令，开关ROI模式并返回当前裁剪框
+    roi_response = {}
+    try:
+        param = string[4:].strip()
+        if param:
+            enable_str, _, margin_str = param.partition(",")
+            enable = int(enable_str)
+            if enable not in [0, 1]:
+                raise ValueError(enable_str)
+            margin = int(margin_str) if margin_str.strip() else image_roi_margin
+            if margin < 0:
+                raise ValueError(margin_str)
+            image_roi_enabled = bool(enable)
+            image_roi_margin = margin
+
+            # 持久化保存到配置文件
+            local_config = load_config("config.json")
+            local_config["ImageROI"] = image_roi_enabled
+            local_config["ImageROIMargin"] = image_roi_margin
+            with open("config.json", "w", encoding="utf-8") as file:
+                json.dump(local_config, file, indent=4)
+            logger.info(f"Image ROI mode set to: {enable}, margin: {margin}")
+            image_encoder_wakeup.set()  # 配置变化，立即重新编码
+    except ValueError:
+        logger.error(f"Invalid ROI parameter: {string[4:]}")
+        roi_response["Error"] = "Invalid parameter"
+    roi_response["ImageROI"] = int(image_roi_enabled)
+    roi_response["ROIMargin"] = image_roi_margin
+    # 当前锁定图像的裁剪框，整帧时不返回
+    crop_boxes = getattr(pinned_image, "crop_boxes", None)
+    if crop_boxes:
+        for cam_id, box in sorted(crop_boxes.items()):
+            roi_response[f"CropBox{cam_id}"] = list(box)
+    response = json.dumps(roi_response)
+    uart.send_serial(response)
+
+@register_command("?DLT", prefix=True)
+def handle_delta_frame(uart, string):
+    """?DLT[|K]: 生成增量帧并返回帧头"""
+    # 处理?DLT[|K]命令，生成增量帧（K表示强制关键帧），返回帧头
+    try:
+        header = build_delta_frame(cam_in_use, force_keyframe=string[4:] == "|K")
+        response = json.dumps(header)
+    except Exception as e:
+        logger.error(f"Error building delta frame: {e}")
+        response = json.dumps({"DeltaSeq": -1, "Error": str(e)})
+    uart.send_serial(response)
+
+@register_command("?DB", prefix=True)
+def handle_delta_block(uart, string):
+    """?DB<n>: 读取当前增量帧的第n块"""
+    # 处理?DB<n>命令，读取当前增量帧的第n块（从1开始）
+    try:
+        block_index = int(string[3:]) - 1
+        delta_blocks = delta_state["blocks"]
+        if 0 <= block_index < len(delta_blocks):
+            if uart.binary_mode:
+                uart.send_frame(delta_blocks.binary_frame(block_index))
+            else:
+                uart.send_frame(delta_blocks.frame(block_index))
+        elif 0 <= block_index < MAX_IMAGE_BLOCKS:
+            if uart.binary_mode:
+                uart.send_frame(build_binary_frame(FRAME_TYPE_DELTA_BLOCK, struct.pack(">H", block_index + 1)))
+            else:
+                uart.send_frame(b'{"DBlock%d":""}\n' % (block_index + 1))
+        else:
+            logger.error(f"Unexpected delta block index: {string}")
+            uart.send_serial(json.dumps({"DBlock": block_index + 1, "Error": "Invalid block index"}))
+    except ValueError:
+        logger.error(f"Invalid delta block command: {string}")
+        uart.send_serial(json.dumps({"DBlock": -1, "Error": "Invalid parameter"}))
+
+@register_command("DACK|", prefix=True)
+def handle_delta_ack(uart, string):
+    """DACK|<seq>: 主机确认增量帧"""
+    # 处理DACK|<seq>命令，主机确认已收到增量帧
+    try:
+        seq = int(string[5:])
+        if acknowledge_delta_frame(seq):
+            response = json.dumps({"DeltaAck": seq})
+        else:
+            response = json.dumps({"DeltaAck": seq, "Error": "Unknown frame"})
+    except ValueError:
+        response = json.dumps({"DeltaAck": -1, "Error": "Invalid parameter"})
+    uart.send_serial(response)
+
+@register_command("COMP|", prefix=True)
+def handle_compression(uart, string):
+    """COMP|<mode>: 响应压缩"""
+    # 处理COMP|<mode>命令，开关响应压缩（off/deflate/zdict）；COMP|dict 返回预设字典
+    # COMP| 的应答始终不压缩，主机丢失状态时也能读取
+    param = string[5:].strip()
+    if param == "dict":
+        comp_response = {"CompressionDict": base64.b64encode(COMPRESSION_DICTIONARY).decode("ascii"),
+                         "DictID": zlib.adler32(COMPRESSION_DICTIONARY)}
+    elif param in COMPRESSION_MODES or param in ["off", "0"]:
+        uart.compression = param if param in COMPRESSION_MODES else None
+        logger.info(f"Response compression set to: {uart.compression or 'off'}")
+        if compression_stats:
+            log_compression_stats()
+        comp_response = {"Compression": uart.compression or "off"}
+    else:
+        comp_response = {"Compression": uart.compression or "off",
+                         "Modes": list(COMPRESSION_MODES), "DictID": zlib.adler32(COMPRESSION_DICTIONARY),
+                         "RawBytes": sum(s["raw"] for s in compression_stats.values()),
+                         "SentBytes": sum(s["sent"] for s in compression_stats.values())}
+        if param:
+            comp_response["Error"] = "Invalid parameter"
+    response = json.dumps(comp_response)
+    uart.send_serial(response, compress=False)
+
+@register_command("BAUD|", prefix=True)
+def handle_baudrate(uart, string):
+    """BAUD|<rate>[,<rtscts>]: 波特率协商"""
+    # 处理BAUD|<rate>[,<rtscts>]命令，协商串口波特率；无参数时返回当前设置和支持的波特率
+    param = string[5:].strip()
+    baud_response = None
+    if param:
+        try:
+            rate_str, _, rtscts_str = param.partition(",")
+            baudrate = int(rate_str)
+            rtscts = rtscts_str.strip() == "1"
+            if baudrate in SUPPORTED_BAUDRATES and rtscts_str.strip() in ["", "0", "1"]:
+                negotiate_baudrate(uart, baudrate, rtscts)
+            else:
+                baud_response = {"Baudrate": uart.baudrate, "RTSCTS": int(uart.rtscts),
+                                 "Error": "Unsupported baudrate"}
+        except ValueError:
+            logger.error(f"Invalid BAUD parameter: {param}")
+            baud_response = {"Baudrate": uart.baudrate, "RTSCTS": int(uart.rtscts),
+                             "Error": "Invalid parameter"}
+    else:
+        baud_response = {"Baudrate": uart.baudrate, "RTSCTS": int(uart.rtscts),
+                         "Supported": SUPPORTED_BAUDRATES}
+    if baud_response:
+        response = json.dumps(baud_response)
+        uart.send_serial(response)
+
+# 旧的 WFPW| 实现（直接修改 gs501.json），保留备查
+# elif string[:5] == "WFPW|":
+#     # 解析base64编码的密码
+#     try:
+#         if string[5:]:
+#             # Base64解码密码
+#             encoded_password = string[5:]
+#             try:
+#                 new_password = base64.b64decode(encoded_password).decode('utf-8')
+#             except Exception as e:
+#                 logger.error(f"Failed to decode password: {e}")
+#                 response = json.dumps({"Password": "error", "reason": "invalid_base64"})
+#                 uart.send_serial(response)
+#                 continue
+
+#             # 验证密码合法性（WiFi密码要求8-63个字符）
+#             if len(new_password) < 8 or len(new_password) > 63:
+#                 logger.error(f"Invalid password length: {len(new_password)}")
+#                 response = json.dumps({"Password": "error", "reason": "invalid_length"})
+#                 uart.send_serial(response)
+#                 continue
+
+#             # 读取配置文件
+#             try:
+#                 gs501_config = load_config(CONFIG_PATH)
+#             except Exception as e:
+#                 logger.error(f"Failed to read config: {e}")
+#                 response = json.dumps({"Password": "error", "reason": "config_read_failed"})
+#                 uart.send_serial(response)
+#                 continue
+
+#             # 修改AP_PASSWORD字段
+#             old_password = gs501_config.get("AP_PASSWORD", "")
+#             gs501_config["AP_PASSWORD"] = new_password
+
+#             # 保存配置文件
+#             if save_config(CONFIG_PATH, gs501_config):
+#                 # 返回base64编码的新密码作为确认
+#                 encoded_response = base64.b64encode(new_password.encode('utf-8')).decode('utf-8')
+#                 response = json.dumps({"Password": encoded_response})
+#                 uart.send_serial(response)
+
+#                 logger.info(f"WiFi password updated successfully (length: {len(new_password)})")
+#                 # 注意：不记录明文密码到日志
+
+#                 # 触发kill_main_processes重启相关进程
+#                 logger.info("Triggering process restart after password change...")
+#                 kill_success = kill_main_processes()
+#                 if kill_success:
+#                     logger.info("Main processes killed successfully after password update")
+#                 else:
+#                     logger.warning("No main processes found to kill after password update")
+#             else:
+#                 # 配置保存失败
+#                 response = json.dumps({"Password": "error", "reason": "config_save_failed"})
+#                 uart.send_serial(response)
+#                 logger.error("Failed to save WiFi password configuration")
+#         else:
+#             # 没有提供密码
+#             response = json.dumps({"Password": "error", "reason": "no_password"})
+#             uart.send_serial(response)
+
+#     except Exception as e:
+#         logger.error(f"Error processing WFPW command: {e}")
+#         response = json.dumps({"Password": "error", "reason": str(e)})
+#         uart.send_serial(response)
+
+@register_command("WFPW|", prefix=True, deadline=SLOW_COMMAND_DEADLINE)
+def handle_wifi_password(uart, string):
+    """WFPW|<base64>: 设置/查询WiFi AP密码"""
+    try:
+        param = string[5:].strip()
+
+        if not param:
+            # 查询模式 - 从 gs501.json 读取
+            try:
+                gs501_config = load_config(CONFIG_PATH)
+                current_password = gs501_config.get("AP_PASSWORD", "")
+                if current_password:
+                    encoded_pwd = base64.b64encode(current_password.encode('utf-8')).decode('utf-8')
+                    response = json.dumps({"Password": encoded_pwd})
+                else:
+                    response = json.dumps({"Password": ""})
+            except Exception as e:
+                logger.error(f"Query password failed: {e}")
+                response = json.dumps({"Password": ""})
+            uart.send_serial(response)
+        else:
+            # 设置模式
+            try:
+                # Base64 解码
+                new_password = base64.b64decode(param).decode('utf-8')
+
+                # 密码验证
+                if len(new_password) < 8:
+                    response = json.dumps({"Password": ""})
+                    uart.send_serial(response)
+                    return
+                if len(new_password) > 63:
+                    response = json.dumps({"Password": ""})
+                    uart.send_serial(response)
+                    return
+
+                # 调用 SDK
+                request = {
+                    "cmd": "set_wifi_password_req",
+                    "password": new_password
+                }
+                sdk_response = send_json_request(request)
+
+                # 处理响应
+                if sdk_response and sdk_response.get("cmd") == "set_wifi_password_rsp":
+                    if sdk_response.get("ret_code") == 0:
+                        encoded_pwd = base64.b64encode(new_password.encode('utf-8')).decode('utf-8')
+                        response = json.dumps({"Password": encoded_pwd})
+                        logger.info("WiFi password updated successfully")
+                    else:
+                        response = json.dumps({"Password": ""})
+                else:
+                    response = json.dumps({"Password": ""})
+                uart.send_serial(response)
+
+            except base64.binascii.Error:
+                response = json.dumps({"Password": ""})
+                uart.send_serial(response)
+            except UnicodeDecodeError:
+                response = json.dumps({"Password": ""})
+                uart.send_serial(response)
+    except Exception as e:
+        logger.error(f"WFPW error: {e}")
+        response = json.dumps({"Password": ""})
+        uart.send_serial(response)
+
+@register_command("?RST")
+def handle_reset(uart, string):
+    """?RST: 重启摄像头主程序"""
+    # 返回响应
+    response = json.dumps({"CamReset": 1})
+    uart.send_serial(response)
+
+    # 杀掉./main进程
+    kill_success = kill_main_processes()
+    if kill_success:
+        logger.info("RST command completed successfully")
+    else:
+        logger.warning("RST command completed but no processes were killed")
+
+@register_command("?STATS")
+def handle_stats(uart, string):
+    """?STATS: 每类命令的次数/错误数/延迟(毫秒)/收发字节数，以及串口接收丢弃计数"""
+    response = json.dumps({
+        "Uptime": int(time.time() - uart.start_time),
+        "Commands": summarize_command_stats(),
+        "Link": {"Baudrate": uart.baudrate, "Dropped": uart.rx_dropped,
+                 "Oversized": uart.rx_oversized, "BadFrames": uart.rx_errors}
+    }, separators=(",", ":"))
+    uart.send_serial(response)
+
+@register_command("?SDK")
+def handle_sdk_status(uart, string):
+    """?SDK: SDK 断路器状态、各SDK请求的次数/失败数/延迟(毫秒)、缓存的年龄(秒)及返回旧值的次数"""
+    now = time.monotonic()
+    with hardware_status_lock:
+        cache_ages = {module: round(now - updated, 1) for module, (_, updated) in hardware_status.items()}
+    with camera_params_lock:
+        cache_ages.update({f"Cam{camera_id}": round(now - updated, 1) for camera_id, (_, updated) in camera_params.items()})
+    response = json.dumps({
+        "Breaker": sdk_client.breaker,
+        "Failures": sdk_client.failures,
+        "Opened": sdk_client.breaker_opened,
+        "RetryIn": round(max(0.0, sdk_client.retry_at - now), 1) if sdk_client.breaker == "open" else 0,
+        "Login": int(bool(sdk_token)),
+        "Stale": sdk_stale_served,
+        "CacheAge": cache_ages,
+        "Requests": summarize_sdk_stats()
+    }, separators=(",", ":"))
+    uart.send_serial(response)
+
+@register_command("?PSR|", prefix=True)
+def handle_block_range(uart, string):
+    """?PSR|<start>-<end>: 连续发送图像块"""
+    # 处理?PSR|<start>-<end>命令，连续发送锁定图像中 ?PS<start> ~ ?PS<end> 对应的图像块，最后发送汇总行
+    # ?PSR| 全部，?PSR|<n> 单块，?PSR|<n>- 从n到最后
+    try:
+        start_str, separator, end_str = string[5:].strip().partition("-")
+        first = int(start_str) if start_str else 5
+        if separator:
+            last = int(end_str) if end_str else 4 + MAX_IMAGE_BLOCKS
+        else:
+            last = first if start_str else 4 + MAX_IMAGE_BLOCKS
+        if not (5 <= first <= last < 5 + MAX_IMAGE_BLOCKS):
+            raise ValueError(string[5:])
+    except ValueError:
+        logger.error(f"Invalid block range: {string}")
+        response = json.dumps({"BlockRange": string[5:], "Blocks": 0, "Error": "Invalid parameter"})
+        uart.send_serial(response)
+        return
+
+    image_blocks = pinned_image
+    # 只发送实际存在的块，块数由汇总行给出，不再发送空包
+    sent = 0
+    for index in range(first, min(last, 4 + len(image_blocks)) + 1):
+        send_image_block(uart, image_blocks, index)
+        sent += 1
+    # 图像实际使用的后端及文件格式，auto模式下主机据此选择解码方式
+    codec_name = getattr(image_blocks, "codec", image_codec)
+    response = json.dumps({"BlockRange": f"{first}-{last}", "Blocks": sent,
+                           "TotalBlocks": len(image_blocks),
+                           "CRC32": getattr(image_blocks, "image_crc32", ""),
+                           "Codec": codec_name,
+                           "Format": IMAGE_CODECS.get(codec_name, IMAGE_CODECS["jpeg"])["format"].lower()})
+    uart.send_serial(response)
+    logger.debug(f"Streamed {sent} image blocks for ?PSR|{first}-{last}")
+
+@register_command("?PS1", "?PS2", deadline=SLOW_COMMAND_DEADLINE)
+def handle_camera_params(uart, string):
+    """?PS1/?PS2: 摄像头参数"""
+    index = int(string[3:])
+    # 处理PS1和PS2命令
+    if (index == 1 and (cam_in_use == 1 or cam_in_use == 3)) or (index == 2 and (cam_in_use == 2 or cam_in_use == 3)):
+        # 选择正确的socket
+        if index == 1:
+            cam_info_socket = 'cam1_info_sock'
+        else:  # index == 2
+            cam_info_socket = 'cam2_info_sock'
+
+        # 使用缓存的SDK摄像头参数
+        camera_id = CAM1_ID if index == 1 else CAM2_ID
+        camera_param_response, _ = get_camera_params(camera_id)
+        if camera_param_response:
+            response = render_camera_params(camera_param_response)
+        else:
+            response = json.dumps({}) # 如果SDK获取失败，发送空字典
+    else:
+        # 不符合条件时发送空字典
+        response = json.dumps({})
+    uart.send_serial(response)
+
+@register_command("?PS3", "?PS4")
+def handle_drawing_coordinates(uart, string):
+    """?PS3/?PS4: 计数线/区域坐标"""
+    index = int(string[3:])
+    # 处理PS3和PS4命令
+    if (index == 3 and (cam_in_use == 1 or cam_in_use == 3)) or (index == 4 and (cam_in_use == 2 or cam_in_use == 3)):
+        # 选择正确的socket
+        if index == 3:
+            cam_info_socket = 'cam1_info_sock'
+        else:  # index == 4
+            cam_info_socket = 'cam2_info_sock'
+        # 发送JSON格式的drawing命令
+        roi_request = {"cmd": "drawing"}
+        roi_request_json = json.dumps(roi_request)
+        send_data(cam_info_socket, roi_request_json.encode('utf-8'))
+        response = receive_data(cam_info_socket, 4096)
+        # 解析响应，只提取coordinates部分传给处理函数
+        if response:
+            try:
+                json_response = json.loads(response.decode('utf-8'))
+                if update_roi_coordinates(CAM1_ID if index == 3 else CAM2_ID, json_response) and image_roi_enabled:
+                    image_encoder_wakeup.set()  # 坐标变化，按新坐标重新裁剪编码
+                coordinates_data = json_response.get('coordinates', {})
+                # 将coordinates数据编码为bytes传给处理函数
+                coordinates_bytes = json.dumps(coordinates_data).encode('utf-8')
+                response = process_coordinates_response(coordinates_bytes)
+            except Exception as e:
+                logger.error(f"Error extracting coordinates: {e}")
+                response = json.dumps({})
+        else:
+            response = json.dumps({})
+    else:
+        # 不符合条件时发送空字典
+        response = json.dumps({})
+    uart.send_serial(response)
+
+@register_command(*[f"?PS{n}" for n in range(5, 5 + MAX_IMAGE_BLOCKS)], label="?PS5+")
+def handle_image_block(uart, string):
+    """?PS5 ~ ?PS84: 发送锁定图像的第N块，上限固定为最大支持值80"""
+    index = int(string[3:])
+    send_image_block(uart, pinned_image, index)
+
+@register_command("?PS", prefix=True)
+def handle_ps(uart, string):
+    """?PS<n> 的兜底解析（如 ?PS05），按序号转给对应的处理函数"""
+    index = int(string[3:])
+    if index in [1, 2]:
+        handle_camera_params(uart, string)
+    elif index in [3, 4]:
+        handle_drawing_coordinates(uart, string)
+    elif index >= 5 and index < (5 + MAX_IMAGE_BLOCKS):
+        handle_image_block(uart, string)
+    else:
+        logger.error(f"Unexpected PS index: ?PS{index}")
+
 def main():
     """
     Main function to initialize logger, UART, load config, start socket connection
@@ -1623,7 +3964,10 @@ def main():
     global count_interval, profile_index, emer_mode
     global IMAGE_HEIGHT, IMAGE_WIDTH, cam_in_use, cam_in_use_actual
     global cam1_image_shm_ptr, cam2_image_shm_ptr
-    global emer_imgage_send, max_image_blocks
+    global emer_imgage_send, max_image_blocks, image_debug_dump, image_change_threshold, image_change_max_age
+    global image_encode_interval, image_roi_enabled, image_roi_margin, delta_tile_threshold
+    global baud_idle_revert, device_config, hardware_status_refresh, hardware_status_max_age
+    global camera_param_refresh, camera_param_max_age, ps_template
 
     # 打印当前版本
     logger.info("===========================================")
@@ -1633,12 +3977,13 @@ def main():
     uart = UART()
     
     # Step 1: Read actual hardware configuration from gs501.json
-    config = load_config(CONFIG_PATH)
-    IMAGE_HEIGHT = int(config.get('InputTensorHeith'))
-    IMAGE_WIDTH = int(config.get('InputTensorWidth'))
+    device_config = load_config(CONFIG_PATH)
+    ps_template = build_ps_template(device_config)
+    IMAGE_HEIGHT = int(device_config.get('InputTensorHeith'))
+    IMAGE_WIDTH = int(device_config.get('InputTensorWidth'))
     
     # 确定实际硬件配置 - 程序运行期间不会改变
-    sensor_num_actual_str = config.get("SensorNum", "dual")
+    sensor_num_actual_str = device_config.get("SensorNum", "dual")
     if sensor_num_actual_str == "left":
         cam_in_use_actual = 1  # 仅左摄像头可用
     elif sensor_num_actual_str == "right":
@@ -1691,7 +4036,7 @@ def main():
             logger.error("Failed to map shared memory for cam1")
             cam1_image_shm.close_fd()
             return
-        get_pic_from_socket(cam1_image_shm_ptr, CAM1_ID)
+        get_pic_from_socket(cam1_image_shm_ptr, CAM1_ID, cam_in_use_actual)
         logger.info("Camera1 initialized successfully")
         
     if cam_in_use_actual == 2 or cam_in_use_actual == 3:  # 右摄像头可用 (actual=2 或 actual=3)
@@ -1711,7 +4056,7 @@ def main():
             logger.error("Failed to map shared memory for cam2")
             cam2_image_shm.close_fd()
             return
-        get_pic_from_socket(cam2_image_shm_ptr, CAM2_ID)
+        get_pic_from_socket(cam2_image_shm_ptr, CAM2_ID, cam_in_use_actual)
         logger.info("Camera2 initialized successfully")
 
     # Step 4: 读取用户配置并验证
@@ -1730,6 +4075,67 @@ def main():
             json.dump(local_config, file, indent=4)
         logger.info(f"TotalImageBlocks saved to config.json: {max_image_blocks}")
 
+    # 调试用：是否把中间图像写入 ./tmp（默认关闭，全程内存处理）
+    image_debug_dump = bool(local_config.get("ImageDebugDump", False))
+    if image_debug_dump:
+        logger.info(f"Image debug dump enabled, writing to {IMAGE_DEBUG_DUMP_DIR}")
+
+    # 帧变化检测阈值（小格平均绝对差，负数表示每次都重新编码）及复用图像块的最长时间
+    try:
+        image_change_threshold = float(local_config.get("ImageChangeThreshold", image_change_threshold))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid ImageChangeThreshold: {local_config.get('ImageChangeThreshold')}, using {image_change_threshold}")
+    try:
+        image_change_max_age = float(local_config.get("ImageChangeMaxAge", image_change_max_age))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid ImageChangeMaxAge: {local_config.get('ImageChangeMaxAge')}, using {image_change_max_age}")
+    logger.info(f"Image change threshold set to: {image_change_threshold}, max age: {image_change_max_age}s")
+
+    # 图像编码后端（jpeg / jpeg_progressive / webp / gray / auto）及JPEG色度抽样
+    if not set_image_codec(local_config.get("ImageCodec", image_codec),
+                           local_config.get("ImageSubsampling", image_chroma_subsampling)):
+        logger.warning(f"Invalid ImageCodec/ImageSubsampling in config.json, using {image_codec} ({image_chroma_subsampling})")
+
+    # ROI模式：只编码计数线/区域并集加边距的区域
+    image_roi_enabled = bool(local_config.get("ImageROI", False))
+    try:
+        image_roi_margin = max(0, int(local_config.get("ImageROIMargin", image_roi_margin)))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid ImageROIMargin: {local_config.get('ImageROIMargin')}, using {image_roi_margin}")
+    logger.info(f"Image ROI mode: {int(image_roi_enabled)}, margin: {image_roi_margin}")
+
+    # 增量图像的图块变化阈值
+    try:
+        delta_tile_threshold = float(local_config.get("DeltaTileThreshold", delta_tile_threshold))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid DeltaTileThreshold: {local_config.get('DeltaTileThreshold')}, using {delta_tile_threshold}")
+
+    # 后台编码周期（秒），0 表示在 ?OBdata 时同步编码
+    try:
+        image_encode_interval = max(0.0, float(local_config.get("ImageEncodeInterval", image_encode_interval)))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid ImageEncodeInterval: {local_config.get('ImageEncodeInterval')}, using {image_encode_interval}")
+
+    # 非默认波特率下的空闲恢复时间（秒），主机重启后可用默认波特率重新连接
+    try:
+        baud_idle_revert = max(0, int(local_config.get("BaudIdleRevert", baud_idle_revert)))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid BaudIdleRevert: {local_config.get('BaudIdleRevert')}, using {baud_idle_revert}")
+
+    # WiFi/LTE 状态缓存的刷新周期和最长使用时间（秒）
+    try:
+        hardware_status_refresh = max(0.0, float(local_config.get("HardwareStatusRefresh", hardware_status_refresh)))
+        hardware_status_max_age = max(0.0, float(local_config.get("HardwareStatusMaxAge", hardware_status_max_age)))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid HardwareStatusRefresh/HardwareStatusMaxAge in config.json, using {hardware_status_refresh}/{hardware_status_max_age}")
+
+    # 摄像头参数缓存的刷新周期和过期时间（秒）
+    try:
+        camera_param_refresh = max(0.0, float(local_config.get("CameraParamRefresh", camera_param_refresh)))
+        camera_param_max_age = max(0.0, float(local_config.get("CameraParamMaxAge", camera_param_max_age)))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid CameraParamRefresh/CameraParamMaxAge in config.json, using {camera_param_refresh}/{camera_param_max_age}")
+
     sensor_num_config = local_config.get("cam_in_use", "dual")
     
     if sensor_num_config in ["1", "left"]:
@@ -1759,503 +4165,54 @@ def main():
             json.dump(local_config, file, indent=4)
 
     # Step 5: 初始化图像
-    update_sim_attribute(cam_in_use)
-
-    # Step 6: UART命令处理主循环
-    while True:
-        raw_data = uart.receive_serial()
-        if raw_data:
-            start_time = time.time()
-            string = raw_data.decode("utf_8", "ignore").rstrip()
-            logger.debug(f"UART recv <-: {string}")
-
-            # Try to parse as JSON command (for file transfer)
-            try:
-                json_cmd = json.loads(string)
-                if isinstance(json_cmd, dict) and "cmd" in json_cmd:
-                    # Handle JSON format command
-                    handle_json_command(uart, json_cmd)
-                    logger.debug(f"--- {time.time() - start_time} seconds ---")
-                    continue
-            except json.JSONDecodeError:
-                pass  # Not JSON, continue with original command parsing
-
-            # Original command handling
-            if string == "?Asset":
-                asset_data = {
-                    "MfrName": config["MfrName"],
-                    "ModelNumber": config["ModelNumber"],
-                    "SerialNumber": config["SerialNumber"],
-                    "MfgDate": config["MfgDate"],
-                    "FWVersion": config["FWVersion"],
-                    "HWVersion": config["HWVersion"],
-                    "AppNumber": config["AppNumber"]
-                }
-                response = json.dumps(asset_data)
-                uart.send_serial(response)
-            elif string[:2] == "@|":
-                if string[2:]:
-                    count_interval = str(string[2:])
-                response = json.dumps({"NICFrequency": int(count_interval)})
-                uart.send_serial(response)
-            elif string == "?Order":
-                response = json.dumps(config["Order"])
-                uart.send_serial(response)
-            elif string[:8] == "Profile|":
-                if string[8:] and int(string[8:]) in [1, 2, 3]:
-                    requested_profile = int(string[8:])
-                    
-                    # 验证请求的配置是否被硬件支持
-                    if validate_cam_in_use(requested_profile, cam_in_use_actual):
-                        profile_index = requested_profile
-                        cam_in_use = requested_profile
-                        
-                        # 更新config.json
-                        local_config = load_config("config.json")
-                        config_mapping = {1: "left", 2: "right", 3: "dual"}
-                        local_config["cam_in_use"] = config_mapping[requested_profile]
-                        with open("config.json", "w", encoding="utf-8") as file:
-                            json.dump(local_config, file, indent=4)
-                        
-                        logger.info(f"Profile changed to {requested_profile}")
-                    else:
-                        logger.warning(f"Profile {requested_profile} not supported by hardware {cam_in_use_actual}")
-                        
-                response = json.dumps({"CamProfile": int(profile_index)})
-                uart.send_serial(response)
-
-            elif string[:5] == "WiFi|":
-                #这段是原来的wifi控制
-                # if get_wifi_status() == 'enabled':
-                #     wifi_cur_config = 1
-                # else:
-                #     wifi_cur_config = 0
-                # if string[5:] and int(string[5:]) in [0, 1]:
-                #     wifi_status = str(string[5:])
-                #     if wifi_cur_config != int(wifi_status):
-                #         if int(wifi_status) == 1:
-                #             subprocess.run(['nmcli', 'radio', 'wifi', 'on'])
-                #         else:
-                #             subprocess.run(['nmcli', 'radio', 'wifi', 'off'])
-                # 这段是对接sdk的wifi控制，暂时不使用，因为处理速度太慢
-                wifi_cur_config = 0
-                if get_wifi_status_from_sdk() == 'enabled':
-                    wifi_cur_config = 1
-                if string[5:] and int(string[5:]) in [0, 1]:
-                    wifi_status = str(string[5:])
-                    if wifi_cur_config != int(wifi_status):
-                        if int(wifi_status) == 1:
-                            set_wifi_status_via_sdk(True)
-                        else:
-                            set_wifi_status_via_sdk(False)
-                else:
-                    wifi_status = wifi_cur_config
-                response = json.dumps({"WiFiEnable": int(wifi_status)})
-                uart.send_serial(response)
-
-            elif string[:5] == "CELL|":
-                # LTE硬件控制
-                # 获取当前LTE状态
-                lte_cur_config = 0
-                lte_status_str = get_lte_status_from_sdk()
-                if lte_status_str == 'enabled':
-                    lte_cur_config = 1
-
-                # 处理设置命令
-                if string[5:] and int(string[5:]) in [0, 1]:
-                    lte_target_status = str(string[5:])
-                    if lte_cur_config != int(lte_target_status):
-                        if int(lte_target_status) == 1:
-                            set_lte_status_via_sdk(True)
-                        else:
-                            set_lte_status_via_sdk(False)
-                else:
-                    lte_target_status = lte_cur_config
+    refresh_image_blocks(cam_in_use)
+    pin_image_blocks()
 
-                response = json.dumps({"CellularEnable": int(lte_target_status)})
-                uart.send_serial(response)
-
-            # elif string[:5] == "WFPW|":
-            #     # 解析base64编码的密码
-            #     try:
-            #         if string[5:]:
-            #             # Base64解码密码
-            #             encoded_password = string[5:]
-            #             try:
-            #                 new_password = base64.b64decode(encoded_password).decode('utf-8')
-            #             except Exception as e:
-            #                 logger.error(f"Failed to decode password: {e}")
-            #                 response = json.dumps({"Password": "error", "reason": "invalid_base64"})
-            #                 uart.send_serial(response)
-            #                 continue
-
-            #             # 验证密码合法性（WiFi密码要求8-63个字符）
-            #             if len(new_password) < 8 or len(new_password) > 63:
-            #                 logger.error(f"Invalid password length: {len(new_password)}")
-            #                 response = json.dumps({"Password": "error", "reason": "invalid_length"})
-            #                 uart.send_serial(response)
-            #                 continue
-
-            #             # 读取配置文件
-            #             try:
-            #                 gs501_config = load_config(CONFIG_PATH)
-            #             except Exception as e:
-            #                 logger.error(f"Failed to read config: {e}")
-            #                 response = json.dumps({"Password": "error", "reason": "config_read_failed"})
-            #                 uart.send_serial(response)
-            #                 continue
-
-            #             # 修改AP_PASSWORD字段
-            #             old_password = gs501_config.get("AP_PASSWORD", "")
-            #             gs501_config["AP_PASSWORD"] = new_password
-
-            #             # 保存配置文件
-            #             if save_config(CONFIG_PATH, gs501_config):
-            #                 # 返回base64编码的新密码作为确认
-            #                 encoded_response = base64.b64encode(new_password.encode('utf-8')).decode('utf-8')
-            #                 response = json.dumps({"Password": encoded_response})
-            #                 uart.send_serial(response)
-
-            #                 logger.info(f"WiFi password updated successfully (length: {len(new_password)})")
-            #                 # 注意：不记录明文密码到日志
-
-            #                 # 触发kill_main_processes重启相关进程
-            #                 logger.info("Triggering process restart after password change...")
-            #                 kill_success = kill_main_processes()
-            #                 if kill_success:
-            #                     logger.info("Main processes killed successfully after password update")
-            #                 else:
-            #                     logger.warning("No main processes found to kill after password update")
-            #             else:
-            #                 # 配置保存失败
-            #                 response = json.dumps({"Password": "error", "reason": "config_save_failed"})
-            #                 uart.send_serial(response)
-            #                 logger.error("Failed to save WiFi password configuration")
-            #         else:
-            #             # 没有提供密码
-            #             response = json.dumps({"Password": "error", "reason": "no_password"})
-            #             uart.send_serial(response)
-
-            #     except Exception as e:
-            #         logger.error(f"Error processing WFPW command: {e}")
-            #         response = json.dumps({"Password": "error", "reason": str(e)})
-            #         uart.send_serial(response)
-            elif string == "?ERR":
-                cam1_error_code = check_camera_errors(CAMERA1_DIAGNOSE_INFO_PATH)
-                cam2_error_code = check_camera_errors(CAMERA2_DIAGNOSE_INFO_PATH)
-                response = json.dumps({"Cam1ErrCode": cam1_error_code,"Cam2ErrCode": cam2_error_code})
-                uart.send_serial(response)
-            elif string[:6] == "REACT|":
-                # Just return current emer_mode, no modification
-                response = json.dumps({"EmergencyMode": int(emer_mode)})
-                uart.send_serial(response)
-            elif string == "?OBdata":
-                # If emer_mode == 1, skip image save and update_sim_attribute
-                if emer_mode == 1:
-                    logger.warning("emer_mode==1, skip image save and update_sim_attribute on ?OBdata")
-                else:
-                    # save image to str_image, wait str
-                    if cam_in_use == 1 or cam_in_use == 3:
-                        get_pic_from_socket(cam1_image_shm_ptr, CAM1_ID)
-                    if cam_in_use == 2 or cam_in_use == 3:
-                        get_pic_from_socket(cam2_image_shm_ptr, CAM2_ID)
-                    update_sim_attribute(cam_in_use)
-                
-                # 获取交通类别信息
-                left_traffic_data = {}
-                right_traffic_data = {}
-                
-                # 获取左摄像头交通类别信息
-                if cam_in_use == 1 or cam_in_use == 3:
-                    # 选择左摄像头的socket
-                    cam_info_socket = 'cam1_info_sock'
-                    # 发送JSON格式的请求获取交通类别信息
-                    # traffic_request = {"cmd": "traffic_category"}
-                    traffic_request = {"cmd": "drawing"}
-                    traffic_request_json = json.dumps(traffic_request)
-                    send_data(cam_info_socket, traffic_request_json.encode('utf-8'))
-                    response = receive_data(cam_info_socket, 4096)
-                    if response:
-                        try:
-                            # 检查响应是否为有效的JSON
-                            left_traffic_data = json.loads(response.decode('utf-8'))
-                            # logger.info(f"Left camera traffic category data: {left_traffic_data}")
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Failed to decode left traffic category response: {e}")
-                        except Exception as e:
-                            logger.error(f"Error processing left traffic category response: {e}")
-                
-                # 获取右摄像头交通类别信息
-                if cam_in_use == 2 or cam_in_use == 3:
-                    # 选择右摄像头的socket
-                    cam_info_socket = 'cam2_info_sock'
-                    # 发送JSON格式的请求获取交通类别信息
-                    # traffic_request = {"cmd": "traffic_category"}
-                    traffic_request = {"cmd": "drawing"}
-                    traffic_request_json = json.dumps(traffic_request)
-                    send_data(cam_info_socket, traffic_request_json.encode('utf-8'))
-                    response = receive_data(cam_info_socket, 4096)
-                    if response:
-                        try:
-                            # 检查响应是否为有效的JSON
-                            right_traffic_data = json.loads(response.decode('utf-8'))
-                            # logger.info(f"Right camera traffic category data: {right_traffic_data}")
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Failed to decode right traffic category response: {e}")
-                        except Exception as e:
-                            logger.error(f"Error processing right traffic category response: {e}")
-                
-                # Get counting data from CDS - returns separate left and right data
-                left_counting_data, right_counting_data = get_cds_counting_data()
-                
-                # Process left camera data (cam1)
-                if cam_in_use == 1 or cam_in_use == 3:
-                    # 根据交通类别信息创建基础uart_data
-                    if left_traffic_data:
-                        base_uart_data = create_uart_data_from_traffic_categories(left_traffic_data)
-                    else:
-                        base_uart_data = dnn_default_dirct.copy()
-                    if left_counting_data:
-                        # Process cumulative data to get period counts for left camera
-                        left_period_data = process_cumulative_counting(left_counting_data, "left")
-                        # Get speed averages for left camera
-                        left_speed_averages = get_speed_data_for_uart("left")
-                        # Reformat for UART with speed integration using base data
-                        uart_data = reformat_counting_for_uart(left_period_data, left_speed_averages, base_uart_data)
-                    else:
-                        # 如果没有计数数据，使用基础数据
-                        uart_data = base_uart_data
-                    
-                    response = json.dumps(uart_data)
-                    uart.send_serial(response)
-                
-                # Process right camera data (cam2)
-                if cam_in_use == 2 or cam_in_use == 3:
-                    # 根据交通类别信息创建基础uart_data
-                    if right_traffic_data:
-                        base_uart_data = create_uart_data_from_traffic_categories(right_traffic_data)
-                    else:
-                        base_uart_data = dnn_default_dirct.copy()
-                    
-                    if right_counting_data:
-                        # Process cumulative data to get period counts for right camera
-                        right_period_data = process_cumulative_counting(right_counting_data, "right")
-                        # Get speed averages for right camera
-                        right_speed_averages = get_speed_data_for_uart("right")
-                        # Reformat for UART with speed integration using base data
-                        uart_data = reformat_counting_for_uart(right_period_data, right_speed_averages, base_uart_data)
-                    else:
-                        # 如果没有计数数据，使用基础数据
-                        uart_data = base_uart_data
-                    
-                    response = json.dumps(uart_data)
-                    uart.send_serial(response)
-                
-                # Reset speed data for next cycle
-                reset_speed_data()
+    if image_encode_interval > 0:
+        encoder_thread = Thread(target=image_encoder_thread)
+        encoder_thread.daemon = True
+        encoder_thread.start()
+    else:
+        logger.info("Background image encoder disabled, encoding on ?OBdata")
 
-            elif string[:4] == "BLK|":
-                # 处理BLK|xxx命令，设置最大图像块数量
-                try:
-                    if string[4:]:
-                        block_count = int(string[4:])
-                        # 限制在20-80范围内
-                        block_count = max(20, min(80, block_count))
-                        max_image_blocks = block_count
-
-                        # 持久化保存到配置文件
-                        local_config = load_config("config.json")
-                        local_config["TotalImageBlocks"] = block_count
-                        with open("config.json", "w", encoding="utf-8") as file:
-                            json.dump(local_config, file, indent=4)
-
-                        logger.info(f"Max image blocks set to: {block_count}")
-                        response = json.dumps({"TotalImageBlocks": str(block_count)})
-                    else:
-                        # 如果没有参数，返回当前设置
-                        response = json.dumps({"TotalImageBlocks": str(max_image_blocks)})
-                except ValueError:
-                    # 参数不是有效数字
-                    logger.error(f"Invalid BLK parameter: {string[4:]}")
-                    response = json.dumps({"TotalImageBlocks": str(max_image_blocks), "Error": "Invalid parameter"})
-                uart.send_serial(response)
+    if hardware_status_refresh > 0:
+        hardware_thread = Thread(target=hardware_status_thread, name="hardware_status")
+        hardware_thread.daemon = True
+        hardware_thread.start()
+    else:
+        logger.info("Hardware status cache disabled, querying SDK on WiFi|/CELL|")
 
-            elif string[:5] == "WFPW|":
-                try:
-                    param = string[5:].strip()
-
-                    if not param:
-                        # 查询模式 - 从 gs501.json 读取
-                        try:
-                            gs501_config = load_config(CONFIG_PATH)
-                            current_password = gs501_config.get("AP_PASSWORD", "")
-                            if current_password:
-                                encoded_pwd = base64.b64encode(current_password.encode('utf-8')).decode('utf-8')
-                                response = json.dumps({"Password": encoded_pwd})
-                            else:
-                                response = json.dumps({"Password": ""})
-                        except Exception as e:
-                            logger.error(f"Query password failed: {e}")
-                            response = json.dumps({"Password": ""})
-                        uart.send_serial(response)
-                    else:
-                        # 设置模式
-                        try:
-                            # Base64 解码
-                            new_password = base64.b64decode(param).decode('utf-8')
-
-                            # 密码验证
-                            if len(new_password) < 8:
-                                response = json.dumps({"Password": ""})
-                                uart.send_serial(response)
-                                continue
-                            if len(new_password) > 63:
-                                response = json.dumps({"Password": ""})
-                                uart.send_serial(response)
-                                continue
-
-                            # 调用 SDK
-                            request = {
-                                "cmd": "set_wifi_password_req",
-                                "password": new_password
-                            }
-                            sdk_response = send_json_request(request)
-
-                            # 处理响应
-                            if sdk_response and sdk_response.get("cmd") == "set_wifi_password_rsp":
-                                if sdk_response.get("ret_code") == 0:
-                                    encoded_pwd = base64.b64encode(new_password.encode('utf-8')).decode('utf-8')
-                                    response = json.dumps({"Password": encoded_pwd})
-                                    logger.info("WiFi password updated successfully")
-                                else:
-                                    response = json.dumps({"Password": ""})
-                            else:
-                                response = json.dumps({"Password": ""})
-                            uart.send_serial(response)
-
-                        except base64.binascii.Error:
-                            response = json.dumps({"Password": ""})
-                            uart.send_serial(response)
-                        except UnicodeDecodeError:
-                            response = json.dumps({"Password": ""})
-                            uart.send_serial(response)
-                except Exception as e:
-                    logger.error(f"WFPW error: {e}")
-                    response = json.dumps({"Password": ""})
-                    uart.send_serial(response)
+    if camera_param_refresh > 0:
+        camera_thread = Thread(target=camera_param_thread, name="camera_params")
+        camera_thread.daemon = True
+        camera_thread.start()
+    else:
+        logger.info("Camera param cache disabled, querying SDK on ?PS1/?PS2")
 
-            elif string == "?RST":
-                # 返回响应
-                response = json.dumps({"CamReset": 1})
-                uart.send_serial(response)
+    # Step 6: UART命令处理主循环
+    last_command_time = time.time()
+    while True:
+        frame_type, raw_data = uart.receive_frame(UART_RX_IDLE_WAIT)
+        if not raw_data and (uart.baudrate != UART_DEFAULT_BAUDRATE or uart.binary_mode or uart.compression) \
+                and baud_idle_revert > 0 and time.time() - last_command_time > baud_idle_revert:
+            logger.warning(f"No command for {baud_idle_revert}s, reverting to {UART_DEFAULT_BAUDRATE} baud uncompressed line mode")
+            uart.compression = None
+            uart.set_binary_mode(False)
+            uart.set_baudrate(UART_DEFAULT_BAUDRATE)
+        if raw_data:
+            last_command_time = time.time()
 
-                # 杀掉./main进程
-                kill_success = kill_main_processes()
-                if kill_success:
-                    logger.info("RST command completed successfully")
-                else:
-                    logger.warning("RST command completed but no processes were killed")
-
-            elif string[:3] == "?PS":
-                index = int(string[3:])
-                if index in [1, 2]:
-                    # 处理PS1和PS2命令
-                    if (index == 1 and (cam_in_use == 1 or cam_in_use == 3)) or (index == 2 and (cam_in_use == 2 or cam_in_use == 3)):
-                        # 选择正确的socket
-                        if index == 1:
-                            cam_info_socket = 'cam1_info_sock'
-                        else:  # index == 2
-                            cam_info_socket = 'cam2_info_sock'
-                        
-                        # 使用SDK获取摄像头参数
-                        camera_id = CAM1_ID if index == 1 else CAM2_ID
-                        camera_param_response = sdk_get_camera_param(camera_id)
-                        if camera_param_response:
-                            gain = camera_param_response.get("gain", 0)
-                            exposure = camera_param_response.get("exposure", 0)
-                            ae_mode = camera_param_response.get("ae_mode", "auto")
-                            framerate = camera_param_response.get("framerate", 30)
-                            
-                            ps_data = {
-                                "CameraFPS": str(framerate),  # 使用SDK返回的帧率
-                                "ImageSize": f"{config['InputTensorWidth']}*{config['InputTensorHeith']}",
-                                "PixelDepth": config["PixelDepth"],
-                                "PixelOrder": config["PixelOrder"],
-                                "DNNModel": config["DNNModel"],
-                                "PostProcessingLogic": config["PostProcessingLogic"],
-                                "SendImageQuality": config["SendImageQuality"],
-                                "SendImageSizePercent": config["SendImageSizePercent"],
-                                "AEModel": ae_mode,  # 直接使用SDK返回的字符串
-                                "Exposure": str(exposure),
-                                "Gain": str(gain),
-                                "Heating": config["Heating"],
-                                "Time": datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-                            }
-                            response = json.dumps(ps_data)
-                        else:
-                            response = json.dumps({}) # 如果SDK获取失败，发送空字典
-                    else:
-                        # 不符合条件时发送空字典
-                        response = json.dumps({})
-                    uart.send_serial(response)
-                elif index in [3, 4]:
-                    # 处理PS3和PS4命令
-                    if (index == 3 and (cam_in_use == 1 or cam_in_use == 3)) or (index == 4 and (cam_in_use == 2 or cam_in_use == 3)):
-                        # 选择正确的socket
-                        if index == 3:
-                            cam_info_socket = 'cam1_info_sock'
-                        else:  # index == 4
-                            cam_info_socket = 'cam2_info_sock'
-                        # 发送JSON格式的drawing命令
-                        roi_request = {"cmd": "drawing"}
-                        roi_request_json = json.dumps(roi_request)
-                        send_data(cam_info_socket, roi_request_json.encode('utf-8'))
-                        response = receive_data(cam_info_socket, 4096)
-                        # 解析响应，只提取coordinates部分传给处理函数
-                        if response:
-                            try:
-                                json_response = json.loads(response.decode('utf-8'))
-                                coordinates_data = json_response.get('coordinates', {})
-                                # 将coordinates数据编码为bytes传给处理函数
-                                coordinates_bytes = json.dumps(coordinates_data).encode('utf-8')
-                                response = process_coordinates_response(coordinates_bytes)
-                            except Exception as e:
-                                logger.error(f"Error extracting coordinates: {e}")
-                                response = json.dumps({})
-                        else:
-                            response = json.dumps({})
-                    else:
-                        # 不符合条件时发送空字典
-                        response = json.dumps({})
-                    uart.send_serial(response)
-                elif index >= 5 and index < (5 + 80):  # 从index=5开始处理图像块，上限固定为最大支持值80
-                    block_index = index - 5  # 计算实际的数组索引
-
-                    if block_index < len(str_image):
-                        # 发送实际存在的图像块
-                        if block_index == 0 and emer_mode == 1:
-                            emer_imgage_send = 1
-                        response = "{\"Block" + str(block_index + 1) + "\":\"" + str_image[block_index] + "\"}"
-                        uart.send_serial(response)
-
-                        # 检查是否发送完最后一块
-                        if block_index == len(str_image) - 1 and emer_imgage_send == 1:
-                            emer_imgage_send = 0
-                            emer_mode = 0
-                            logger.debug(f"Emergency mode image sending completed at block {block_index + 1}")
-                    else:
-                        # 超出实际图像块范围但在最大范围内，返回空包
-                        response = "{\"Block" + str(block_index + 1) + "\":\"\"}"
-                        uart.send_serial(response)
-                        # 如果在紧急模式下到达最大索引，结束紧急模式
-                        if index == (4 + max_image_blocks) and emer_imgage_send == 1:
-                            emer_imgage_send = 0
-                            emer_mode = 0
-                            logger.debug(f"Emergency mode ended at index {index}, actual blocks: {len(str_image)}")
-                else:
-                    logger.error(f"Unexpected PS index: ?PS{index}")
+            # 二进制模式下的非文本帧
+            if frame_type == FRAME_TYPE_FILE_BLOCK:
+                run_command(uart, "FILE_BLOCK", handle_file_block_frame, raw_data, len(raw_data))
+                continue
+            elif frame_type != FRAME_TYPE_TEXT:
+                logger.warning(f"Unexpected frame type from host: {frame_type}")
+                continue
 
-            logger.debug(f"--- {time.time() - start_time} seconds ---")
+            string = raw_data.decode("utf_8", "ignore").rstrip()
+            logger.debug(f"UART recv <-: {string}")
+            dispatch_command(uart, string, len(raw_data))
 
 def signal_handler(sig, frame):
     """信号处理函数，用于优雅地关闭程序"""
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+UART Pseudo-Terminal Harness
+Runs uart_control.py against a pty pair instead of /dev/ttymxc2 (the device opens the
+slave side through UART_CONTROL_PORT) and drives the master side with a load generator.
+The generator replays the rev_uart.py command mix, or a custom mix, at a target rate,
+optionally paced to the byte rate of a real baud rate, and reports throughput and
+latency percentiles per command.
+
+Usage:
+    python uart_harness.py [--mix rev_uart] [--rate 5] [--duration 60] [--baud 38400]
+
+Example:
+    python uart_harness.py --baud 38400 --duration 120 --save harness_result.json
+    python uart_harness.py --mix "?OBdata=1,?PSR|=1,?Asset=2" --rate 2 --baud 115200
+    python uart_harness.py --device "./uart_control" --mix commands.txt
+    python uart_harness.py --backend --sdk-latency 0.05 --duration 60
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import tty
+
+# rev_uart.py 一轮测试发送的命令，最后用 ?PSR| 取完整图像
+REV_UART_MIX = [
+    "?Asset", "@|600", "@|", "?Order", "Profile|", "WiFi|1", "WiFi|", "WFPW|", "?ERR",
+    "REACT|", "BLK|", "?OBdata", "?PS1", "?PS2", "?PS3", "?PS4", "BLK|", "?PSR|"
+]
+# 多行应答的结束行，其余命令收到第一行后再等 --gap 秒没有数据即视为应答完成
+RESPONSE_TERMINATORS = {"?PSR|": b'{"BlockRange"'}
+READY_TIMEOUT = 60  # 等待设备启动应答 ?Asset 的时间(秒)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    """p50/p95/p99/mean of a list of latencies in milliseconds"""
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0
+    }
+
+
+def command_label(command):
+    """Group commands the way uart_control counts them: ?PS5+ together, parameters dropped"""
+    match = re.fullmatch(r"\?PS(\d+)", command)
+    if match:
+        return "?PS5+" if int(match.group(1)) >= 5 else command
+    if "|" in command:
+        return command[:command.index("|") + 1]
+    return command
+
+
+def parse_mix(text):
+    """
+    'rev_uart' -> the rev_uart.py sequence, replayed in order
+    'cmd=weight,...' -> weighted random choice
+    a file name -> one command per line, replayed in order
+    Returns (commands, weights); weights is None for an ordered replay.
+    """
+    if text == "rev_uart":
+        return REV_UART_MIX, None
+    if os.path.isfile(text):
+        with open(text, "r", encoding="utf-8") as file:
+            commands = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+        return commands, None
+    commands, weights = [], []
+    for item in text.split(","):
+        command, _, weight = item.rpartition("=")
+        if not command:
+            command, weight = weight, "1"
+        commands.append(command)
+        weights.append(float(weight))
+    return commands, weights
+
+
+class PacedLink:
+    """
+    Host side of the pty. Writes and reads are paced to the byte rate of the emulated
+    baud rate (10 bits per byte); baudrate 0 means no limit.
+    """
+
+    def __init__(self, fd, baudrate):
+        self.fd = fd
+        self.byte_time = 10.0 / baudrate if baudrate else 0.0
+        self.tx_free = 0.0
+        self.rx_free = 0.0
+        self.lines = []  # (到达时间, 行)
+        self.partial = bytearray()
+        self.cond = threading.Condition()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.closed = False
+        threading.Thread(target=self.reader, daemon=True).start()
+
+    def write(self, data):
+        if self.byte_time:
+            self.tx_free = max(self.tx_free, time.perf_counter()) + len(data) * self.byte_time
+        os.write(self.fd, data)
+        self.bytes_out += len(data)
+        if self.byte_time:
+            # 按模拟波特率发送完毕的时间
+            delay = self.tx_free - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def reader(self):
+        while True:
+            try:
+                chunk = os.read(self.fd, 4096)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                with self.cond:
+                    self.closed = True
+                    self.cond.notify_all()
+                return
+            if self.byte_time:
+                self.rx_free = max(self.rx_free, time.perf_counter()) + len(chunk) * self.byte_time
+                delay = self.rx_free - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.perf_counter()
+            with self.cond:
+                self.bytes_in += len(chunk)
+                self.partial += chunk
+                while b"\n" in self.partial:
+                    line, _, rest = bytes(self.partial).partition(b"\n")
+                    self.partial = bytearray(rest)
+                    self.lines.append((now, line.rstrip(b"\r")))
+                self.cond.notify_all()
+
+    def next_line(self, timeout):
+        """Return (arrival, line) or (None, None) after timeout seconds"""
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while not self.lines:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.closed:
+                    return None, None
+                self.cond.wait(remaining)
+            return self.lines.pop(0)
+
+    def drain(self):
+        with self.cond:
+            self.lines.clear()
+            self.partial.clear()
+
+
+def run_command(link, command, timeout, gap):
+    """Send one command and collect its response. Returns (first_ms, total_ms, lines, bytes) or None on timeout"""
+    link.drain()
+    start = time.perf_counter()
+    link.write(command.encode("utf_8") + b"\n")
+    terminator = RESPONSE_TERMINATORS.get(command_label(command))
+    first = last = None
+    lines = size = 0
+    wait = timeout
+    while True:
+        arrival, line = link.next_line(wait)
+        if line is None:
+            break
+        if first is None:
+            first = arrival
+        last = arrival
+        lines += 1
+        size += len(line) + 1
+        if terminator is not None:
+            if line.startswith(terminator):
+                break
+        else:
+            wait = gap
+    if first is None:
+        return None
+    return (first - start) * 1000, (last - start) * 1000, lines, size
+
+
+def query_json(link, command, timeout):
+    """Send a command and parse its first response line as JSON, None on timeout or bad JSON"""
+    link.drain()
+    link.write(command.encode("utf_8") + b"\n")
+    _, line = link.next_line(timeout)
+    try:
+        return json.loads(line)
+    except (TypeError, ValueError):
+        return None
+
+
+def wait_ready(link, process):
+    print("Waiting for uart_control to answer ?Asset...")
+    deadline = time.time() + READY_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uart_control exited with code {process.returncode}")
+        if run_command(link, "?Asset", 1.0, 0.05):
+            return
+    raise RuntimeError(f"uart_control did not answer within {READY_TIMEOUT} seconds")
+
+
+def run_load(link, commands, weights, rate, duration, count, timeout, gap):
+    """Closed-loop load: the next command is sent at its scheduled time or when the previous response completes"""
+    results = {}
+    interval = 1.0 / rate if rate else 0.0
+    start = time.perf_counter()
+    next_send = start
+    sent = 0
+    while (not duration or time.perf_counter() - start < duration) and (not count or sent < count):
+        if weights:
+            command = random.choices(commands, weights)[0]
+        else:
+            command = commands[sent % len(commands)]
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        next_send = max(next_send + interval, time.perf_counter())
+
+        result = run_command(link, command, timeout, gap)
+        stats = results.setdefault(command_label(command), {"count": 0, "timeouts": 0, "first_ms": [], "total_ms": [],
+                                                            "lines": 0, "bytes_in": 0, "bytes_out": 0})
+        stats["count"] += 1
+        stats["bytes_out"] += len(command) + 1
+        if result is None:
+            stats["timeouts"] += 1
+        else:
+            first_ms, total_ms, lines, size = result
+            stats["first_ms"].append(first_ms)
+            stats["total_ms"].append(total_ms)
+            stats["lines"] += lines
+            stats["bytes_in"] += size
+        sent += 1
+    return results, time.perf_counter() - start
+
+
+def build_report(results, elapsed, baudrate):
+    commands = {}
+    total_in = total_out = total_count = 0
+    for label, stats in sorted(results.items(), key=lambda item: item[1]["bytes_in"], reverse=True):
+        commands[label] = {
+            "count": stats["count"],
+            "timeouts": stats["timeouts"],
+            "first_ms": summarize(stats["first_ms"]),
+            "total_ms": summarize(stats["total_ms"]),
+            "lines": stats["lines"],
+            "bytes_in": stats["bytes_in"],
+            "bytes_out": stats["bytes_out"]
+        }
+        total_in += stats["bytes_in"]
+        total_out += stats["bytes_out"]
+        total_count += stats["count"]
+    report = {
+        "elapsed": round(elapsed, 2),
+        "commands_per_sec": round(total_count / elapsed, 2) if elapsed else 0.0,
+        "bytes_in_per_sec": round(total_in / elapsed, 1) if elapsed else 0.0,
+        "bytes_out_per_sec": round(total_out / elapsed, 1) if elapsed else 0.0,
+        "commands": commands
+    }
+    if baudrate and elapsed:
+        report["link_utilization"] = round(total_in * 10 / baudrate / elapsed, 3)
+    return report
+
+
+def print_report(report):
+    print(f"\n{'=' * 100}")
+    print(f"Elapsed: {report['elapsed']}s, {report['commands_per_sec']} cmd/s, "
+          f"in {report['bytes_in_per_sec']} B/s, out {report['bytes_out_per_sec']} B/s"
+          + (f", link utilization {report['link_utilization'] * 100:.1f}%" if "link_utilization" in report else ""))
+    print(f"{'=' * 100}")
+    print(f"{'command':<12} {'count':>6} {'t/o':>4} {'first p50':>10} {'first p95':>10} "
+          f"{'total p50':>10} {'total p95':>10} {'total p99':>10} {'bytes in':>10}")
+    for label, stats in report["commands"].items():
+        print(f"{label:<12} {stats['count']:>6} {stats['timeouts']:>4} {stats['first_ms']['p50']:>10.1f} "
+              f"{stats['first_ms']['p95']:>10.1f} {stats['total_ms']['p50']:>10.1f} {stats['total_ms']['p95']:>10.1f} "
+              f"{stats['total_ms']['p99']:>10.1f} {stats['bytes_in']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run uart_control against a pseudo-terminal and benchmark it with a command mix",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Mix formats:
+  rev_uart                  the rev_uart.py command sequence (default), replayed in order
+  "?OBdata=1,?PS5=20"       weighted random choice
+  commands.txt              one command per line, replayed in order
+
+Examples:
+  python uart_harness.py --baud 38400 --duration 120
+  python uart_harness.py --mix "?OBdata=1,?PSR|=1" --rate 1 --save harness_result.json
+  python uart_harness.py --backend --sdk-latency 0.2 --mix "?PS1=1,?OBdata=1"
+        """
+    )
+    parser.add_argument("--device", default=f"{sys.executable} uart_control.py",
+                        help="Command that starts uart_control (default: this python + uart_control.py)")
+    parser.add_argument("--mix", default="rev_uart", help="Command mix (default: rev_uart)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Target commands per second, 0 = as fast as possible (default: 5)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Test duration in seconds (default: 60)")
+    parser.add_argument("--count", type=int, default=0, help="Stop after this many commands (default: no limit)")
+    parser.add_argument("--baud", type=int, default=0, help="Emulate the byte rate of this baud rate, 0 = pty speed (default: 0)")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Response timeout per command (default: 2.0)")
+    parser.add_argument("--gap", type=float, default=0.05, help="Idle time that ends a multi-line response (default: 0.05)")
+    parser.add_argument("--device-log", default=None, help="Write uart_control stdout/stderr to this file")
+    parser.add_argument("--save", default=None, help="Write the report to this JSON file")
+    parser.add_argument("--backend", action="store_true",
+                        help="Start the fake AglaiaSense backend (fake_backend) in this process")
+    parser.add_argument("--sdk-latency", type=float, default=0.0, help="Fake SDK response latency with --backend (default: 0)")
+    parser.add_argument("--sdk-keepalive", action="store_true", help="Let the fake SDK keep connections open with --backend")
+    parser.add_argument("--gs501", default="/tmp/fake_gs501.json", help="gs501.json written by --backend (default: /tmp/fake_gs501.json)")
+    args = parser.parse_args()
+
+    commands, weights = parse_mix(args.mix)
+    master_fd, slave_fd = os.openpty()
+    tty.setraw(slave_fd)  # 关闭回显，设备打开前主机写入的数据不会被回送
+    port = os.ttyname(slave_fd)
+
+    env = dict(os.environ, UART_CONTROL_PORT=port)
+    backend = None
+    if args.backend:
+        from fake_backend import FakeBackend
+        backend = FakeBackend(args.gs501, sdk_latency=args.sdk_latency, sdk_keep_alive=args.sdk_keepalive)
+        backend.start()
+        env["UART_CONTROL_GS501"] = args.gs501
+    log_file = open(args.device_log, "w") if args.device_log else subprocess.DEVNULL
+    print(f"Starting '{args.device}' on {port}")
+    process = subprocess.Popen(shlex.split(args.device), env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    link = PacedLink(master_fd, args.baud)
+    try:
+        wait_ready(link, process)
+        print(f"Mix: {args.mix} ({len(commands)} commands), rate: {args.rate}/s, baud: {args.baud or 'unlimited'}")
+        results, elapsed = run_load(link, commands, weights, args.rate, args.duration, args.count,
+                                    args.timeout, args.gap)
+        device_stats = query_json(link, "?STATS", args.timeout)
+        device_sdk = query_json(link, "?SDK", args.timeout)
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if backend:
+            backend.stop()
+
+    report = build_report(results, elapsed, args.baud)
+    report["device_stats"] = device_stats
+    report["device_sdk"] = device_sdk
+    if backend:
+        report["backend"] = backend.summary()
+    print_report(report)
+    if device_stats:
+        print(f"\nDevice ?STATS: {json.dumps(device_stats)}")
+    if device_sdk:
+        print(f"Device ?SDK: {json.dumps(device_sdk)}")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+        print(f"Report saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()